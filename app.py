@@ -2,25 +2,67 @@ diff --git a/app.py b/app.py
 index bf85c2e77c3dd41f9a304cb5e131777fbfac5e88..2a7353db828ee980db43cfbc8db804a04d7e071e 100644
 --- a/app.py
 +++ b/app.py
-@@ -1,93 +1,252 @@
+@@ -1,93 +1,1802 @@
 +# -*- coding: utf-8 -*-
  # app.py
  # Streamlit: AI 습관 트래커 (단일 파일)
  # 실행: streamlit run app.py
++# 벤치마크/배치: python app.py <명령> --help
  
  from __future__ import annotations
  
 -import os
++import atexit
++import base64
++import bisect
 +import calendar
++import csv
++import functools
++import hashlib
++import importlib
++import io
  import json
 -import time
 -from dataclasses import dataclass
- from datetime import datetime, timedelta
- from typing import Dict, List, Optional, Tuple
++import os
++import queue
++import sqlite3
++import sys
++import tempfile
++import threading
++import time
++from abc import ABC, abstractmethod
++from collections import OrderedDict, deque
++from concurrent.futures import Future, ThreadPoolExecutor, wait
+-from datetime import datetime, timedelta
++from contextlib import contextmanager
++from datetime import date, datetime, timedelta
+-from typing import Dict, List, Optional, Tuple
++from typing import (
++    TYPE_CHECKING, Any, BinaryIO, Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Sequence, Tuple
++)
++from urllib.parse import parse_qs, urlparse
  
- import pandas as pd
- import requests
++import numpy as np
+-import pandas as pd
+-import requests
  import streamlit as st
++from streamlit import logger as st_logger
++
++if TYPE_CHECKING:
++    # 무거운 의존성과 CLI(벤치마크/점검) 전용 모듈은 처음 쓰는 함수 안에서 import한다 (아래 "지연 import" 참고)
++    import argparse
++
++    import pandas as pd
++    import requests
++
++# `python app.py <명령>`으로 실행하면 UI 대신 CLI 명령을 수행한다
++CLI_MODE = __name__ == "__main__" and not st.runtime.exists() and len(sys.argv) > 1
++if CLI_MODE:
++    # bare 모드 경고(ScriptRunContext 없음 등)는 CLI 출력에 섞이지 않게 숨긴다.
++    # 설정 파일을 먼저 읽혀 두어야 이후 설정 로딩이 로그 레벨을 되돌리지 않는다.
++    st.config.get_option("logger.level")
++    st_logger.set_log_level("error")
  
  
  # -----------------------------
@@ -100,6 +142,14 @@ index bf85c2e77c3dd41f9a304cb5e131777fbfac5e88..2a7353db828ee980db43cfbc8db804a0
 +  height: 10px;
 +  border-radius: 999px;
 +}
++.calendar-year {
++  display: grid;
++  grid-template-columns: repeat(4, minmax(0, 1fr));
++  gap: 12px 18px;
++}
++.calendar-year h5 { margin: 0 0 4px 0; font-size: 13px; color: var(--muted); }
++.calendar.compact { border-spacing: 3px; }
++.calendar.compact td { padding: 4px 0; border-radius: 6px; font-size: 10px; }
 +</style>
 +""",
 +    unsafe_allow_html=True,
@@ -114,8 +164,236 @@ index bf85c2e77c3dd41f9a304cb5e131777fbfac5e88..2a7353db828ee980db43cfbc8db804a0
      openai_api_key = st.text_input("OpenAI API Key", type="password", placeholder="sk-...")
      owm_api_key = st.text_input("OpenWeatherMap API Key", type="password", placeholder="OWM API Key")
      st.caption("키는 브라우저 세션(session_state)에만 사용됩니다. 배포 시 Secrets 사용 권장.")
++    st.subheader("🤖 리포트")
++    stream_report = st.toggle("리포트 스트리밍 출력", value=True, help="토큰이 생성되는 대로 리포트를 표시합니다.")
  
  
++# -----------------------------
++# 계측 (프로세스 전역)
++# -----------------------------
++# 지연 시간 히스토그램 버킷(초): Prometheus 기본 버킷 + 느린 외부 호출용 30초
++LATENCY_BUCKETS_S = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
++# p50/p95/p99는 이름별 최근 샘플로 계산한다
++METRICS_SAMPLE_SIZE = 2048
++# 지정하면 이 경로에 Prometheus 텍스트 형식으로 주기적으로 기록한다 (node_exporter textfile collector용)
++METRICS_TEXTFILE = os.environ.get("HABIT_METRICS_TEXTFILE", "")
++METRICS_TEXTFILE_INTERVAL_S = float(os.environ.get("HABIT_METRICS_TEXTFILE_INTERVAL_S", 15))
++
++
++class Metrics:
++    # 연산 이름별 지연 시간 히스토그램(누적 버킷 + 최근 샘플), 캐시 hit/miss, 업스트림 오류 수.
++    # 캐시가 자체 통계(TTLCache.stats)를 가지면 track_cache로 등록해 내보낼 때 합친다.
++    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS_S, sample_size: int = METRICS_SAMPLE_SIZE) -> None:
++        self.buckets = buckets
++        self.sample_size = sample_size
++        self._counts: Dict[str, List[int]] = {}
++        self._sums: Dict[str, float] = {}
++        self._samples: Dict[str, "deque[float]"] = {}
++        self._errors: Dict[str, int] = {}
++        self._cache_events: Dict[str, Dict[str, int]] = {}
++        self._cache_sources: Dict[str, Callable[[], Dict[str, int]]] = {}
++        self._tokens: Dict[str, Dict[str, int]] = {}
++        self._lock = threading.Lock()
++
++    def observe(self, name: str, seconds: float) -> None:
++        idx = bisect.bisect_left(self.buckets, seconds)
++        with self._lock:
++            counts = self._counts.get(name)
++            if counts is None:
++                counts = self._counts[name] = [0] * (len(self.buckets) + 1)
++                self._sums[name] = 0.0
++                self._samples[name] = deque(maxlen=self.sample_size)
++            counts[idx] += 1
++            self._sums[name] += seconds
++            self._samples[name].append(seconds)
++
++    def error(self, name: str) -> None:
++        with self._lock:
++            self._errors[name] = self._errors.get(name, 0) + 1
++
++    def cache_event(self, cache: str, hit: bool) -> None:
++        with self._lock:
++            events = self._cache_events.setdefault(cache, {"hits": 0, "misses": 0})
++            events["hits" if hit else "misses"] += 1
++
++    def tokens(self, name: str, prompt_tokens: int, completion_tokens: int) -> None:
++        # LLM 호출 1회의 실제 사용량 (API 응답의 usage)
++        with self._lock:
++            totals = self._tokens.setdefault(name, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0})
++            totals["calls"] += 1
++            totals["prompt_tokens"] += prompt_tokens
++            totals["completion_tokens"] += completion_tokens
++
++    def token_stats(self) -> Dict[str, Dict[str, int]]:
++        with self._lock:
++            return {name: dict(totals) for name, totals in self._tokens.items()}
++
++    def track_cache(self, cache: str, stats: Callable[[], Dict[str, int]]) -> None:
++        with self._lock:
++            self._cache_sources[cache] = stats
++
++    def cache_stats(self) -> Dict[str, Dict[str, int]]:
++        # {캐시: {"hits", "misses"}}. stale/대기 합류 응답도 업스트림 호출이 없었으므로 hit로 센다.
++        with self._lock:
++            merged = {cache: dict(events) for cache, events in self._cache_events.items()}
++            sources = dict(self._cache_sources)
++        for cache, stats_fn in sources.items():
++            stats = stats_fn()
++            events = merged.setdefault(cache, {"hits": 0, "misses": 0})
++            events["hits"] += stats.get("hits", 0) + stats.get("stale_hits", 0) + stats.get("coalesced", 0)
++            events["misses"] += stats.get("misses", 0)
++        return merged
++
++    def summary(self) -> List[Dict[str, Any]]:
++        with self._lock:
++            names = sorted(set(self._counts) | set(self._errors))
++            samples = {name: list(self._samples.get(name, ())) for name in names}
++            totals = {name: sum(self._counts.get(name, ())) for name in names}
++            errors = dict(self._errors)
++        return [
++            {"name": name, "count": totals[name], "errors": errors.get(name, 0), **_percentiles(samples[name])}
++            for name in names
++        ]
++
++    def prometheus_text(self, prefix: str = "habit_tracker") -> str:
++        cache_stats = self.cache_stats()
++        with self._lock:
++            counts = {name: list(c) for name, c in self._counts.items()}
++            sums = dict(self._sums)
++            errors = dict(self._errors)
++        lines = [
++            f"# HELP {prefix}_latency_seconds Latency of instrumented operations.",
++            f"# TYPE {prefix}_latency_seconds histogram",
++        ]
++        for name in sorted(counts):
++            cumulative = 0
++            for le, n in zip([*map(str, self.buckets), "+Inf"], counts[name]):
++                cumulative += n
++                lines.append(f'{prefix}_latency_seconds_bucket{{op="{name}",le="{le}"}} {cumulative}')
++            lines.append(f'{prefix}_latency_seconds_sum{{op="{name}"}} {sums[name]:.6f}')
++            lines.append(f'{prefix}_latency_seconds_count{{op="{name}"}} {cumulative}')
++        lines += [
++            f"# HELP {prefix}_cache_requests_total Cache lookups by result.",
++            f"# TYPE {prefix}_cache_requests_total counter",
++        ]
++        for cache in sorted(cache_stats):
++            for result, key in (("hit", "hits"), ("miss", "misses")):
++                lines.append(f'{prefix}_cache_requests_total{{cache="{cache}",result="{result}"}} {cache_stats[cache][key]}')
++        lines += [
++            f"# HELP {prefix}_upstream_errors_total Failed calls to external services.",
++            f"# TYPE {prefix}_upstream_errors_total counter",
++        ]
++        lines.extend(f'{prefix}_upstream_errors_total{{op="{name}"}} {errors[name]}' for name in sorted(errors))
++        token_stats = self.token_stats()
++        lines += [
++            f"# HELP {prefix}_llm_tokens_total Tokens used by LLM calls, as reported by the API.",
++            f"# TYPE {prefix}_llm_tokens_total counter",
++        ]
++        for name in sorted(token_stats):
++            for kind in ("prompt", "completion"):
++                lines.append(f'{prefix}_llm_tokens_total{{op="{name}",kind="{kind}"}} {token_stats[name][kind + "_tokens"]}')
++        return "\n".join(lines) + "\n"
++
++
++@st.cache_resource
++def _metrics() -> Metrics:
++    return Metrics()
++
++
++@contextmanager
++def timed(name: str) -> Iterator[None]:
++    # 블록 소요 시간을 기록한다. 예외로 빠져나가면 오류로도 센다.
++    t0 = time.perf_counter()
++    try:
++        yield
++    except Exception:
++        _metrics().error(name)
++        raise
++    finally:
++        _metrics().observe(name, time.perf_counter() - t0)
++
++
++def instrumented(name: str, none_is_error: bool = False) -> Callable[[Callable], Callable]:
++    # 함수 단위 timed(). 외부 호출 함수는 실패를 None으로 돌려주므로 none_is_error로 오류를 센다.
++    def decorate(fn: Callable) -> Callable:
++        @functools.wraps(fn)
++        def wrapper(*args, **kwargs):
++            with timed(name):
++                result = fn(*args, **kwargs)
++            if none_is_error and result is None:
++                _metrics().error(name)
++            return result
++
++        return wrapper
++
++    return decorate
++
++
++class MetricsTextfileWriter:
++    # 주기적으로 Prometheus 텍스트를 임시 파일에 쓰고 교체한다 (수집기가 반쯤 쓰인 파일을 읽지 않도록)
++    def __init__(self, path: str, interval_s: float) -> None:
++        self.path = path
++        self.interval_s = interval_s
++        self._stop = threading.Event()
++        self._thread = threading.Thread(target=self._run, name="metrics-textfile", daemon=True)
++
++    def start(self) -> "MetricsTextfileWriter":
++        self._thread.start()
++        return self
++
++    def stop(self) -> None:
++        self._stop.set()
++
++    def write(self) -> None:
++        tmp = f"{self.path}.{os.getpid()}.tmp"
++        with open(tmp, "w", encoding="utf-8") as f:
++            f.write(_metrics().prometheus_text())
++        os.replace(tmp, self.path)
++
++    def _run(self) -> None:
++        while not self._stop.wait(self.interval_s):
++            try:
++                self.write()
++            except OSError:
++                pass
++
++
++@st.cache_resource
++def _metrics_writer() -> Optional[MetricsTextfileWriter]:
++    if not METRICS_TEXTFILE:
++        return None
++    return MetricsTextfileWriter(METRICS_TEXTFILE, METRICS_TEXTFILE_INTERVAL_S).start()
++
++
++# -----------------------------
++# 지연 import
++# -----------------------------
++# pandas(차트/분석), requests(외부 호출), openai(리포트)는 import만 수백 ms라 처음 쓰는 코드에서 import한다.
++# 새 프로세스의 첫 화면(체크인, 달력)은 이들 없이 그려지고, 그동안 백그라운드 스레드가 미리 import해 둔다.
++DEFERRED_IMPORTS = ("pandas", "requests", "openai")
++PREWARM_IMPORTS = os.environ.get("HABIT_PREWARM_IMPORTS", "1") != "0"
++IMPORT_BUDGET_MS = float(os.environ.get("HABIT_IMPORT_BUDGET_MS", 1000))
++
++
++def _prewarm_imports(modules: Tuple[str, ...]) -> None:
++    for name in modules:
++        try:
++            with timed(f"import_{name}"):
++                importlib.import_module(name)
++        except ImportError:
++            pass
++
++
++@st.cache_resource
++def _import_prewarmer() -> Optional[threading.Thread]:
++    # 프로세스당 한 번. 스크립트가 같은 모듈을 먼저 필요로 하면 import 잠금에서 이 스레드를 기다린다.
++    if not PREWARM_IMPORTS:
++        return None
++    thread = threading.Thread(target=_prewarm_imports, args=(DEFERRED_IMPORTS,), name="import-prewarm", daemon=True)
++    thread.start()
++    return thread
++
++
  # -----------------------------
  # 상수 / 유틸
  # -----------------------------
@@ -138,6 +416,28 @@ index bf85c2e77c3dd41f9a304cb5e131777fbfac5e88..2a7353db828ee980db43cfbc8db804a0
      "게임 마스터": "RPG 세계관. 퀘스트/레벨/보상/보스전 같은 표현을 사용.",
  }
  
++# 로컬 저장소 위치 / 리포트 캐시 설정 (환경변수로 덮어쓰기 가능)
++DATA_DIR = os.environ.get("HABIT_TRACKER_DATA_DIR", ".habit_tracker")
++DEFAULT_USER_ID = "local"
++# 사용자 구분 방식. single: 1인용(항상 DEFAULT_USER_ID), login: st.login() 계정별(공유 배포용, 로그인 전에는 화면 없음),
++# dev: ?user= 와 사이드바 자유 입력 ID. dev는 누구나 아무 ID의 기록을 읽고 덮어쓸 수 있으므로 로컬 개발/벤치마크 전용.
++USER_MODES = ("single", "login", "dev")
++USER_MODE = os.environ.get("HABIT_TRACKER_USER_MODE", "single")
++if USER_MODE not in USER_MODES:
++    raise ValueError(f"HABIT_TRACKER_USER_MODE는 {', '.join(USER_MODES)} 중 하나여야 합니다: {USER_MODE!r}")
++DB_POOL_SIZE = int(os.environ.get("HABIT_TRACKER_DB_POOL", 8))
++# 체크인 저장은 백그라운드에서 모아 쓴다: 최대 지연(초, 0이면 즉시 동기 저장)과 대기 행 상한
++WRITE_BEHIND_S = float(os.environ.get("HABIT_WRITE_BEHIND_S", 0.5))
++WRITE_BEHIND_MAX_PENDING = int(os.environ.get("HABIT_WRITE_BEHIND_MAX_PENDING", 1000))
++# 내보내기/가져오기 전에 대기 중인 저장을 기다리는 최대 시간(초). 저장소가 계속 실패하면 이 뒤에 포기한다.
++WRITE_BEHIND_FLUSH_TIMEOUT_S = float(os.environ.get("HABIT_WRITE_BEHIND_FLUSH_TIMEOUT_S", 10))
++# 공유 배포에서는 0으로 꺼서 새 사용자에게 샘플 기록을 만들지 않는다
++DEMO_SEED = os.environ.get("HABIT_TRACKER_DEMO_SEED", "1") != "0"
++REPORT_CACHE_FRESH_S = float(os.environ.get("HABIT_REPORT_CACHE_FRESH_S", 6 * 3600))
++REPORT_CACHE_MAX_ROWS = int(os.environ.get("HABIT_REPORT_CACHE_MAX_ROWS", 5000))
++# batch-reports가 미리 만든 (사용자, 날짜) 리포트를 화면에서 그대로 쓸 수 있는 시간. 그 안의 날씨도 이만큼까지만 묵는다.
++REPORT_PREGEN_FRESH_S = float(os.environ.get("HABIT_REPORT_PREGEN_FRESH_S", 3 * 3600))
++
  
  def _today_str() -> str:
      return datetime.now().strftime("%Y-%m-%d")
@@ -145,12 +445,31 @@ index bf85c2e77c3dd41f9a304cb5e131777fbfac5e88..2a7353db828ee980db43cfbc8db804a0
  
  def _clamp_int(x: int, lo: int, hi: int) -> int:
      return max(lo, min(hi, int(x)))
++
++
++def _format_age(seconds: float) -> str:
++    if seconds < 60:
++        return "방금"
++    if seconds < 3600:
++        return f"{int(seconds // 60)}분 전"
++    if seconds < 86400:
++        return f"{int(seconds // 3600)}시간 전"
++    return f"{int(seconds // 86400)}일 전"
  
  
  def calc_achievement(habit_state: Dict[str, bool]) -> Tuple[int, float]:
      done = sum(1 for k, _, _ in HABITS if habit_state.get(k, False))
      pct = (done / len(HABITS)) * 100.0
      return done, pct
++
++
++def habit_mask(habit_state: Dict[str, bool]) -> int:
++    # HABITS 순서대로 1비트씩: wake=1, water=2, study=4, ...
++    return sum(1 << i for i, (k, _, _) in enumerate(HABITS) if habit_state.get(k, False))
++
++
++def habits_from_mask(mask: int) -> Dict[str, bool]:
++    return {k: bool(mask >> i & 1) for i, (k, _, _) in enumerate(HABITS)}
  
  
 +def _pct_to_color(pct: float) -> str:
@@ -165,129 +484,3711 @@ index bf85c2e77c3dd41f9a304cb5e131777fbfac5e88..2a7353db828ee980db43cfbc8db804a0
 +    return "#1f2937"
 +
 +
-+def _calendar_matrix(year: int, month: int) -> List[List[Optional[int]]]:
-+    cal = calendar.Calendar(firstweekday=0)
-+    weeks = cal.monthdayscalendar(year, month)
-+    return [[day if day != 0 else None for day in week] for week in weeks]
++def _calendar_matrix(year: int, month: int) -> List[List[Optional[int]]]:
++    cal = calendar.Calendar(firstweekday=0)
++    weeks = cal.monthdayscalendar(year, month)
++    return [[day if day != 0 else None for day in week] for week in weeks]
++
++
++@instrumented("calc_streak")
++def calc_streak(store: "HistoryRepository", user_id: str, today_done: bool) -> int:
++    # 오늘은 아직 저장 전일 수 있으므로 화면 값으로 판단하고, 어제까지는 저장소의 연속 구간을 쓴다
++    if not today_done:
++        return 0
++    return 1 + store.streak_as_of(user_id, datetime.now().date() - timedelta(days=1))
++
++
++CALENDAR_LEGEND_HTML = """
++<div class="calendar-legend">
++  <span class="legend-box" style="background:#1f2937;"></span>미기록
++  <span class="legend-box" style="background:#fb7185;"></span>낮음
++  <span class="legend-box" style="background:#f59e0b;"></span>보통
++  <span class="legend-box" style="background:#38bdf8;"></span>높음
++  <span class="legend-box" style="background:#22c55e;"></span>아주 높음
++</div>
++"""
++
++
++def calendar_html(year: int, month: int, month_cols: "HabitColumns", compact: bool = False) -> str:
++    # (월, 그 달의 기록) → HTML. st 호출이 없는 순수 함수라 결과를 그대로 캐시할 수 있다.
++    # 날짜 칸 조회는 "서수 - 그 달 1일 서수" 인덱스로 한다.
++    first = date(year, month, 1).toordinal()
++    pct_by_day = np.zeros(calendar.monthrange(year, month)[1])
++    mood_by_day = np.zeros(len(pct_by_day), dtype=np.uint8)
++    offset = month_cols.days - first
++    pct_by_day[offset] = month_cols.pct
++    mood_by_day[offset] = month_cols.mood
++    table = ['<table class="calendar compact">' if compact else '<table class="calendar">']
++    table.append("<thead><tr>")
++    for day in ["월", "화", "수", "목", "금", "토", "일"]:
++        table.append(f"<th>{day}</th>")
++    table.append("</tr></thead><tbody>")
++    for week in _calendar_matrix(year, month):
++        table.append("<tr>")
++        for day in week:
++            if not day:
++                table.append('<td class="empty">.</td>')
++                continue
++            pct = pct_by_day[day - 1]
++            mood = int(mood_by_day[day - 1])
++            color = _pct_to_color(pct)
++            if compact:
++                label = str(day)
++            else:
++                label = f"{day}<br/><span style='font-size:11px; color:#e2e8f0'>{pct:.0f}%</span>"
++                if mood:
++                    label += f"<div style='font-size:11px; color:#cbd5f5'>🙂 {mood}</div>"
++            table.append(
++                f"<td style='background:{color};'>{label}</td>"
++            )
++        table.append("</tr>")
++    table.append("</tbody></table>")
++    return "".join(table)
++
++
++@st.cache_data(max_entries=512, show_spinner=False)
++def _calendar_html_cached(year: int, month: int, compact: bool, digest: str, _month_cols: "HabitColumns") -> str:
++    # 캐시 키는 (연, 월, 모드, 그 달 기록의 digest). 배열 자체는 해시하지 않는다(_ 접두사).
++    return calendar_html(year, month, _month_cols, compact)
++
++
++@instrumented("render_calendar")
++def render_calendar(month_cols: "HabitColumns", focus_date: datetime) -> None:
++    year = focus_date.year
++    month = focus_date.month
++    month_label = focus_date.strftime("%Y년 %m월")
++
++    st.markdown(f"#### 🗓️ {month_label}")
++    html = _calendar_html_cached(year, month, False, month_cols.digest(), month_cols)
++    st.markdown(html, unsafe_allow_html=True)
++    st.markdown(CALENDAR_LEGEND_HTML, unsafe_allow_html=True)
++
++
++@instrumented("render_calendar_year")
++def render_calendar_year(year_cols: "HabitColumns", year: int) -> None:
++    # 연간 보기: 1년치 기록을 월별 뷰로 나눈 뒤, 월 단위 캐시를 재사용해 한 번에 그린다
++    st.markdown(f"#### 🗓️ {year}년")
++    parts = ['<div class="calendar-year">']
++    for month in range(1, 13):
++        month_cols = year_cols.month(year, month)
++        parts.append(f"<div><h5>{month}월</h5>")
++        parts.append(_calendar_html_cached(year, month, True, month_cols.digest(), month_cols))
++        parts.append("</div>")
++    parts.append("</div>")
++    st.markdown("".join(parts), unsafe_allow_html=True)
++    st.markdown(CALENDAR_LEGEND_HTML, unsafe_allow_html=True)
++
++
+ # -----------------------------
++# 공유 캐시 (세션 간 공유)
++# -----------------------------
++class TTLCache:
++    # 키별 TTL + 크기 제한(LRU) + 동시 미스 단일 호출(single-flight).
++    # loader가 None을 돌려주면 캐시하지 않는다(실패 응답이 TTL 동안 고정되지 않도록).
++    # stale_s > 0 이고 refresh가 주어지면 만료 후 stale_s 동안은 이전 값을 바로 돌려주고
++    # 갱신은 refresh(작업 함수)로 백그라운드에서 한 번만 수행한다(stale-while-revalidate).
++    def __init__(
++        self,
++        maxsize: int = 128,
++        ttl_s: float = 600.0,
++        stale_s: float = 0.0,
++        refresh: Optional[Callable[[Callable[[], None]], Any]] = None,
++    ) -> None:
++        self.maxsize = maxsize
++        self.ttl_s = ttl_s
++        self.stale_s = stale_s
++        self.refresh = refresh
++        self.hits = 0
++        self.misses = 0
++        self.coalesced = 0
++        self.stale_hits = 0
++        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
++        self._inflight: Dict[Hashable, Tuple[threading.Event, List[Any]]] = {}
++        self._lock = threading.Lock()
++
++    def _lookup(self, key: Hashable, now: float) -> Tuple[str, Any]:
++        item = self._data.get(key)
++        if item is None:
++            return "miss", None
++        expires_at, value = item
++        if expires_at + self.stale_s <= now:
++            del self._data[key]
++            return "miss", None
++        self._data.move_to_end(key)
++        return ("fresh" if expires_at > now else "stale"), value
++
++    def get(self, key: Hashable) -> Any:
++        with self._lock:
++            state, value = self._lookup(key, time.monotonic())
++            return value if state == "fresh" else None
++
++    def set(self, key: Hashable, value: Any, ttl_s: Optional[float] = None) -> None:
++        ttl = self.ttl_s if ttl_s is None else ttl_s
++        with self._lock:
++            self._data[key] = (time.monotonic() + ttl, value)
++            self._data.move_to_end(key)
++            while len(self._data) > self.maxsize:
++                self._data.popitem(last=False)
++
++    def _load(
++        self,
++        key: Hashable,
++        loader: Callable[[], Any],
++        ttl_s: Optional[float],
++        inflight: Tuple[threading.Event, List[Any]],
++    ) -> Any:
++        event, box = inflight
++        try:
++            value = loader()
++            box[0] = value
++            if value is not None:
++                self.set(key, value, ttl_s)
++            return value
++        finally:
++            with self._lock:
++                self._inflight.pop(key, None)
++            event.set()
++
++    def get_or_load(self, key: Hashable, loader: Callable[[], Any], ttl_s: Optional[float] = None) -> Any:
++        with self._lock:
++            state, value = self._lookup(key, time.monotonic())
++            if state == "fresh":
++                self.hits += 1
++                return value
++            if state == "stale" and self.refresh is not None:
++                self.stale_hits += 1
++                if key not in self._inflight:
++                    inflight = (threading.Event(), [value])
++                    self._inflight[key] = inflight
++                    self.refresh(lambda: self._load(key, loader, ttl_s, inflight))
++                return value
++            inflight = self._inflight.get(key)
++            if inflight is None:
++                inflight = (threading.Event(), [None])
++                self._inflight[key] = inflight
++                self.misses += 1
++                leader = True
++            else:
++                self.coalesced += 1
++                leader = False
++
++        if not leader:
++            inflight[0].wait()
++            return inflight[1][0]
++        return self._load(key, loader, ttl_s, inflight)
++
++    def stats(self) -> Dict[str, int]:
++        with self._lock:
++            return {
++                "size": len(self._data),
++                "hits": self.hits,
++                "misses": self.misses,
++                "coalesced": self.coalesced,
++                "stale_hits": self.stale_hits,
++            }
++
++
++class TokenBucket:
++    # 초당 rate개씩 채워지는 토큰 버킷 (최대 capacity개까지 몰아서 사용 가능)
++    def __init__(self, rate: float, capacity: float) -> None:
++        self.rate = rate
++        self.capacity = capacity
++        self._tokens = capacity
++        self._updated = time.monotonic()
++        self._lock = threading.Lock()
++
++    def _refill(self, now: float) -> None:
++        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
++        self._updated = now
++
++    def acquire(self, timeout: Optional[float] = None) -> bool:
++        deadline = None if timeout is None else time.monotonic() + timeout
++        while True:
++            with self._lock:
++                now = time.monotonic()
++                self._refill(now)
++                if self._tokens >= 1:
++                    self._tokens -= 1
++                    return True
++                wait_s = (1 - self._tokens) / self.rate
++            if deadline is not None:
++                if now + wait_s > deadline:
++                    return False
++            time.sleep(wait_s)
++
++
++class CircuitBreaker:
++    # 업스트림 하나의 회로 차단기. 최근 window번 호출 중 실패 비율이 failure_rate 이상이면(최소 min_calls번) 연다.
++    # 열린 동안은 호출 없이 바로 실패시키고, open_s가 지나면 시험 호출 1건만 통과시켜(half-open)
++    # 성공하면 닫고 실패하면 다시 연다. 결과를 알리지 못한 시험 호출은 open_s 뒤에 다시 허용한다.
++    def __init__(self, window: int = 20, min_calls: int = 4, failure_rate: float = 0.5, open_s: float = 30.0) -> None:
++        self.min_calls = min_calls
++        self.failure_rate = failure_rate
++        self.open_s = open_s
++        self.state = "closed"
++        self.rejected = 0
++        self.trips = 0
++        self._outcomes: "deque[bool]" = deque(maxlen=window)
++        self._opened_at = 0.0
++        self._probe_at: Optional[float] = None
++        self._lock = threading.Lock()
++
++    def allow(self) -> bool:
++        with self._lock:
++            if self.state == "closed":
++                return True
++            now = time.monotonic()
++            if self.state == "open" and now - self._opened_at >= self.open_s:
++                self.state = "half_open"
++                self._probe_at = None
++            if self.state == "half_open" and (self._probe_at is None or now - self._probe_at >= self.open_s):
++                self._probe_at = now
++                return True
++            self.rejected += 1
++            return False
++
++    def record(self, ok: bool) -> None:
++        with self._lock:
++            if self.state == "half_open":
++                if ok:
++                    self.state = "closed"
++                    self._outcomes.clear()
++                else:
++                    self._trip()
++                return
++            if self.state == "open":
++                # 열리기 전에 시작한 호출의 늦은 결과
++                return
++            self._outcomes.append(ok)
++            failures = self._outcomes.count(False)
++            if len(self._outcomes) >= self.min_calls and failures >= self.failure_rate * len(self._outcomes):
++                self._trip()
++
++    def _trip(self) -> None:
++        self.state = "open"
++        self.trips += 1
++        self._opened_at = time.monotonic()
++        self._outcomes.clear()
++
++    def status(self) -> Dict[str, Any]:
++        with self._lock:
++            return {"state": self.state, "trips": self.trips, "rejected": self.rejected}
++
++
++class ReportStore:
++    # 프롬프트 해시 → 리포트 본문을 SQLite에 보관하는 영구 캐시.
++    # 신선도(max_age_s)를 넘긴 행은 무시하고, max_rows를 넘으면 가장 오래 안 쓰인 행부터 지운다.
++    def __init__(self, path: str, max_rows: int = REPORT_CACHE_MAX_ROWS) -> None:
++        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
++        self.max_rows = max_rows
++        self._lock = threading.Lock()
++        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
++        self._conn.execute("PRAGMA journal_mode=WAL")
++        self._conn.execute(
++            "CREATE TABLE IF NOT EXISTS report_cache ("
++            " key TEXT PRIMARY KEY, text TEXT NOT NULL,"
++            " created_at REAL NOT NULL, last_used_at REAL NOT NULL)"
++        )
++        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_report_cache_last_used ON report_cache(last_used_at)")
++        # 미리 만든 리포트는 (사용자, 날짜)별 한 행: 본문과 그때의 날씨/강아지를 함께 두어 LRU 정리와 무관하다
++        self._conn.execute(
++            "CREATE TABLE IF NOT EXISTS pregenerated_report ("
++            " user_id TEXT NOT NULL, day TEXT NOT NULL, fingerprint TEXT NOT NULL, inputs TEXT NOT NULL,"
++            " text TEXT NOT NULL, created_at REAL NOT NULL, PRIMARY KEY (user_id, day)) WITHOUT ROWID"
++        )
++
++    def get(self, key: str, max_age_s: float = REPORT_CACHE_FRESH_S) -> Optional[Tuple[str, float]]:
++        now = time.time()
++        with self._lock:
++            row = self._conn.execute(
++                "SELECT text, created_at FROM report_cache WHERE key = ? AND created_at >= ?",
++                (key, now - max_age_s),
++            ).fetchone()
++            if row is None:
++                return None
++            self._conn.execute("UPDATE report_cache SET last_used_at = ? WHERE key = ?", (now, key))
++        return row[0], row[1]
++
++    def put(self, key: str, text: str) -> None:
++        now = time.time()
++        with self._lock:
++            self._conn.execute(
++                "INSERT OR REPLACE INTO report_cache (key, text, created_at, last_used_at) VALUES (?, ?, ?, ?)",
++                (key, text, now, now),
++            )
++            self._conn.execute(
++                "DELETE FROM report_cache WHERE key IN ("
++                " SELECT key FROM report_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)",
++                (self.max_rows,),
++            )
++
++    def put_pregenerated(
++        self, user_id: str, day: str, fingerprint: str, weather: Dict, dog: Dict, text: str
++    ) -> None:
++        now = time.time()
++        inputs = json.dumps({"weather": weather, "dog": dog}, ensure_ascii=False)
++        with self._lock:
++            self._conn.execute(
++                "INSERT OR REPLACE INTO pregenerated_report (user_id, day, fingerprint, inputs, text, created_at)"
++                " VALUES (?, ?, ?, ?, ?, ?)",
++                (user_id, day, fingerprint, inputs, text, now),
++            )
++            # 하루가 지난 행은 다시 쓰일 일이 없다
++            self._conn.execute("DELETE FROM pregenerated_report WHERE created_at < ?", (now - 2 * 86400,))
++
++    def get_pregenerated(self, user_id: str, day: str, fingerprint: str, max_age_s: float) -> Optional[Dict]:
++        # 그 사용자의 지금 입력(fingerprint)과 같을 때만. 입력이 바뀌었거나 오래됐으면 None → 실시간 경로
++        with self._lock:
++            row = self._conn.execute(
++                "SELECT inputs, text, created_at FROM pregenerated_report"
++                " WHERE user_id = ? AND day = ? AND fingerprint = ? AND created_at >= ?",
++                (user_id, day, fingerprint, time.time() - max_age_s),
++            ).fetchone()
++        if row is None:
++            return None
++        inputs = json.loads(row[0])
++        return {"weather": inputs["weather"], "dog": inputs["dog"], "text": row[1], "created_at": row[2]}
++
++
++@st.cache_resource
++def _report_store() -> ReportStore:
++    return ReportStore(os.path.join(DATA_DIR, "reports.sqlite3"))
++
++
++# -----------------------------
++# 기록 저장소 (사용자별 일 단위 기록)
++# -----------------------------
++class HistoryRepository(ABC):
++    # 화면 코드는 이 인터페이스만 사용한다. 추상 메서드를 빠뜨린 구현은 인스턴스를 만들 때 TypeError. 행 형식:
++    # {"date": "YYYY-MM-DD", "done": int, "pct": float, "mood": int, "habit_mask": int}
++    @abstractmethod
++    def upsert_days(self, user_id: str, rows: List[Dict]) -> None:
++        raise NotImplementedError
++
++    @abstractmethod
++    def get_records(self, user_id: str, start: str = "0000-01-01", end: str = "9999-12-31") -> List[Tuple]:
++        # (date, done, pct, mood, habit_mask) 튜플, 날짜 오름차순. 대량 분석용(dict 생성 비용 없음)
++        raise NotImplementedError
++
++    def iter_records(self, user_id: str, chunk_size: int = 5000) -> Iterator[List[Tuple]]:
++        # get_records()와 같은 튜플을 날짜 순으로 chunk_size개씩. 대량 내보내기용
++        records = self.get_records(user_id)
++        for i in range(0, len(records), chunk_size):
++            yield records[i : i + chunk_size]
++
++    def bulk_upsert_days(self, user_id: str, rows: List[Dict]) -> None:
++        # 대량 가져오기용 upsert (rows의 날짜는 서로 달라야 한다)
++        self.upsert_days(user_id, rows)
++
++    def get_range(self, user_id: str, start: str, end: str) -> List[Dict]:
++        # start <= date <= end, 날짜 오름차순
++        return [
++            {"date": d, "done": done, "pct": pct, "mood": mood, "habit_mask": mask}
++            for d, done, pct, mood, mask in self.get_records(user_id, start, end)
++        ]
++
++    @abstractmethod
++    def revision(self, user_id: str) -> int:
++        # 사용자 기록이 바뀔 때마다 증가: 파생 데이터 캐시 키로 사용
++        raise NotImplementedError
++
++    def records_since(self, user_id: str, revision: int) -> Optional[List[Tuple]]:
++        # revision 이후에 쓴 행만 get_records()와 같은 튜플로. 알 수 없으면 None(호출한 쪽이 전체를 다시 읽는다)
++        return None
++
++    def get_month(self, user_id: str, year: int, month: int) -> List[Dict]:
++        last_day = calendar.monthrange(year, month)[1]
++        return self.get_range(user_id, f"{year}-{month:02d}-01", f"{year}-{month:02d}-{last_day:02d}")
++
++    @abstractmethod
++    def list_months(self, user_id: str) -> List[str]:
++        # 기록이 있는 "YYYY-MM" 목록, 최신순
++        raise NotImplementedError
++
++    @abstractmethod
++    def has_rows(self, user_id: str) -> bool:
++        raise NotImplementedError
++
++    @abstractmethod
++    def list_users(self) -> List[str]:
++        # 기록이나 설정이 하나라도 있는 사용자
++        raise NotImplementedError
++
++    @abstractmethod
++    def streak_as_of(self, user_id: str, day: date) -> int:
++        # day를 포함해 그 이전으로 이어진 연속 기록 일수 (day에 기록이 없으면 0)
++        raise NotImplementedError
++
++    @abstractmethod
++    def longest_streak(self, user_id: str) -> int:
++        raise NotImplementedError
++
++    @abstractmethod
++    def get_settings(self, user_id: str) -> Dict[str, str]:
++        # 사용자별 설정 {"city": ..., "coach_style": ...} (저장된 값만)
++        raise NotImplementedError
++
++    @abstractmethod
++    def save_settings(self, user_id: str, settings: Dict[str, str]) -> None:
++        raise NotImplementedError
++
++    @abstractmethod
++    def get_rollups(self, user_id: str, period: str, start: date, end: date) -> List[Dict]:
++        # 시작일이 start..end인 주(월요일 시작)/월 집계, 오래된 순. 저장할 때마다 해당 기간만 갱신된다.
++        # {"start": date, "days": int, "pct_sum": float, "mood_sum": int, "mood_days": int, "habits": [int, ...]}
++        raise NotImplementedError
++
++
++class SQLitePool:
++    # 스레드 간 공유하는 SQLite 커넥션 풀. WAL 모드라 읽기는 동시에, 쓰기는 SQLite 잠금으로 직렬화된다.
++    def __init__(self, path: str, size: int = 8) -> None:
++        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
++        self.path = path
++        self.size = size
++        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
++        self._slots = threading.BoundedSemaphore(size)
++
++    def _connect(self) -> sqlite3.Connection:
++        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
++        conn.execute("PRAGMA journal_mode=WAL")
++        conn.execute("PRAGMA synchronous=NORMAL")
++        return conn
++
++    @contextmanager
++    def connection(self) -> Iterator[sqlite3.Connection]:
++        with self._slots:
++            try:
++                conn = self._idle.get_nowait()
++            except queue.Empty:
++                conn = self._connect()
++            try:
++                yield conn
++            finally:
++                self._idle.put(conn)
++
++    @contextmanager
++    def transaction(self) -> Iterator[sqlite3.Connection]:
++        # BEGIN IMMEDIATE: 쓰기 잠금을 먼저 잡아 읽기→쓰기 승격 중 교착을 피한다
++        with self.connection() as conn:
++            conn.execute("BEGIN IMMEDIATE")
++            try:
++                yield conn
++                conn.execute("COMMIT")
++            except BaseException:
++                conn.execute("ROLLBACK")
++                raise
++
++
++class SQLiteHistoryRepository(HistoryRepository):
++    def __init__(self, path: str, pool_size: int = 8) -> None:
++        self._pool = SQLitePool(path, pool_size)
++        with self._pool.connection() as conn:
++            # (user_id, date) 기본키가 곧 날짜 인덱스: 월/기간 조회는 인덱스 범위 스캔
++            conn.execute(
++                "CREATE TABLE IF NOT EXISTS history ("
++                " user_id TEXT NOT NULL, date TEXT NOT NULL,"
++                " done INTEGER NOT NULL, pct REAL NOT NULL, mood INTEGER,"
++                " habit_mask INTEGER NOT NULL DEFAULT 0, updated_at REAL NOT NULL,"
++                " revision INTEGER NOT NULL DEFAULT 0,"
++                " PRIMARY KEY (user_id, date)) WITHOUT ROWID"
++            )
++            # 행을 마지막으로 쓴 history_revision 값: 열 캐시가 바뀐 행만 다시 읽는다 (이 열이 생기기 전 DB는 추가)
++            if "revision" not in {col[1] for col in conn.execute("PRAGMA table_info(history)")}:
++                conn.execute("ALTER TABLE history ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
++            conn.execute("CREATE INDEX IF NOT EXISTS ix_history_revision ON history(user_id, revision)")
++            # 연속 기록은 "달성한 날(done > 0)이 이어진 구간"으로 보관한다 (날짜는 date.toordinal()).
++            # 하루를 저장할 때 인접 구간만 보고 합치거나 쪼개므로 기록 길이와 무관하게 인덱스 조회 몇 번으로 끝난다.
++            conn.execute(
++                "CREATE TABLE IF NOT EXISTS streak_runs ("
++                " user_id TEXT NOT NULL, start INTEGER NOT NULL, end INTEGER NOT NULL,"
++                " PRIMARY KEY (user_id, start)) WITHOUT ROWID"
++            )
++            conn.execute("CREATE INDEX IF NOT EXISTS ix_streak_runs_end ON streak_runs(user_id, end)")
++            # 주/월 집계(롤업). start는 기간 첫날의 date.toordinal(), habits는 습관별 달성 일수 JSON 배열
++            conn.execute(
++                "CREATE TABLE IF NOT EXISTS history_rollup ("
++                " user_id TEXT NOT NULL, period TEXT NOT NULL, start INTEGER NOT NULL,"
++                " days INTEGER NOT NULL, pct_sum REAL NOT NULL, mood_sum INTEGER NOT NULL, mood_days INTEGER NOT NULL,"
++                " habits TEXT NOT NULL, PRIMARY KEY (user_id, period, start)) WITHOUT ROWID"
++            )
++            conn.execute(
++                "CREATE TABLE IF NOT EXISTS history_revision ("
++                " user_id TEXT PRIMARY KEY, revision INTEGER NOT NULL) WITHOUT ROWID"
++            )
++            conn.execute(
++                "CREATE TABLE IF NOT EXISTS streak_summary ("
++                " user_id TEXT PRIMARY KEY, longest INTEGER NOT NULL,"
++                " last_active INTEGER, current_start INTEGER) WITHOUT ROWID"
++            )
++            conn.execute(
++                "CREATE TABLE IF NOT EXISTS user_settings ("
++                " user_id TEXT PRIMARY KEY, city TEXT, coach_style TEXT, updated_at REAL NOT NULL) WITHOUT ROWID"
++            )
++
++    @staticmethod
++    def _run_containing(conn: sqlite3.Connection, user_id: str, day: int) -> Optional[Tuple[int, int]]:
++        row = conn.execute(
++            "SELECT start, end FROM streak_runs WHERE user_id = ? AND start <= ? ORDER BY start DESC LIMIT 1",
++            (user_id, day),
++        ).fetchone()
++        return row if row is not None and row[1] >= day else None
++
++    @staticmethod
++    def _summary(conn: sqlite3.Connection, user_id: str) -> Tuple[int, Optional[int], Optional[int]]:
++        row = conn.execute(
++            "SELECT longest, last_active, current_start FROM streak_summary WHERE user_id = ?", (user_id,)
++        ).fetchone()
++        return row if row is not None else (0, None, None)
++
++    @staticmethod
++    def _save_summary(
++        conn: sqlite3.Connection, user_id: str, longest: int, last_active: Optional[int], current_start: Optional[int]
++    ) -> None:
++        conn.execute(
++            "INSERT OR REPLACE INTO streak_summary (user_id, longest, last_active, current_start) VALUES (?, ?, ?, ?)",
++            (user_id, longest, last_active, current_start),
++        )
++
++    def _mark_active(self, conn: sqlite3.Connection, user_id: str, day: int) -> None:
++        if self._run_containing(conn, user_id, day) is not None:
++            return
++        left = conn.execute(
++            "SELECT start FROM streak_runs WHERE user_id = ? AND end = ?", (user_id, day - 1)
++        ).fetchone()
++        right = conn.execute(
++            "SELECT end FROM streak_runs WHERE user_id = ? AND start = ?", (user_id, day + 1)
++        ).fetchone()
++        start = left[0] if left else day
++        end = right[0] if right else day
++        if right:
++            conn.execute("DELETE FROM streak_runs WHERE user_id = ? AND start = ?", (user_id, day + 1))
++        conn.execute(
++            "INSERT OR REPLACE INTO streak_runs (user_id, start, end) VALUES (?, ?, ?)", (user_id, start, end)
++        )
++        longest, last_active, current_start = self._summary(conn, user_id)
++        if last_active is None or end >= last_active:
++            last_active, current_start = end, start
++        self._save_summary(conn, user_id, max(longest, end - start + 1), last_active, current_start)
++
++    def _mark_inactive(self, conn: sqlite3.Connection, user_id: str, day: int) -> None:
++        run = self._run_containing(conn, user_id, day)
++        if run is None:
++            return
++        start, end = run
++        conn.execute("DELETE FROM streak_runs WHERE user_id = ? AND start = ?", (user_id, start))
++        if start <= day - 1:
++            conn.execute(
++                "INSERT INTO streak_runs (user_id, start, end) VALUES (?, ?, ?)", (user_id, start, day - 1)
++            )
++        if day + 1 <= end:
++            conn.execute(
++                "INSERT INTO streak_runs (user_id, start, end) VALUES (?, ?, ?)", (user_id, day + 1, end)
++            )
++        longest, last_active, current_start = self._summary(conn, user_id)
++        if end - start + 1 >= longest:
++            # 최장 구간을 쪼갠 드문 경우에만 전체 구간에서 다시 찾는다
++            longest = conn.execute(
++                "SELECT COALESCE(MAX(end - start + 1), 0) FROM streak_runs WHERE user_id = ?", (user_id,)
++            ).fetchone()[0]
++        if last_active == end:
++            latest = conn.execute(
++                "SELECT start, end FROM streak_runs WHERE user_id = ? ORDER BY end DESC LIMIT 1", (user_id,)
++            ).fetchone()
++            current_start, last_active = latest if latest else (None, None)
++        self._save_summary(conn, user_id, longest, last_active, current_start)
++
++    def _ensure_streaks(self, user_id: str) -> None:
++        # 구간 테이블이 생기기 전에 저장된 기록을 위한 1회성 재구성
++        with self._pool.connection() as conn:
++            if conn.execute("SELECT 1 FROM streak_summary WHERE user_id = ?", (user_id,)).fetchone() is not None:
++                return
++        with self._pool.transaction() as conn:
++            if conn.execute("SELECT 1 FROM streak_summary WHERE user_id = ?", (user_id,)).fetchone() is not None:
++                return
++            conn.execute("DELETE FROM streak_runs WHERE user_id = ?", (user_id,))
++            self._save_summary(conn, user_id, 0, None, None)
++            cur = conn.execute("SELECT date FROM history WHERE user_id = ? AND done > 0 ORDER BY date", (user_id,))
++            for (d,) in cur.fetchall():
++                self._mark_active(conn, user_id, date.fromisoformat(d).toordinal())
++
++    _UPSERT_SQL = (
++        "INSERT INTO history (user_id, date, done, pct, mood, habit_mask, updated_at, revision)"
++        " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
++        " ON CONFLICT(user_id, date) DO UPDATE SET"
++        " done = excluded.done, pct = excluded.pct, mood = excluded.mood,"
++        " habit_mask = excluded.habit_mask, updated_at = excluded.updated_at, revision = excluded.revision"
++    )
++
++    @staticmethod
++    def _upsert_params(user_id: str, rows: List[Dict], revision: int) -> List[Tuple]:
++        now = time.time()
++        return [
++            (user_id, r["date"], int(r["done"]), float(r["pct"]), r.get("mood"), int(r.get("habit_mask", 0)), now,
++             revision)
++            for r in rows
++        ]
++
++    @staticmethod
++    def _bump_revision(conn: sqlite3.Connection, user_id: str) -> int:
++        # 쓰기 트랜잭션 안에서 호출: 올린 revision을 돌려주어 이번에 쓰는 행에 함께 기록한다
++        conn.execute(
++            "INSERT INTO history_revision (user_id, revision) VALUES (?, 1)"
++            " ON CONFLICT(user_id) DO UPDATE SET revision = revision + 1",
++            (user_id,),
++        )
++        return conn.execute("SELECT revision FROM history_revision WHERE user_id = ?", (user_id,)).fetchone()[0]
++
++    # 날짜 문자열 → date.toordinal() (julianday 기준 1721424.5 차이)
++    _ORDINAL_SQL = "CAST(julianday(date) - 1721424.5 AS INTEGER)"
++    _ROLLUP_START_SQL = {
++        "week": f"({_ORDINAL_SQL} - ({_ORDINAL_SQL} - 1) % 7)",
++        "month": "CAST(julianday(substr(date, 1, 8) || '01') - 1721424.5 AS INTEGER)",
++    }
++    _ROLLUP_HABITS_SQL = "json_array(" + ", ".join(f"SUM((habit_mask >> {i}) & 1)" for i in range(len(HABITS))) + ")"
++
++    def _refresh_rollups(self, conn: sqlite3.Connection, user_id: str, first: date, last: date) -> None:
++        # first..last 날짜가 걸친 주/월만 history에서 다시 집계한다 (기간당 최대 31행 인덱스 범위 스캔)
++        for period, start_sql in self._ROLLUP_START_SQL.items():
++            lo = period_start(first, period)
++            hi = period_start(last, period) + (timedelta(days=6) if period == "week" else timedelta(days=0))
++            if period == "month":
++                hi = hi.replace(day=calendar.monthrange(hi.year, hi.month)[1])
++            conn.execute(
++                "INSERT OR REPLACE INTO history_rollup"
++                " (user_id, period, start, days, pct_sum, mood_sum, mood_days, habits)"
++                f" SELECT user_id, ?, {start_sql} AS s, COUNT(*), SUM(pct), COALESCE(SUM(mood), 0), COUNT(mood),"
++                f" {self._ROLLUP_HABITS_SQL}"
++                " FROM history WHERE user_id = ? AND date BETWEEN ? AND ? GROUP BY s",
++                (period, user_id, lo.isoformat(), hi.isoformat()),
++            )
++
++    def _ensure_rollups(self, user_id: str) -> None:
++        # 롤업 테이블이 생기기 전에 저장된 기록을 위한 1회성 재구성
++        with self._pool.connection() as conn:
++            if conn.execute("SELECT 1 FROM history_rollup WHERE user_id = ? LIMIT 1", (user_id,)).fetchone():
++                return
++            span = conn.execute("SELECT MIN(date), MAX(date) FROM history WHERE user_id = ?", (user_id,)).fetchone()
++        if span[0] is None:
++            return
++        with self._pool.transaction() as conn:
++            self._refresh_rollups(conn, user_id, date.fromisoformat(span[0]), date.fromisoformat(span[1]))
++
++    def _refresh_rollups_for(self, conn: sqlite3.Connection, user_id: str, rows: List[Dict]) -> None:
++        if rows:
++            days = [r["date"] for r in rows]
++            self._refresh_rollups(conn, user_id, date.fromisoformat(min(days)), date.fromisoformat(max(days)))
++
++    def upsert_days(self, user_id: str, rows: List[Dict]) -> None:
++        self._ensure_streaks(user_id)
++        self._ensure_rollups(user_id)
++        with self._pool.transaction() as conn:
++            conn.executemany(self._UPSERT_SQL, self._upsert_params(user_id, rows, self._bump_revision(conn, user_id)))
++            self._refresh_rollups_for(conn, user_id, rows)
++            for r in rows:
++                day = date.fromisoformat(r["date"]).toordinal()
++                if int(r["done"]) > 0:
++                    self._mark_active(conn, user_id, day)
++                else:
++                    self._mark_inactive(conn, user_id, day)
++
++    def get_records(self, user_id: str, start: str = "0000-01-01", end: str = "9999-12-31") -> List[Tuple]:
++        with self._pool.connection() as conn:
++            cur = conn.execute(
++                "SELECT date, done, pct, mood, habit_mask FROM history"
++                " WHERE user_id = ? AND date BETWEEN ? AND ? ORDER BY date",
++                (user_id, start, end),
++            )
++            return cur.fetchall()
++
++    def iter_records(self, user_id: str, chunk_size: int = 5000) -> Iterator[List[Tuple]]:
++        # 키셋 페이지네이션: 청크마다 커넥션을 잠깐만 잡으므로 내보내기가 길어져도 저장/체크포인트를 막지 않는다
++        after = ""
++        while True:
++            with self._pool.connection() as conn:
++                chunk = conn.execute(
++                    "SELECT date, done, pct, mood, habit_mask FROM history"
++                    " WHERE user_id = ? AND date > ? ORDER BY date LIMIT ?",
++                    (user_id, after, chunk_size),
++                ).fetchall()
++            if not chunk:
++                return
++            yield chunk
++            after = chunk[-1][0]
++
++    def bulk_upsert_days(self, user_id: str, rows: List[Dict]) -> None:
++        # 행마다 연속 기록 구간을 고치지 않고 요약을 지워 둔다: 다음 조회 때 _ensure_streaks가 한 번에 다시 만든다
++        self._ensure_rollups(user_id)
++        with self._pool.transaction() as conn:
++            conn.executemany(self._UPSERT_SQL, self._upsert_params(user_id, rows, self._bump_revision(conn, user_id)))
++            self._refresh_rollups_for(conn, user_id, rows)
++            conn.execute("DELETE FROM streak_summary WHERE user_id = ?", (user_id,))
++
++    def get_rollups(self, user_id: str, period: str, start: date, end: date) -> List[Dict]:
++        self._ensure_rollups(user_id)
++        with self._pool.connection() as conn:
++            cur = conn.execute(
++                "SELECT start, days, pct_sum, mood_sum, mood_days, habits FROM history_rollup"
++                " WHERE user_id = ? AND period = ? AND start BETWEEN ? AND ? ORDER BY start",
++                (user_id, period, start.toordinal(), end.toordinal()),
++            )
++            return [
++                {"start": date.fromordinal(s), "days": days, "pct_sum": pct_sum, "mood_sum": mood_sum,
++                 "mood_days": mood_days, "habits": json.loads(habits)}
++                for s, days, pct_sum, mood_sum, mood_days, habits in cur.fetchall()
++            ]
++
++    def revision(self, user_id: str) -> int:
++        with self._pool.connection() as conn:
++            row = conn.execute("SELECT revision FROM history_revision WHERE user_id = ?", (user_id,)).fetchone()
++        return row[0] if row else 0
++
++    def records_since(self, user_id: str, revision: int) -> Optional[List[Tuple]]:
++        # (user_id, revision) 인덱스 범위 스캔: 체크인 한 번이면 한 행
++        with self._pool.connection() as conn:
++            cur = conn.execute(
++                "SELECT date, done, pct, mood, habit_mask FROM history"
++                " WHERE user_id = ? AND revision > ? ORDER BY date",
++                (user_id, revision),
++            )
++            return cur.fetchall()
++
++    def list_months(self, user_id: str) -> List[str]:
++        with self._pool.connection() as conn:
++            cur = conn.execute(
++                "SELECT DISTINCT substr(date, 1, 7) FROM history WHERE user_id = ? ORDER BY date DESC",
++                (user_id,),
++            )
++            return [m for (m,) in cur.fetchall()]
++
++    def has_rows(self, user_id: str) -> bool:
++        with self._pool.connection() as conn:
++            cur = conn.execute("SELECT 1 FROM history WHERE user_id = ? LIMIT 1", (user_id,))
++            return cur.fetchone() is not None
++
++    def list_users(self) -> List[str]:
++        with self._pool.connection() as conn:
++            cur = conn.execute(
++                "SELECT user_id FROM history_revision UNION SELECT user_id FROM user_settings ORDER BY 1"
++            )
++            return [u for (u,) in cur.fetchall()]
++
++    def streak_as_of(self, user_id: str, day: date) -> int:
++        self._ensure_streaks(user_id)
++        with self._pool.connection() as conn:
++            run = self._run_containing(conn, user_id, day.toordinal())
++        return day.toordinal() - run[0] + 1 if run else 0
++
++    def longest_streak(self, user_id: str) -> int:
++        self._ensure_streaks(user_id)
++        with self._pool.connection() as conn:
++            return self._summary(conn, user_id)[0]
++
++    def get_settings(self, user_id: str) -> Dict[str, str]:
++        with self._pool.connection() as conn:
++            row = conn.execute(
++                "SELECT city, coach_style FROM user_settings WHERE user_id = ?", (user_id,)
++            ).fetchone()
++        if row is None:
++            return {}
++        return {k: v for k, v in (("city", row[0]), ("coach_style", row[1])) if v}
++
++    def save_settings(self, user_id: str, settings: Dict[str, str]) -> None:
++        with self._pool.transaction() as conn:
++            conn.execute(
++                "INSERT INTO user_settings (user_id, city, coach_style, updated_at) VALUES (?, ?, ?, ?)"
++                " ON CONFLICT(user_id) DO UPDATE SET"
++                " city = excluded.city, coach_style = excluded.coach_style, updated_at = excluded.updated_at",
++                (user_id, settings.get("city"), settings.get("coach_style"), time.time()),
++            )
++
++
++@st.cache_resource
++def _history_store() -> HistoryRepository:
++    # 프로세스 전체가 공유하는 저장소 (세션마다 연결을 만들지 않음)
++    return SQLiteHistoryRepository(os.path.join(DATA_DIR, "history.sqlite3"), pool_size=DB_POOL_SIZE)
++
++
++class WriteBehindQueue:
++    # 하루 기록 저장을 화면 스레드에서 떼어 내는 write-behind 큐.
++    # 같은 (사용자, 날짜)의 연속 수정은 마지막 값 하나로 합치고, 백그라운드 스레드가 최대 delay_s마다
++    # 사용자별 upsert_days 한 번(트랜잭션 1개)으로 모아 쓴다. put()은 기다리지 않는다: 대기 행이 max_pending이면
++    # 새 날짜 행은 호출한 스레드에서 바로 쓰고(sync_writes, write_behind_sync 지표) 같은 행 수정은 대기 행에 합친다.
++    # 쓰는 중/대기 중인 행은 pending_rows()로 읽을 수 있어 새 세션도 방금 저장한 값을 본다.
++    def __init__(self, store: HistoryRepository, delay_s: float, max_pending: int) -> None:
++        self.store = store
++        self.delay_s = delay_s
++        self.max_pending = max_pending
++        self.batches = 0
++        self.rows_written = 0
++        self.coalesced = 0
++        self.sync_writes = 0
++        self.errors = 0
++        self._pending: "OrderedDict[Tuple[str, str], Dict]" = OrderedDict()
++        self._inflight: Dict[Tuple[str, str], Dict] = {}
++        self._flush_requested = False
++        self._stopping = False
++        self._cond = threading.Condition()
++        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
++
++    def start(self) -> "WriteBehindQueue":
++        self._thread.start()
++        return self
++
++    def put(self, user_id: str, row: Dict) -> None:
++        key = (user_id, row["date"])
++        with self._cond:
++            # 쓰는 중인 행은 직접 쓰면 백그라운드 쓰기가 옛 값으로 덮을 수 있으므로 상한을 넘겨도 큐에 넣는다
++            full = len(self._pending) >= self.max_pending and key not in self._inflight and not self._stopping
++            if key in self._pending:
++                self.coalesced += 1
++            elif full:
++                self.sync_writes += 1
++                self._flush_requested = True
++                self._cond.notify_all()
++            if key in self._pending or not full:
++                self._pending[key] = dict(row)
++                self._cond.notify_all()
++                return
++        try:
++            with timed("write_behind_sync"):
++                self.store.upsert_days(user_id, [row])
++        except Exception:
++            # 직접 쓰기도 실패하면 상한을 넘겨서라도 큐에 넣어 백그라운드 재시도에 맡긴다
++            with self._cond:
++                self.errors += 1
++                self._pending.setdefault(key, dict(row))
++                self._cond.notify_all()
++
++    def pending_rows(self, user_id: str, start: str, end: str) -> List[Dict]:
++        # 아직 저장소에 반영되지 않은 이 사용자의 start..end 행 (대기 중인 값이 쓰는 중인 값보다 최신)
++        with self._cond:
++            rows = {d: row for (uid, d), row in self._inflight.items() if uid == user_id and start <= d <= end}
++            rows.update((d, row) for (uid, d), row in self._pending.items() if uid == user_id and start <= d <= end)
++        return [dict(rows[d]) for d in sorted(rows)]
++
++    def request_flush(self) -> None:
++        # 기다리지 않고 다음 배치를 바로 쓰게 한다 (사용자 전환 시)
++        with self._cond:
++            self._flush_requested = True
++            self._cond.notify_all()
++
++    def flush(self, user_id: Optional[str] = None, timeout: Optional[float] = None) -> bool:
++        # user_id(없으면 전체)의 대기 행이 모두 저장될 때까지 기다린다. 내보내기/가져오기처럼 저장소를 직접 읽는 쪽에서 쓴다.
++        def drained() -> bool:
++            return not any(user_id in (None, uid) for uid, _ in [*self._pending, *self._inflight])
++
++        with self._cond:
++            if drained():
++                return True
++            self._flush_requested = True
++            self._cond.notify_all()
++            if not self._thread.is_alive():
++                return False
++            return self._cond.wait_for(drained, timeout)
++
++    def close(self, timeout: float = 10.0) -> None:
++        # 종료 시: 스레드가 남은 행을 모두 쓰고 끝나길 기다리고, 스레드가 없으면 여기서 직접 쓴다
++        with self._cond:
++            self._stopping = True
++            self._cond.notify_all()
++        if self._thread.is_alive():
++            self._thread.join(timeout)
++        with self._cond:
++            rows, self._pending = self._pending, OrderedDict()
++        if rows:
++            self._write(rows)
++
++    def status(self) -> Dict[str, Any]:
++        with self._cond:
++            pending = len(self._pending) + len(self._inflight)
++        return {
++            "pending": pending,
++            "batches": self.batches,
++            "rows_written": self.rows_written,
++            "coalesced": self.coalesced,
++            "sync_writes": self.sync_writes,
++            "errors": self.errors,
++        }
++
++    def _write(self, batch: Dict[Tuple[str, str], Dict]) -> Dict[Tuple[str, str], Dict]:
++        # 사용자별 한 트랜잭션. 실패한 사용자의 행만 돌려준다.
++        by_user: Dict[str, List[Dict]] = {}
++        for (uid, _), row in batch.items():
++            by_user.setdefault(uid, []).append(row)
++        failed: Dict[Tuple[str, str], Dict] = {}
++        for uid, rows in by_user.items():
++            try:
++                self.store.upsert_days(uid, rows)
++                self.rows_written += len(rows)
++            except Exception:
++                self.errors += 1
++                failed.update(((uid, row["date"]), row) for row in rows)
++        self.batches += 1
++        return failed
++
++    def _run(self) -> None:
++        backoff_s = 0.0
++        while True:
++            with self._cond:
++                self._cond.wait_for(lambda: self._pending or self._stopping)
++                if not self._pending:
++                    return
++                if not (self._flush_requested or self._stopping):
++                    # 첫 행이 들어온 뒤 delay_s 동안 더 받아 한 배치로 (flush 요청이 오면 바로)
++                    self._cond.wait_for(lambda: self._flush_requested or self._stopping, self.delay_s + backoff_s)
++                self._flush_requested = False
++                batch, self._pending = self._pending, OrderedDict()
++                self._inflight = dict(batch)
++                self._cond.notify_all()
++            failed = self._write(batch)
++            with self._cond:
++                for key, row in failed.items():
++                    # 그사이 더 새 값이 들어왔으면 그 값을 쓴다
++                    if key not in self._pending:
++                        self._pending[key] = row
++                self._inflight = {}
++                self._cond.notify_all()
++            backoff_s = min(30.0, max(1.0, backoff_s * 2)) if failed else 0.0
++            if failed and self._stopping:
++                return
++
++
++@st.cache_resource
++def _day_writer() -> Optional[WriteBehindQueue]:
++    if WRITE_BEHIND_S <= 0:
++        return None
++    writer = WriteBehindQueue(_history_store(), WRITE_BEHIND_S, WRITE_BEHIND_MAX_PENDING).start()
++    # 프로세스 종료(Ctrl+C, SIGTERM 후 정상 종료)에서도 받은 저장은 모두 쓴다
++    atexit.register(writer.close)
++    return writer
++
++
++def logout() -> None:
++    # 로그아웃 버튼 콜백: 이 계정의 대기 중인 체크인을 먼저 저장소에 쓴다 (제한 시간 안에 못 쓰면 백그라운드 재시도에 맡김)
++    writer = _day_writer()
++    if writer is not None:
++        writer.flush(st.session_state.user_id, WRITE_BEHIND_FLUSH_TIMEOUT_S)
++    st.logout()
++
++
++def logged_in_user_id() -> Optional[str]:
++    # st.login()이 설정된 배포에서만 값이 있다
++    try:
++        if st.user.get("is_logged_in"):
++            return st.user.get("email") or st.user.get("sub")
++    except Exception:
++        pass
++    return None
++
++
++class HabitService:
++    # 한 사용자 기준의 서비스 계층: 화면 코드는 user_id를 넘기지 않고 이 객체만 사용한다.
++    # writer가 있으면 save_day는 큐에 넣고 바로 돌아온다. 날짜별 행 조회(day/range/month)는 아직 쓰지 않은
++    # 행을 덮어 보여 주고, 스트릭/롤업/열 캐시 같은 파생 값은 저장 후 revision이 오르면 따라온다.
++    def __init__(self, store: HistoryRepository, user_id: str, writer: Optional[WriteBehindQueue] = None) -> None:
++        self.store = store
++        self.user_id = user_id
++        self.writer = writer
++
++    def seed_demo_if_empty(self) -> None:
++        if not DEMO_SEED or self.store.has_rows(self.user_id):
++            return
++        # 처음 쓰는 사용자: 데모용 6일 샘플 데이터 + 오늘은 사용자가 입력
++        base = datetime.now().date()
++        sample_days = 6
++        rows = []
++        # 샘플은 약간의 변동을 주기 위한 패턴
++        patterns = [
++            (3, 6), (4, 7), (2, 5), (5, 8), (3, 7), (4, 6)
++        ]
++        for i in range(sample_days, 0, -1):
++            d = base - timedelta(days=i)
++            done, mood = patterns[(sample_days - i) % len(patterns)]
++            pct = (done / 5) * 100
++            rows.append(
++                {"date": d.strftime("%Y-%m-%d"), "done": done, "pct": pct, "mood": mood, "habit_mask": (1 << done) - 1}
++            )
++        self.store.upsert_days(self.user_id, rows)
++
++    def save_day(self, row: Dict) -> None:
++        if self.writer is not None:
++            self.writer.put(self.user_id, row)
++        else:
++            self.store.upsert_days(self.user_id, [row])
++
++    def flush(self) -> None:
++        # 대기 중인 저장을 제한 시간 안에 모두 쓰지 못하면 저장소를 직접 읽고 쓰는 작업을 거절한다
++        if self.writer is not None and not self.writer.flush(self.user_id, WRITE_BEHIND_FLUSH_TIMEOUT_S):
++            raise RuntimeError("아직 저장하지 못한 기록이 있습니다. 잠시 후 다시 시도해 주세요.")
++
++    def _with_pending(self, rows: List[Dict], start: str, end: str) -> List[Dict]:
++        pending = self.writer.pending_rows(self.user_id, start, end) if self.writer is not None else []
++        if not pending:
++            return rows
++        merged = {row["date"]: row for row in rows}
++        merged.update((row["date"], row) for row in pending)
++        return [merged[d] for d in sorted(merged)]
++
++    def day(self, day: date) -> Optional[Dict]:
++        rows = self.range(day, day)
++        return rows[0] if rows else None
++
++    def range(self, start: date, end: date) -> List[Dict]:
++        start_s, end_s = start.isoformat(), end.isoformat()
++        return self._with_pending(self.store.get_range(self.user_id, start_s, end_s), start_s, end_s)
++
++    def month(self, year: int, month: int) -> List[Dict]:
++        return self.range(date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1]))
++
++    def months(self) -> List[str]:
++        return self.store.list_months(self.user_id)
++
++    def streak(self, today_done: bool) -> int:
++        return calc_streak(self.store, self.user_id, today_done)
++
++    def longest_streak(self) -> int:
++        return self.store.longest_streak(self.user_id)
++
++    def revision(self) -> int:
++        return self.store.revision(self.user_id)
++
++    def rollups(self, period: str, start: date, end: date) -> List[Dict]:
++        return self.store.get_rollups(self.user_id, period, period_start(start, period), end)
++
++    def rollup(self, period: str, day: date) -> Optional[Dict]:
++        start = period_start(day, period)
++        rows = self.store.get_rollups(self.user_id, period, start, start)
++        return rows[0] if rows else None
++
++    def columns(self) -> "HabitColumns":
++        return history_columns(self.user_id, self.revision())
++
++    def settings(self) -> Dict[str, str]:
++        return self.store.get_settings(self.user_id)
++
++    def save_settings(self, settings: Dict[str, str]) -> None:
++        self.store.save_settings(self.user_id, settings)
++
++    def export_history(self, fmt: str) -> bytes:
++        # 내려받기 버튼용: 임시 파일에 청크 단위로 쓰고 완성본만 읽는다. flush 실패(RuntimeError)면 내려받기가 실패로 끝난다.
++        self.flush()
++        with tempfile.SpooledTemporaryFile(max_size=8 << 20) as buf:
++            write_history(buf, fmt, export_history_chunks(self.store, [self.user_id]))
++            buf.seek(0)
++            return buf.read()
++
++    def import_history(self, inp: BinaryIO, fmt: str) -> Dict[str, Any]:
++        # 파일의 user_id 열은 무시하고 모두 이 사용자 기록으로 넣는다. 대기 중인 저장이 가져온 행을 덮지 않게 먼저 쓴다.
++        self.flush()
++        return import_history(self.store, read_history(inp, fmt), user_id=self.user_id)
++
++
++# -----------------------------
++# 기간 집계 (주/월 롤업)
++# -----------------------------
++ROLLUP_PERIODS = ("week", "month")
++
++
++def period_start(day: date, period: str) -> date:
++    # 주는 월요일, 월은 1일
++    return day - timedelta(days=day.weekday()) if period == "week" else day.replace(day=1)
++
++
++def empty_rollup(start: date) -> Dict:
++    return {"start": start, "days": 0, "pct_sum": 0.0, "mood_sum": 0, "mood_days": 0, "habits": [0] * len(HABITS)}
++
++
++def rollup_with_day(rollup: Optional[Dict], start: date, saved: Optional[Dict], current: Dict) -> Dict:
++    # 롤업은 저장된 기록 기준: 저장된 오늘 행(saved)을 빼고 아직 저장 전인 화면 값(current)을 더한다
++    r = dict(rollup or empty_rollup(start))
++    r["habits"] = list(r["habits"])
++    for row, sign in ((saved, -1), (current, 1)):
++        if row is None:
++            continue
++        r["days"] += sign
++        r["pct_sum"] += sign * row["pct"]
++        if row.get("mood"):
++            r["mood_sum"] += sign * row["mood"]
++            r["mood_days"] += sign
++        for i in range(len(HABITS)):
++            r["habits"][i] += sign * ((row["habit_mask"] >> i) & 1)
++    return r
++
++
++def rollup_pct(rollup: Optional[Dict]) -> Optional[float]:
++    return rollup["pct_sum"] / rollup["days"] if rollup and rollup["days"] else None
++
++
++def rollup_mood(rollup: Optional[Dict]) -> Optional[float]:
++    return rollup["mood_sum"] / rollup["mood_days"] if rollup and rollup["mood_days"] else None
++
++
++# -----------------------------
++# 기록 내보내기 / 가져오기 (스트리밍)
++# -----------------------------
++# 행 형식: user_id, date, done, pct, mood, 습관별 0/1 플래그(HABITS 키). 모든 단계가 청크 단위라
++# 수백만 행도 DataFrame으로 한꺼번에 올리지 않고 옮긴다. Parquet은 pyarrow가 있을 때만 쓸 수 있다.
++HISTORY_IO_FORMATS = ("csv", "jsonl", "parquet")
++HISTORY_IO_MIME = {"csv": "text/csv", "jsonl": "application/x-ndjson", "parquet": "application/vnd.apache.parquet"}
++HISTORY_IO_CHUNK = 5000
++HISTORY_FIELDS = ["user_id", "date", "done", "pct", "mood"] + [key for key, _, _ in HABITS]
++_TRUE_FLAGS = {"1", "true", "yes", "y", "o"}
++_FALSE_FLAGS = {"0", "false", "no", "n", "x"}
++
++
++def history_format(path: str) -> str:
++    fmt = os.path.splitext(path)[1].lower().lstrip(".")
++    fmt = {"ndjson": "jsonl", "pq": "parquet"}.get(fmt, fmt)
++    if fmt not in HISTORY_IO_FORMATS:
++        raise ValueError(f"지원하지 않는 형식입니다: {path} (가능: {', '.join(HISTORY_IO_FORMATS)})")
++    return fmt
++
++
++def export_history_chunks(
++    store: HistoryRepository, user_ids: Iterable[str], chunk_size: int = HISTORY_IO_CHUNK
++) -> Iterator[List[Dict]]:
++    for uid in user_ids:
++        for records in store.iter_records(uid, chunk_size):
++            yield [
++                {"user_id": uid, "date": d, "done": done, "pct": pct, "mood": mood,
++                 **{key: (mask >> i) & 1 for i, (key, _, _) in enumerate(HABITS)}}
++                for d, done, pct, mood, mask in records
++            ]
++
++
++def _parquet_schema():
++    import pyarrow as pa
++
++    return pa.schema(
++        [("user_id", pa.string()), ("date", pa.string()), ("done", pa.int8()), ("pct", pa.float32()), ("mood", pa.int8())]
++        + [(key, pa.int8()) for key, _, _ in HABITS]
++    )
++
++
++def write_history(out: BinaryIO, fmt: str, chunks: Iterable[List[Dict]]) -> int:
++    # 청크를 받는 대로 out에 쓴다. 쓴 행 수를 돌려준다 (out은 닫지 않는다)
++    rows = 0
++    if fmt == "parquet":
++        import pyarrow as pa
++        import pyarrow.parquet as pq
++
++        schema = _parquet_schema()
++        with pq.ParquetWriter(out, schema, compression="zstd") as writer:
++            for chunk in chunks:
++                writer.write_batch(pa.RecordBatch.from_pylist(chunk, schema=schema))
++                rows += len(chunk)
++        return rows
++    if fmt == "csv":
++        text = io.TextIOWrapper(out, encoding="utf-8", newline="")
++        writer = csv.DictWriter(text, fieldnames=HISTORY_FIELDS)
++        writer.writeheader()
++        for chunk in chunks:
++            writer.writerows(chunk)
++            rows += len(chunk)
++        text.flush()
++        text.detach()
++        return rows
++    for chunk in chunks:
++        out.write("".join(json.dumps(row, ensure_ascii=False) + "\n" for row in chunk).encode("utf-8"))
++        rows += len(chunk)
++    return rows
++
++
++def read_history(inp: BinaryIO, fmt: str, chunk_size: int = HISTORY_IO_CHUNK) -> Iterator[List[Any]]:
++    # 원시 행(dict, JSONL은 한 줄 bytes)을 chunk_size개씩. 검증은 normalize_history_row에서 한다
++    if fmt == "parquet":
++        import pyarrow.parquet as pq
++
++        for batch in pq.ParquetFile(inp).iter_batches(batch_size=chunk_size):
++            yield batch.to_pylist()
++        return
++    if fmt == "csv":
++        rows: Iterator[Any] = csv.DictReader(io.TextIOWrapper(inp, encoding="utf-8-sig", newline=""))
++    else:
++        rows = (line for line in inp if line.strip())
++    chunk: List[Any] = []
++    for row in rows:
++        chunk.append(row)
++        if len(chunk) >= chunk_size:
++            yield chunk
++            chunk = []
++    if chunk:
++        yield chunk
++
++
++def _parse_flag(value: Any) -> int:
++    text = str(value).strip().lower()
++    if text in _TRUE_FLAGS:
++        return 1
++    if text in _FALSE_FLAGS:
++        return 0
++    raise ValueError(f"습관 플래그는 0/1이어야 합니다: {value!r}")
++
++
++def normalize_history_row(raw: Any) -> Tuple[Optional[str], Dict]:
++    # 원시 행 → (파일의 user_id, 저장소 행). 잘못된 값은 ValueError. pct는 done에서 다시 계산한다.
++    if isinstance(raw, (bytes, str)):
++        raw = json.loads(raw)
++    if not isinstance(raw, dict):
++        raise ValueError("행이 객체가 아닙니다")
++    day = date.fromisoformat(str(raw.get("date") or "").strip()[:10])
++    mask = 0
++    has_flags = False
++    for i, (key, _, _) in enumerate(HABITS):
++        if raw.get(key) not in (None, ""):
++            has_flags = True
++            mask |= _parse_flag(raw[key]) << i
++    if not has_flags and raw.get("habit_mask") not in (None, ""):
++        has_flags = True
++        mask = int(raw["habit_mask"]) & ((1 << len(HABITS)) - 1)
++    done = int(raw["done"]) if raw.get("done") not in (None, "") else bin(mask).count("1")
++    if not 0 <= done <= len(HABITS):
++        raise ValueError(f"done 범위 오류: {done}")
++    # 저장소는 done/달성률을 mask에서 다시 읽으므로 둘이 어긋난 행은 받지 않는다.
++    # 플래그가 없는 행은 done이 0일 때(mask 0)만 그대로 옮길 수 있다.
++    if has_flags and done != bin(mask).count("1"):
++        raise ValueError(f"done({done})과 습관 플래그가 맞지 않습니다")
++    if not has_flags and done:
++        raise ValueError(f"습관 플래그가 없어 done({done})을 저장할 수 없습니다")
++    mood = raw.get("mood")
++    mood = None if mood in (None, "") else int(mood)
++    if mood is not None and not 1 <= mood <= 10:
++        raise ValueError(f"mood 범위 오류: {mood}")
++    user = str(raw.get("user_id") or "").strip() or None
++    return user, {"date": day.isoformat(), "done": done, "pct": done / len(HABITS) * 100.0, "mood": mood,
++                  "habit_mask": mask}
++
++
++def import_history(
++    store: HistoryRepository, chunks: Iterable[List[Any]], user_id: Optional[str] = None, max_errors: int = 20
++) -> Dict[str, Any]:
++    # 청크마다 검증 → 사용자·날짜별 중복 제거(나중 행 우선) → 사용자별 한 트랜잭션으로 upsert.
++    # 청크를 넘는 중복은 upsert가 덮어쓰므로 결과는 같다. user_id가 있으면 파일의 user_id 열은 무시한다.
++    stats: Dict[str, Any] = {"rows": 0, "written": 0, "duplicates": 0, "invalid": 0, "errors": []}
++    users = set()
++    for chunk in chunks:
++        by_user: Dict[str, Dict[str, Dict]] = {}
++        for raw in chunk:
++            stats["rows"] += 1
++            try:
++                file_user, row = normalize_history_row(raw)
++                uid = user_id or file_user
++                if not uid:
++                    raise ValueError("user_id가 없습니다")
++            except (ValueError, TypeError, KeyError) as exc:
++                stats["invalid"] += 1
++                if len(stats["errors"]) < max_errors:
++                    stats["errors"].append(f"{stats['rows']}번째 행: {exc}")
++                continue
++            days = by_user.setdefault(uid, {})
++            if row["date"] in days:
++                stats["duplicates"] += 1
++            days[row["date"]] = row
++        for uid, days in by_user.items():
++            store.bulk_upsert_days(uid, list(days.values()))
++            stats["written"] += len(days)
++            users.add(uid)
++    stats["users"] = len(users)
++    return stats
++
++
++# -----------------------------
+ # session_state 초기화
+ # -----------------------------
+ def init_state() -> None:
+-    if "history" not in st.session_state:
+-        # 데모용 6일 샘플 데이터 + 오늘은 사용자가 입력
+-        base = datetime.now().date()
+-        sample_days = 6
+-        rows = []
+-        # 샘플은 약간의 변동을 주기 위한 패턴
+-        patterns = [
+-            (3, 6), (4, 7), (2, 5), (5, 8), (3, 7), (4, 6)
+-        ]
+-        for i in range(sample_days, 0, -1):
+-            d = base - timedelta(days=i)
+-            done, mood = patterns[(sample_days - i) % len(patterns)]
+-            pct = (done / 5) * 100
+-            rows.append({"date": d.strftime("%Y-%m-%d"), "done": done, "pct": pct, "mood": mood})
+-        st.session_state.history = rows
++    # 사용자 식별: 로그인 계정 > (dev 모드만) ?user= 쿼리 파라미터와 사이드바 입력 > 기본값
++    login_id = logged_in_user_id()
++    if login_id:
++        st.session_state.user_id = login_id
++    elif USER_MODE == "login":
++        st.session_state.user_id = ""
++    elif USER_MODE == "dev":
++        if "user_id" not in st.session_state:
++            st.session_state.user_id = st.query_params.get("user", DEFAULT_USER_ID)
++    else:
++        st.session_state.user_id = DEFAULT_USER_ID
+ 
+     if "today_record" not in st.session_state:
+         st.session_state.today_record = {
+             "date": _today_str(),
+             "habits": {k: False for k, _, _ in HABITS},
+             "mood": 7,
+@@ -311,249 +2020,2976 @@ def generate_report(
+                         if t:
+                             chunks.append(t)
+                 txt = "\n".join(chunks).strip() if chunks else None
+             return txt or None
+         except Exception:
+             pass
+ 
+         # 2) Chat Completions 폴백
+         try:
+             cc = client.chat.completions.create(
+                 model="gpt-5-mini",
+                 messages=[
+                     {"role": "system", "content": sys},
+                     {"role": "user", "content": user},
+                 ],
+             )
+             return (cc.choices[0].message.content or "").strip() or None
+         except Exception:
+             return None
+ 
+     except Exception:
+         return None
++
++
++# 위의 get_weather / get_dog_image / generate_report는 아래 fetch_* / generate_coach_report로 대체되어
++# 더 이상 호출하지 않는다. 모듈 전역 requests를 쓰는데 requests는 이제 지연 import라 호출하면 NameError이므로 지운다.
++del get_weather, get_dog_image, generate_report
++
++
++# -----------------------------
++# 공유 HTTP / OpenAI 클라이언트
++# -----------------------------
++# fetch_* / generate_coach_report는 예전 함수와 같은 계약(반환 dict 키, 실패 시 None)을 유지하면서
++# 프로세스 전역 커넥션 풀과 OpenAI 클라이언트를 재사용한다.
++OWM_URL = os.environ.get("HABIT_OWM_URL", "https://api.openweathermap.org/data/2.5/weather")
++DOG_API_URL = os.environ.get("HABIT_DOG_API_URL", "https://dog.ceo/api/breeds/image/random")
++REPORT_MODEL = "gpt-5-mini"
++
++HTTP_POOL_SIZE = 16
++# 호스트별 (connect, read) timeout
++HTTP_TIMEOUTS: Dict[str, Tuple[float, float]] = {
++    "api.openweathermap.org": (3.05, 10.0),
++    "dog.ceo": (3.05, 10.0),
++    "images.dog.ceo": (3.05, 15.0),
++}
++HTTP_DEFAULT_TIMEOUT = (3.05, 10.0)
++# 이보다 느린 응답은 회로 차단기에서 실패로 센다 (느린 업스트림도 열어서 빨리 폴백하도록)
++BREAKER_SLOW_CALL_S = {"weather": 5.0, "dog": 5.0}
++BREAKER_OPEN_S = float(os.environ.get("HABIT_BREAKER_OPEN_S", 30))
++OPENAI_TIMEOUT_S = 30.0
++# 리포트 호출 경로: auto(감지 후 기억) | responses | chat (고정)
++OPENAI_API_PATH = os.environ.get("HABIT_OPENAI_API_PATH", "auto")
++REPORT_PATHS = ("responses", "chat")
++# 리포트 프롬프트(시스템+사용자 메시지) 토큰 예산. 기록 요약은 중요한 줄부터 예산 안에 드는 만큼만 붙인다.
++REPORT_PROMPT_TOKENS = int(os.environ.get("HABIT_REPORT_PROMPT_TOKENS", 700))
++# 출력 토큰 상한 (0이면 모델 기본값). 추론 모델은 추론 토큰도 이 상한에 포함되므로 너무 낮추지 않는다.
++REPORT_MAX_OUTPUT_TOKENS = int(os.environ.get("HABIT_REPORT_MAX_OUTPUT_TOKENS", 0))
++FETCH_TIMEOUT_S = 10.0
++REPORT_DEADLINE_S = 40.0
++
++
++@st.cache_resource
++def _http_session() -> requests.Session:
++    import requests
++    from requests.adapters import HTTPAdapter
++    from urllib3.util.retry import Retry
++
++    retry = Retry(
++        total=2,
++        connect=2,
++        read=1,
++        status=2,
++        backoff_factor=0.3,
++        backoff_jitter=0.3,
++        status_forcelist=(429, 500, 502, 503, 504),
++        allowed_methods=frozenset({"GET"}),
++        respect_retry_after_header=True,
++    )
++    adapter = HTTPAdapter(
++        pool_connections=len(HTTP_TIMEOUTS) + 2,
++        pool_maxsize=HTTP_POOL_SIZE,
++        pool_block=True,
++        max_retries=retry,
++    )
++    session = requests.Session()
++    session.mount("https://", adapter)
++    session.mount("http://", adapter)
++    session.headers["User-Agent"] = "ai-habit-tracker/1.0"
++    return session
++
++
++def http_get(url: str, params: Optional[Dict[str, Any]] = None) -> requests.Response:
++    timeout = HTTP_TIMEOUTS.get(urlparse(url).hostname or "", HTTP_DEFAULT_TIMEOUT)
++    return _http_session().get(url, params=params, timeout=timeout)
++
++
++@st.cache_resource
++def _breakers() -> Dict[str, CircuitBreaker]:
++    return {name: CircuitBreaker(open_s=BREAKER_OPEN_S) for name in ("weather", "dog", "openai")}
++
++
++def guarded_get(upstream: str, url: str, params: Optional[Dict[str, Any]] = None) -> Optional[requests.Response]:
++    # 회로가 열려 있으면 호출 없이 None. 연결 오류, 5xx/429, 느린 응답만 실패로 센다(잘못된 키·도시는 장애가 아님).
++    import requests
++
++    breaker = _breakers()[upstream]
++    if not breaker.allow():
++        return None
++    t0 = time.monotonic()
++    try:
++        r = http_get(url, params)
++    except requests.RequestException:
++        breaker.record(False)
++        return None
++    slow = time.monotonic() - t0 > BREAKER_SLOW_CALL_S.get(upstream, float("inf"))
++    breaker.record(r.status_code < 500 and r.status_code != 429 and not slow)
++    return r
++
++
++def _is_upstream_failure(exc: BaseException) -> bool:
++    # 연결/타임아웃/5xx/429는 업스트림 장애: 같은 서버의 다른 API 경로로 다시 시도해도 소용없다.
++    # 그 밖의 오류(이 SDK/모델이 지원하지 않는 경로 등)는 다른 경로로 넘어갈 만하다.
++    import openai
++
++    return isinstance(exc, (openai.APIConnectionError, openai.InternalServerError, openai.RateLimitError))
++
++
++@st.cache_resource(max_entries=64)
++def _openai_client(api_key: str):
++    from openai import OpenAI
++
++    return OpenAI(api_key=api_key, timeout=OPENAI_TIMEOUT_S, max_retries=1)
++
++
++class ApiPathMemory:
++    # (키, 모델)별로 실제로 동작한 OpenAI 호출 경로를 기억한다. 처음 한 번만 Responses → Chat 순서로 감지하고,
++    # 이후에는 기억한 경로부터 호출한다. pinned가 있으면 감지 없이 그 경로만 쓴다.
++    # Responses를 모르는 SDK(client.responses 없음)는 네트워크 호출 없이 바로 Chat으로 간다.
++    def __init__(self, pinned: str = "auto") -> None:
++        self.pinned = pinned if pinned in REPORT_PATHS else None
++        self._paths: Dict[Tuple[str, str], str] = {}
++        self._lock = threading.Lock()
++
++    @staticmethod
++    def _key(api_key: str, model: str) -> Tuple[str, str]:
++        # 키 원문 대신 지문만 보관한다
++        return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16], model
++
++    def candidates(self, client, api_key: str, model: str = REPORT_MODEL) -> List[str]:
++        if self.pinned:
++            return [self.pinned]
++        supported = [p for p in REPORT_PATHS if p != "responses" or hasattr(client, "responses")]
++        with self._lock:
++            known = self._paths.get(self._key(api_key, model))
++        if known in supported:
++            return [known] + [p for p in supported if p != known]
++        return supported
++
++    def remember(self, api_key: str, path: str, model: str = REPORT_MODEL) -> None:
++        with self._lock:
++            self._paths[self._key(api_key, model)] = path
++
++    def forget(self, api_key: str, path: str, model: str = REPORT_MODEL) -> None:
++        # 기억한 경로가 업스트림 장애가 아닌 이유로 실패하면(모델/SDK 변경 등) 다시 감지한다
++        with self._lock:
++            if self._paths.get(self._key(api_key, model)) == path:
++                del self._paths[self._key(api_key, model)]
++
++    def describe(self, api_key: str, model: str = REPORT_MODEL) -> str:
++        if self.pinned:
++            return f"{self.pinned} (고정)"
++        with self._lock:
++            known = self._paths.get(self._key(api_key, model))
++        return f"{known} (자동 감지)" if known else "아직 감지 전"
++
++
++@st.cache_resource
++def _api_paths() -> ApiPathMemory:
++    return ApiPathMemory(OPENAI_API_PATH)
++
++
++@instrumented("weather", none_is_error=True)
++def fetch_weather(city: str, api_key: str) -> Optional[Dict]:
++    if not api_key:
++        return None
++    try:
++        r = guarded_get("weather", OWM_URL, params={"q": city, "appid": api_key, "units": "metric", "lang": "kr"})
++        if r is None or r.status_code != 200:
++            return None
++        data = r.json()
++        main = data.get("main", {})
++        weather = {
++            "city": data.get("name", city),
++            "desc_kr": (data.get("weather") or [{}])[0].get("description", ""),
++            "temp_c": round(float(main.get("temp", 0.0)), 1),
++            "feels_like_c": round(float(main.get("feels_like", 0.0)), 1),
++            "humidity": main.get("humidity"),
++            "wind_ms": data.get("wind", {}).get("speed"),
++        }
++        _last_known_weather()[city] = weather
++        return weather
++    except Exception:
++        return None
++
++
++@st.cache_resource
++def _last_known_weather() -> Dict[str, Dict]:
++    # 도시별 마지막 정상 응답 (만료 없음): 업스트림 장애 시 폴백
++    return {}
++
++
++def last_known_weather(city: str) -> Optional[Dict]:
++    weather = _last_known_weather().get(city)
++    return dict(weather, fallback=True) if weather else None
++
++
++def _breed_from_url(url: str) -> str:
++    # https://images.dog.ceo/breeds/hound-afghan/n02088094_1003.jpg -> "Afghan Hound"
++    try:
++        slug = url.split("/breeds/")[1].split("/")[0]
++    except IndexError:
++        return "Unknown"
++    return " ".join(reversed(slug.split("-"))).title()
++
++
++@instrumented("dog_image", none_is_error=True)
++def fetch_dog_image() -> Optional[Dict]:
++    try:
++        r = guarded_get("dog", DOG_API_URL)
++        if r is None or r.status_code != 200:
++            return None
++        url = r.json().get("message")
++        if not url:
++            return None
++        return {"url": url, "breed": _breed_from_url(url)}
++    except Exception:
++        return None
++
++
++# dog.ceo 장애 시 쓰는 내장 이미지 (SVG data URI라 네트워크가 필요 없다)
++FALLBACK_DOGS = (
++    ("Shiba Inu", "#f59e0b"),
++    ("Golden Retriever", "#eab308"),
++    ("Beagle", "#a16207"),
++    ("Pomeranian", "#fb923c"),
++    ("Border Collie", "#64748b"),
++    ("Maltese", "#cbd5e1"),
++)
++
++
++def fallback_dog() -> Dict:
++    # 날짜별로 고정: 같은 날에는 같은 강아지라 리포트 프롬프트(와 캐시 키)가 흔들리지 않는다
++    breed, color = FALLBACK_DOGS[datetime.now().toordinal() % len(FALLBACK_DOGS)]
++    svg = (
++        '<svg xmlns="http://www.w3.org/2000/svg" width="480" height="320" viewBox="0 0 480 320">'
++        f'<rect width="480" height="320" rx="24" fill="{color}"/>'
++        '<text x="240" y="150" font-size="140" text-anchor="middle" dominant-baseline="central">🐶</text>'
++        '<text x="240" y="280" font-size="28" font-family="sans-serif" font-weight="700" fill="#0f172a"'
++        f' text-anchor="middle">{breed}</text></svg>'
++    )
++    url = "data:image/svg+xml;base64," + base64.b64encode(svg.encode("utf-8")).decode("ascii")
++    return {"url": url, "breed": breed, "fallback": True}
++
++
++def estimate_tokens(text: str) -> int:
++    # 토크나이저 없이 넉넉하게 어림한다: 한글 등 비ASCII 문자는 1자 1토큰, ASCII는 공백으로 나눈 낱말당 4자 1토큰.
++    # 예산 판단용이고, 실제 사용량은 API 응답의 usage로 따로 집계한다.
++    non_ascii = sum(1 for ch in text if ord(ch) > 127)
++    words = text.encode("ascii", "ignore").decode("ascii").split()
++    return non_ascii + sum(-(-len(word) // 4) for word in words)
++
++
++def prompt_token_estimate(messages: List[Dict[str, str]]) -> int:
++    # 메시지마다 역할/구분자 몫으로 4토큰을 더한다
++    return sum(estimate_tokens(m["content"]) + 4 for m in messages)
++
++
++def build_report_prompt(
++    coach_style: str,
++    habit_state: Dict[str, bool],
++    mood: int,
++    weather: Optional[Dict],
++    dog: Optional[Dict],
++    digest: Sequence[str] = (),
++    budget: int = REPORT_PROMPT_TOKENS,
++) -> Tuple[str, str]:
++    # 오늘 입력은 항상 넣고, 기록 요약(digest)은 앞줄부터 예산을 넘기 전까지만 붙인다
++    done, pct = calc_achievement(habit_state)
++    system = (
++        f"너는 습관 코치다. 코치 스타일: {coach_style} ({COACH_STYLES.get(coach_style, '')})\n"
++        "사용자의 오늘 습관 체크 결과, 기분, 날씨, 오늘의 강아지를 바탕으로 한국어 마크다운 리포트를 쓴다.\n"
++        "형식: **컨디션 등급(S~D)**, 습관 분석, 날씨 코멘트, 내일 미션 3가지, 오늘의 한마디. 10~15줄 이내."
++    )
++    if digest:
++        system += "\n최근 기록 요약이 있으면 추세와 가장 약한 습관을 습관 분석과 내일 미션에 반영한다."
++    habit_lines = [
++        f"- {emoji} {label}: {'완료' if habit_state.get(key, False) else '미완료'}"
++        for key, emoji, label in HABITS
++    ]
++    if weather:
++        weather_line = (
++            f"{weather.get('city', '')} / {weather.get('desc_kr', '')} / {weather.get('temp_c', '')}°C "
++            f"(체감 {weather.get('feels_like_c', '')}°C) / 습도 {weather.get('humidity', '')}%"
++        )
++    else:
++        weather_line = "정보 없음"
++    user = "\n".join(
++        [
++            f"날짜: {_today_str()}",
++            f"달성률: {pct:.0f}% ({done}/{len(HABITS)})",
++            *habit_lines,
++            f"기분: {mood}/10",
++            f"날씨: {weather_line}",
++            f"오늘의 강아지: {dog.get('breed', 'Unknown') if dog else '정보 없음'}",
++        ]
++    )
++    used = estimate_tokens(system) + estimate_tokens(user) + 8
++    header = "최근 기록 요약:"
++    kept: List[str] = []
++    for line in digest:
++        cost = estimate_tokens(line) + 1 + (0 if kept else estimate_tokens(header) + 1)
++        if used + cost > budget:
++            break
++        kept.append(line)
++        used += cost
++    if kept:
++        user += "\n" + header + "".join(f"\n- {line}" for line in kept)
++    return system, user
++
++
++def _report_messages(
++    coach_style: str,
++    habit_state: Dict[str, bool],
++    mood: int,
++    weather: Optional[Dict],
++    dog: Optional[Dict],
++    digest: Sequence[str] = (),
++) -> List[Dict[str, str]]:
++    system, user = build_report_prompt(coach_style, habit_state, mood, weather, dog, digest)
++    return [
++        {"role": "system", "content": system},
++        {"role": "user", "content": user},
++    ]
++
++
++TEMPLATE_LINES = {
++    "스파르타 코치": ("변명은 없다. 빈칸은 내일 채운다.", "오늘 못 한 건 내일 제일 먼저 끝낸다."),
++    "따뜻한 멘토": ("오늘도 기록한 것 자체가 성장이에요.", "작은 한 걸음이면 충분해요. 내일도 함께해요."),
++    "게임 마스터": ("퀘스트 로그가 갱신되었다!", "내일의 보스전을 위해 HP를 채워 두자."),
++}
++
++
++def template_report(
++    coach_style: str,
++    habit_state: Dict[str, bool],
++    mood: int,
++    weather: Optional[Dict],
++    dog: Optional[Dict],
++) -> str:
++    # OpenAI를 쓸 수 없을 때의 규칙 기반 리포트. 형식은 build_report_prompt가 요청하는 것과 같다.
++    done, pct = calc_achievement(habit_state)
++    grade = next(g for g, lo in (("S", 90), ("A", 70), ("B", 50), ("C", 30), ("D", 0)) if pct >= lo)
++    done_labels = [f"{emoji} {label}" for key, emoji, label in HABITS if habit_state.get(key, False)]
++    missed = [(emoji, label) for key, emoji, label in HABITS if not habit_state.get(key, False)]
++    opener, closer = TEMPLATE_LINES.get(coach_style, TEMPLATE_LINES["따뜻한 멘토"])
++
++    if weather:
++        temp = weather.get("temp_c")
++        tip = "따뜻하게 입고" if isinstance(temp, (int, float)) and temp < 5 else "물 자주 마시며"
++        weather_line = f"{weather.get('city', '')} {weather.get('desc_kr', '')} {temp}°C — {tip} 움직여 보세요."
++    else:
++        weather_line = "날씨 정보를 받지 못했어요. 실내 루틴 위주로 계획해 보세요."
++    missions = [f"{emoji} {label} 다시 도전" for emoji, label in missed][:3]
++    missions += ["🔁 오늘 지킨 습관 그대로 유지", "📝 자기 전 내일 계획 한 줄 쓰기", "🚶 10분 걷기"][: 3 - len(missions)]
++
++    lines = [
++        f"**컨디션 등급: {grade}** ({pct:.0f}%, 기분 {mood}/10)",
++        f"- {opener}",
++        f"- 습관 분석: 완료 {done}/{len(HABITS)}" + (f" ({', '.join(done_labels)})" if done_labels else ""),
++        f"- 날씨 코멘트: {weather_line}",
++        "- 내일 미션:",
++        *[f"  {i}. {m}" for i, m in enumerate(missions, 1)],
++        f"- 오늘의 한마디: {closer}" + (f" {dog.get('breed', '')}도 응원해요! 🐶" if dog else ""),
++    ]
++    return "\n".join(lines)
++
++
++def report_cache_key(messages: List[Dict[str, str]]) -> str:
++    # 공백 차이는 같은 프롬프트로 본다. 날짜가 프롬프트에 들어가므로 키는 하루 단위로 바뀐다.
++    normalized = [{"role": m["role"], "content": " ".join(m["content"].split())} for m in messages]
++    payload = json.dumps({"model": REPORT_MODEL, "messages": normalized}, ensure_ascii=False, sort_keys=True)
++    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
++
++
++@instrumented("report", none_is_error=True)
++def _request_report(
++    client, api_key: str, messages: List[Dict[str, str]], paths: Optional[ApiPathMemory] = None
++) -> Optional[Tuple[str, Optional[Dict[str, int]]]]:
++    # (본문, 토큰 사용량). 사용량은 API가 알려 줄 때만 있다.
++    # 기억한 경로부터 호출하고, 그 경로가 업스트림 장애가 아닌 이유로 실패할 때만 다음 경로로 넘어간다.
++    paths = paths or _api_paths()
++    breaker = _breakers()["openai"]
++    if not breaker.allow():
++        return None
++    for path in paths.candidates(client, api_key):
++        try:
++            txt, usage = _TEXT_PATHS[path](client, messages)
++        except Exception as exc:
++            down = _is_upstream_failure(exc)
++            breaker.record(not down)
++            if down:
++                return None
++            paths.forget(api_key, path)
++            continue
++        breaker.record(True)
++        if usage:
++            _metrics().tokens("report", usage["prompt_tokens"], usage["completion_tokens"])
++        if txt:
++            paths.remember(api_key, path)
++            return txt, usage
++    return None
++
++
++def _usage_counts(usage: Any) -> Optional[Dict[str, int]]:
++    # Responses(input/output_tokens)와 Chat Completions(prompt/completion_tokens)의 usage를 같은 키로
++    if usage is None:
++        return None
++    prompt = getattr(usage, "input_tokens", None)
++    prompt = getattr(usage, "prompt_tokens", None) if prompt is None else prompt
++    completion = getattr(usage, "output_tokens", None)
++    completion = getattr(usage, "completion_tokens", None) if completion is None else completion
++    if prompt is None and completion is None:
++        return None
++    return {"prompt_tokens": int(prompt or 0), "completion_tokens": int(completion or 0)}
++
++
++def _output_limit(path: str) -> Dict[str, int]:
++    if REPORT_MAX_OUTPUT_TOKENS <= 0:
++        return {}
++    return {"max_output_tokens" if path == "responses" else "max_completion_tokens": REPORT_MAX_OUTPUT_TOKENS}
++
++
++def _responses_text(client, messages: List[Dict[str, str]]) -> Tuple[Optional[str], Optional[Dict[str, int]]]:
++    resp = client.responses.create(model=REPORT_MODEL, input=messages, **_output_limit("responses"))
++    return (getattr(resp, "output_text", None) or "").strip() or None, _usage_counts(getattr(resp, "usage", None))
++
++
++def _chat_text(client, messages: List[Dict[str, str]]) -> Tuple[Optional[str], Optional[Dict[str, int]]]:
++    cc = client.chat.completions.create(model=REPORT_MODEL, messages=messages, **_output_limit("chat"))
++    return (cc.choices[0].message.content or "").strip() or None, _usage_counts(getattr(cc, "usage", None))
++
++
++_TEXT_PATHS: Dict[str, Callable[[Any, List[Dict[str, str]]], Tuple[Optional[str], Optional[Dict[str, int]]]]] = {
++    "responses": _responses_text,
++    "chat": _chat_text,
++}
++
++
++def _complete_report(
++    openai_key: str, messages: List[Dict[str, str]]
++) -> Tuple[Optional[str], Optional[float], Optional[Dict[str, int]]]:
++    # (본문, 캐시 생성 시각, 토큰 사용량). 캐시 미스면 생성 시각은 None, 캐시 히트면 사용량은 None(호출 없음).
++    key = report_cache_key(messages)
++    cached = _report_store().get(key)
++    _metrics().cache_event("report", cached is not None)
++    if cached is not None:
++        return cached[0], cached[1], None
++    try:
++        client = _openai_client(openai_key)
++    except Exception:
++        _metrics().error("report")
++        return None, None, None
++
++    result = _request_report(client, openai_key, messages)
++    if result is None:
++        return None, None, None
++    txt, usage = result
++    _report_store().put(key, txt)
++    return txt, None, usage
++
++
++def generate_coach_report(
++    openai_key: str,
++    coach_style: str,
++    habit_state: Dict[str, bool],
++    mood: int,
++    weather: Optional[Dict],
++    dog: Optional[Dict],
++    digest: Sequence[str] = (),
++) -> Optional[str]:
++    if not openai_key:
++        return None
++    return _complete_report(openai_key, _report_messages(coach_style, habit_state, mood, weather, dog, digest))[0]
++
++
++def _responses_deltas(client, messages: List[Dict[str, str]], usage: Dict[str, int]) -> Iterator[str]:
++    # 사용량은 마지막 response.completed 이벤트에 실려 온다
++    for event in client.responses.create(model=REPORT_MODEL, input=messages, stream=True, **_output_limit("responses")):
++        kind = getattr(event, "type", "")
++        if kind == "response.output_text.delta" and event.delta:
++            yield event.delta
++        elif kind == "response.completed":
++            usage.update(_usage_counts(getattr(event.response, "usage", None)) or {})
++
++
++def _chat_deltas(client, messages: List[Dict[str, str]], usage: Dict[str, int]) -> Iterator[str]:
++    # include_usage를 모르는 예전 SDK는 TypeError: 사용량 없이 스트리밍만 한다
++    try:
++        stream = client.chat.completions.create(
++            model=REPORT_MODEL, messages=messages, stream=True, stream_options={"include_usage": True},
++            **_output_limit("chat"),
++        )
++    except TypeError:
++        stream = client.chat.completions.create(model=REPORT_MODEL, messages=messages, stream=True)
++    for chunk in stream:
++        if chunk.choices and chunk.choices[0].delta.content:
++            yield chunk.choices[0].delta.content
++        if getattr(chunk, "usage", None) is not None:
++            usage.update(_usage_counts(chunk.usage) or {})
++
++
++_STREAM_PATHS: Dict[str, Callable[[Any, List[Dict[str, str]], Dict[str, int]], Iterator[str]]] = {
++    "responses": _responses_deltas,
++    "chat": _chat_deltas,
++}
++
++
++def _stream_report(
++    client,
++    api_key: str,
++    messages: List[Dict[str, str]],
++    paths: Optional[ApiPathMemory] = None,
++    usage: Optional[Dict[str, int]] = None,
++) -> Iterator[Tuple[str, str]]:
++    # (경로, 텍스트 델타). 기억한 경로부터 시도하고, 첫 델타 전에 업스트림 장애가 아닌 이유로 실패했거나
++    # 빈 응답이면 다음 경로로 넘어간다. 첫 델타 이후의 오류는 호출자에게 그대로 올려 잘린 본문임을 알린다.
++    # usage를 넘기면 스트림이 끝난 뒤 토큰 사용량이 채워진다 (API가 알려 줄 때만).
++    paths = paths or _api_paths()
++    usage = {} if usage is None else usage
++    breaker = _breakers()["openai"]
++    if not breaker.allow():
++        return
++    for path in paths.candidates(client, api_key):
++        started = False
++        try:
++            for delta in _STREAM_PATHS[path](client, messages, usage):
++                if not started:
++                    started = True
++                    breaker.record(True)
++                    paths.remember(api_key, path)
++                yield path, delta
++        except Exception as exc:
++            down = _is_upstream_failure(exc)
++            breaker.record(not down)
++            if started:
++                raise
++            if down:
++                return
++            paths.forget(api_key, path)
++            continue
++        if started:
++            return
++        breaker.record(True)
++
++
++class ReportStream:
++    # st.write_stream에 그대로 넘길 수 있는 텍스트 델타 이터레이터.
++    # 소비가 끝나면 text(전체 본문), ttft_s(첫 토큰까지 걸린 시간), total_s, path, usage(토큰 사용량)가 채워진다.
++    # 같은 프롬프트의 신선한 리포트가 캐시에 있으면 API 없이 바로 돌려주고 cached_at을 채운다.
++    def __init__(
++        self,
++        openai_key: str,
++        messages: List[Dict[str, str]],
++        deadline_s: float,
++        paths: Optional[ApiPathMemory] = None,
++    ) -> None:
++        self.openai_key = openai_key
++        self.messages = messages
++        self.deadline_s = deadline_s
++        self.paths = paths or _api_paths()
++        self.cache_key = report_cache_key(messages)
++        self.text: Optional[str] = None
++        self.ttft_s: Optional[float] = None
++        self.total_s: Optional[float] = None
++        self.path: Optional[str] = None
++        self.cached_at: Optional[float] = None
++        self.usage: Dict[str, int] = {}
++
++    def __iter__(self) -> Iterator[str]:
++        started = time.monotonic()
++        deadline = started + self.deadline_s
++        chunks: List[str] = []
++        complete = False
++        try:
++            cached = _report_store().get(self.cache_key)
++            if cached is not None:
++                chunks.append(cached[0])
++                self.cached_at = cached[1]
++                self.ttft_s = time.monotonic() - started
++                self.path = "cache"
++                yield cached[0]
++                return
++
++            client = _openai_client(self.openai_key)
++            for path, delta in _stream_report(client, self.openai_key, self.messages, self.paths, self.usage):
++                if self.ttft_s is None:
++                    self.ttft_s = time.monotonic() - started
++                    self.path = path
++                chunks.append(delta)
++                yield delta
++                if time.monotonic() > deadline:
++                    break
++            else:
++                complete = bool(chunks)
++        except Exception:
++            pass
++        finally:
++            self.total_s = time.monotonic() - started
++            self.text = "".join(chunks).strip() or None
++            metrics = _metrics()
++            metrics.cache_event("report", self.path == "cache")
++            if self.path != "cache":
++                metrics.observe("report_stream", self.total_s)
++                if self.ttft_s is not None:
++                    metrics.observe("report_ttft", self.ttft_s)
++                if self.text is None:
++                    metrics.error("report_stream")
++                if self.usage:
++                    metrics.tokens("report", self.usage["prompt_tokens"], self.usage["completion_tokens"])
++            # deadline으로 잘린 본문은 캐시하지 않는다
++            if complete and self.text:
++                _report_store().put(self.cache_key, self.text)
++
++
++def stream_coach_report(
++    openai_key: str,
++    coach_style: str,
++    habit_state: Dict[str, bool],
++    mood: int,
++    weather: Optional[Dict],
++    dog: Optional[Dict],
++    deadline_s: float = REPORT_DEADLINE_S,
++    digest: Sequence[str] = (),
++) -> ReportStream:
++    return ReportStream(openai_key, _report_messages(coach_style, habit_state, mood, weather, dog, digest), deadline_s)
++
++
++# -----------------------------
++# 날씨 캐시 (도시별, 프로세스 전역)
++# -----------------------------
++WEATHER_TTL_S = 600.0
++# 만료 후에도 이 시간 동안은 이전 날씨를 즉시 돌려주고 뒤에서 갱신한다
++WEATHER_STALE_S = float(os.environ.get("HABIT_WEATHER_STALE_S", 3600))
++# 백그라운드 사전 갱신: 서버 키(OWM_API_KEY)가 있고 주기가 0보다 클 때만 동작
++WEATHER_PREFETCH_S = float(os.environ.get("HABIT_WEATHER_PREFETCH_S", 0))
++OWM_SERVER_KEY = os.environ.get("OWM_API_KEY", "")
++OWM_RATE_PER_MIN = float(os.environ.get("HABIT_OWM_RATE_PER_MIN", 50))
++PREFETCH_MAX_BACKOFF_S = 900.0
++
++
++@st.cache_resource
++def _owm_bucket() -> TokenBucket:
++    # OpenWeatherMap 무료 요금제(분당 60회)보다 낮게: 사전 갱신과 사용자 요청이 함께 나눠 쓴다
++    return TokenBucket(rate=OWM_RATE_PER_MIN / 60.0, capacity=len(CITIES))
++
++
++@st.cache_resource
++def _weather_cache() -> TTLCache:
++    # st.session_state가 아니라 프로세스 단위로 공유: 같은 도시 요청이 몰려도 업스트림 호출은 1회
++    cache = TTLCache(
++        maxsize=len(CITIES) * 2,
++        ttl_s=WEATHER_TTL_S,
++        stale_s=WEATHER_STALE_S,
++        refresh=lambda job: _fetch_pool().submit(job),
++    )
++    _metrics().track_cache("weather", cache.stats)
++    return cache
++
++
++def _fetch_weather_limited(city: str, api_key: str) -> Optional[Dict]:
++    if not api_key or not _owm_bucket().acquire(timeout=FETCH_TIMEOUT_S):
++        return None
++    return fetch_weather(city, api_key)
++
++
++def get_weather_cached(city: str, api_key: str) -> Optional[Dict]:
++    return _weather_cache().get_or_load(city, lambda: _fetch_weather_limited(city, api_key or OWM_SERVER_KEY))
++
++
++class WeatherPrefetcher:
++    # CITIES 전체를 주기적으로 미리 받아 날씨 캐시를 데워 둔다.
++    # 호출은 토큰 버킷으로 제한하고, 실패가 이어지면 지수 백오프(+지터)로 간격을 늘린다.
++    def __init__(self, api_key: str, interval_s: float) -> None:
++        self.api_key = api_key
++        self.interval_s = interval_s
++        self.rounds = 0
++        self.errors = 0
++        self.backoff_s = 0.0
++        self.last_round_at: Optional[float] = None
++        self._consecutive_errors = 0
++        self._stop = threading.Event()
++        self._thread = threading.Thread(target=self._run, name="weather-prefetch", daemon=True)
++
++    def start(self) -> "WeatherPrefetcher":
++        self._thread.start()
++        return self
++
++    def stop(self) -> None:
++        self._stop.set()
++
++    def refresh_all(self) -> None:
++        cache = _weather_cache()
++        for city in CITIES:
++            if self._stop.is_set():
++                return
++            _owm_bucket().acquire()
++            data = fetch_weather(city, self.api_key)
++            if data is None:
++                self.errors += 1
++                self._consecutive_errors += 1
++                self.backoff_s = min(PREFETCH_MAX_BACKOFF_S, 2.0 ** self._consecutive_errors)
++                self._stop.wait(self.backoff_s * (0.5 + np.random.random()))
++                continue
++            self._consecutive_errors = 0
++            self.backoff_s = 0.0
++            # 다음 갱신 전까지 신선하게 유지되도록 TTL을 주기보다 길게 잡는다
++            cache.set(city, data, ttl_s=max(WEATHER_TTL_S, self.interval_s * 1.5))
++        self.rounds += 1
++        self.last_round_at = time.time()
++
++    def _run(self) -> None:
++        while not self._stop.is_set():
++            try:
++                self.refresh_all()
++            except Exception:
++                self.errors += 1
++            self._stop.wait(self.interval_s + self.backoff_s)
++
++    def status(self) -> Dict[str, Any]:
++        return {
++            "rounds": self.rounds,
++            "errors": self.errors,
++            "backoff_s": self.backoff_s,
++            "last_round_at": self.last_round_at,
++        }
++
++
++@st.cache_resource
++def _weather_prefetcher() -> Optional[WeatherPrefetcher]:
++    if WEATHER_PREFETCH_S <= 0 or not OWM_SERVER_KEY:
++        return None
++    return WeatherPrefetcher(OWM_SERVER_KEY, WEATHER_PREFETCH_S).start()
++
++
++# -----------------------------
++# 강아지 이미지 풀 (사전 준비)
++# -----------------------------
++DOG_POOL_SIZE = int(os.environ.get("HABIT_DOG_POOL_SIZE", 8))
++DOG_THUMB_PX = 480
++DOG_THUMB_KEEP = 64
++
++
++class DogPool:
++    # 랜덤 강아지 N개({"url", "breed", "thumb"})를 미리 받아 둔다. thumb는 디스크에 저장한 축소 JPEG 경로(없을 수 있음).
++    # take()는 기다리지 않고 꺼내기만 하고, 빈 자리는 백그라운드 스레드가 채운다.
++    # 목록(pool.json)은 채움 스레드만 쓰므로 파일 쓰기 경합이 없고, 재시작 후에도 남은 항목을 바로 쓸 수 있다.
++    def __init__(self, directory: str, size: int) -> None:
++        self.directory = directory
++        self.size = size
++        self.refills = 0
++        self.errors = 0
++        self.backoff_s = 0.0
++        self._lock = threading.Lock()
++        self._wake = threading.Event()
++        self._stop = threading.Event()
++        self._entries: deque[Dict] = deque(self._load())
++        self._thread = threading.Thread(target=self._run, name="dog-pool", daemon=True)
++
++    @property
++    def _manifest(self) -> str:
++        return os.path.join(self.directory, "pool.json")
++
++    def start(self) -> "DogPool":
++        os.makedirs(self.directory, exist_ok=True)
++        self._thread.start()
++        return self
++
++    def stop(self) -> None:
++        self._stop.set()
++        self._wake.set()
++
++    def __len__(self) -> int:
++        with self._lock:
++            return len(self._entries)
++
++    def take(self) -> Optional[Dict]:
++        with self._lock:
++            entry = self._entries.popleft() if self._entries else None
++        self._wake.set()
++        return entry
++
++    def _load(self) -> List[Dict]:
++        try:
++            with open(self._manifest, encoding="utf-8") as f:
++                entries = json.load(f)
++        except (OSError, ValueError):
++            return []
++        # 지워진 썸네일은 경로만 빼고 원본 URL로 쓴다
++        return [dict(e, thumb=e["thumb"] if e.get("thumb") and os.path.exists(e["thumb"]) else None)
++                for e in entries if e.get("url")][: self.size]
++
++    def _save(self) -> None:
++        with self._lock:
++            entries = list(self._entries)
++        tmp = self._manifest + ".tmp"
++        with open(tmp, "w", encoding="utf-8") as f:
++            json.dump(entries, f, ensure_ascii=False)
++        os.replace(tmp, self._manifest)
++
++    def _thumbnail(self, url: str) -> Optional[str]:
++        # 원본(수백 KB~수 MB)을 한 번만 받아 작은 JPEG로 줄여 둔다. Pillow가 없거나 실패하면 원본 URL을 그대로 쓴다.
++        try:
++            from PIL import Image
++        except ImportError:
++            return None
++        path = os.path.join(self.directory, hashlib.sha1(url.encode("utf-8")).hexdigest()[:20] + ".jpg")
++        if os.path.exists(path):
++            return path
++        try:
++            r = guarded_get("dog", url)
++            if r is None or r.status_code != 200:
++                return None
++            with Image.open(io.BytesIO(r.content)) as img:
++                img.thumbnail((DOG_THUMB_PX, DOG_THUMB_PX))
++                tmp = path + ".tmp"
++                img.convert("RGB").save(tmp, "JPEG", quality=80, optimize=True)
++            os.replace(tmp, path)
++            return path
++        except Exception:
++            return None
++
++    def _prune(self) -> None:
++        # 화면에 이미 나간 썸네일도 한동안 필요하므로 바로 지우지 않고 오래된 것부터 DOG_THUMB_KEEP개만 남긴다
++        with self._lock:
++            keep = {e["thumb"] for e in self._entries if e.get("thumb")}
++        files = sorted(
++            (os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(".jpg")),
++            key=os.path.getmtime,
++        )
++        for path in files[: max(0, len(files) - DOG_THUMB_KEEP)]:
++            if path not in keep:
++                try:
++                    os.remove(path)
++                except OSError:
++                    pass
++
++    def fill(self) -> bool:
++        # 빈 자리를 채운다. 실패하면 False (다음 시도는 백오프 후)
++        ok = True
++        while len(self) < self.size and not self._stop.is_set():
++            dog = fetch_dog_image()
++            if dog is None:
++                ok = False
++                break
++            entry = dict(dog, thumb=self._thumbnail(dog["url"]))
++            with self._lock:
++                self._entries.append(entry)
++            self.refills += 1
++        self._save()
++        self._prune()
++        return ok
++
++    def _run(self) -> None:
++        consecutive_errors = 0
++        while not self._stop.is_set():
++            try:
++                ok = self.fill()
++            except Exception:
++                ok = False
++            if ok:
++                consecutive_errors = 0
++                self.backoff_s = 0.0
++            else:
++                self.errors += 1
++                consecutive_errors += 1
++                self.backoff_s = min(PREFETCH_MAX_BACKOFF_S, 2.0 ** consecutive_errors)
++            # 꽉 찼으면 take()가 깨울 때까지 쉰다. 실패 중에는 백오프가 지나야 다시 시도한다
++            if self.backoff_s:
++                self._stop.wait(self.backoff_s * (0.5 + np.random.random()))
++            else:
++                self._wake.wait()
++            self._wake.clear()
++
++    def status(self) -> Dict[str, Any]:
++        with self._lock:
++            ready = len(self._entries)
++            thumbs = sum(1 for e in self._entries if e.get("thumb"))
++        return {"ready": ready, "thumbs": thumbs, "refills": self.refills, "errors": self.errors,
++                "backoff_s": self.backoff_s}
++
++
++@st.cache_resource
++def _dog_pool() -> Optional[DogPool]:
++    if DOG_POOL_SIZE <= 0:
++        return None
++    return DogPool(os.path.join(DATA_DIR, "dogs"), DOG_POOL_SIZE).start()
++
++
++def take_dog() -> Optional[Dict]:
++    # 풀에서 바로 꺼낸다. 비어 있으면(첫 기동 직후, 연속 클릭 등) 예전처럼 dog.ceo를 직접 호출한다
++    pool = _dog_pool()
++    return (pool.take() if pool is not None else None) or fetch_dog_image()
++
++
++def dog_image_src(dog: Dict) -> str:
++    # 썸네일이 디스크에 남아 있으면 그것을, 아니면 원본 URL(또는 내장 data URI)을 보여 준다
++    thumb = dog.get("thumb")
++    return thumb if thumb and os.path.exists(thumb) else dog.get("url", "")
++
++
++# -----------------------------
++# 리포트 파이프라인 (병렬 호출)
++# -----------------------------
++@st.cache_resource
++def _fetch_pool() -> ThreadPoolExecutor:
++    # 세션/재실행 간 공유되는 워커 풀 (버튼 클릭마다 스레드를 새로 만들지 않음)
++    return ThreadPoolExecutor(max_workers=16, thread_name_prefix="report-fetch")
++
++
++def _result_before(future: Future, deadline: float):
++    try:
++        return future.result(timeout=max(0.0, deadline - time.monotonic()))
++    except Exception:
++        return None
++
++
++def report_fingerprint(
++    city: str, coach_style: str, habit_state: Dict[str, bool], mood: int, digest: Sequence[str]
++) -> str:
++    # 날씨/강아지를 뺀 사용자 입력의 해시: 미리 만든 리포트가 지금 화면 입력으로 만든 것인지 비교한다
++    messages = _report_messages(coach_style, dict(habit_state), mood, None, None, digest)
++    return hashlib.sha256(f"{city}\n{report_cache_key(messages)}".encode("utf-8")).hexdigest()
++
++
++def load_pregenerated_report(user_id: str, day: str, fingerprint: str) -> Optional[Dict]:
++    # batch-reports가 이 사용자에게 만들어 둔 리포트 (날씨/강아지는 그때 값). 다른 사용자와는 공유하지 않는다.
++    return _report_store().get_pregenerated(user_id, day, fingerprint, REPORT_PREGEN_FRESH_S)
++
++
++def fetch_report_inputs(city: str, owm_key: str, deadline: float) -> Tuple[Optional[Dict], Optional[Dict]]:
++    # 날씨/강아지는 동시에 호출: 소요 시간은 합이 아니라 느린 쪽 하나
++    pool = _fetch_pool()
++    weather_f = pool.submit(get_weather_cached, city, owm_key)
++    dog_f = pool.submit(take_dog)
++    fetch_deadline = min(deadline, time.monotonic() + FETCH_TIMEOUT_S)
++    wait([weather_f, dog_f], timeout=fetch_deadline - time.monotonic())
++    weather = _result_before(weather_f, fetch_deadline) or last_known_weather(city)
++    dog = _result_before(dog_f, fetch_deadline) or fallback_dog()
++    return weather, dog
++
++
++def fetch_report_bundle(
++    city: str,
++    owm_key: str,
++    openai_key: str,
++    coach_style: str,
++    habit_state: Dict[str, bool],
++    mood: int,
++    deadline_s: float = REPORT_DEADLINE_S,
++    digest: Sequence[str] = (),
++) -> Tuple[Optional[Dict], Optional[Dict], Optional[str], Optional[float], Optional[Dict[str, int]]]:
++    # 입력(날씨/강아지)이 준비되는 즉시 리포트 생성을 시작하고, deadline을 넘긴 결과는 None.
++    # 뒤의 두 값은 캐시에서 꺼낸 리포트의 생성 시각(캐시 미스면 None)과 이번 호출의 토큰 사용량.
++    deadline = time.monotonic() + deadline_s
++    weather, dog = fetch_report_inputs(city, owm_key, deadline)
++    if not openai_key:
++        return weather, dog, None, None, None
++    messages = _report_messages(coach_style, dict(habit_state), mood, weather, dog, digest)
++    report_f = _fetch_pool().submit(_complete_report, openai_key, messages)
++    text, cached_at, usage = _result_before(report_f, deadline) or (None, None, None)
++    return weather, dog, text, cached_at, usage
+ 
+ 
+ # -----------------------------
+-# 습관 체크인 UI
++# 기록 분석 (벡터화)
++# -----------------------------
++WEEKDAY_LABELS = ["월", "화", "수", "목", "금", "토", "일"]
++ROLLING_WINDOWS = (7, 30)
++
++
++_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
++# 비트마스크(uint8) → 완료한 습관 수
++_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
++
++
++class HabitColumns:
++    # 한 사용자 기록의 열 저장. 날짜는 date.toordinal() int32, 습관은 일별 비트마스크 uint8,
++    # 기분은 uint8(0 = 미기록)이라 하루 6바이트다 (dict 행은 하루 수백 바이트).
++    # days는 오름차순이고 배열은 읽기 전용: 기간/월 조회는 searchsorted로 자른 뷰라 복사가 없다.
++    __slots__ = ("days", "mask", "mood")
++
++    def __init__(self, days: np.ndarray, mask: np.ndarray, mood: np.ndarray) -> None:
++        for arr in (days, mask, mood):
++            arr.flags.writeable = False
++        self.days = days
++        self.mask = mask
++        self.mood = mood
++
++    @classmethod
++    def from_records(cls, records: List[Tuple]) -> "HabitColumns":
++        # HistoryRepository.get_records()의 (date, done, pct, mood, habit_mask) 튜플
++        n = len(records)
++        days = np.array([r[0] for r in records], dtype="datetime64[D]").astype(np.int32) + _EPOCH_ORDINAL
++        mask = np.fromiter((r[4] for r in records), dtype=np.uint8, count=n)
++        mood = np.fromiter((r[3] or 0 for r in records), dtype=np.uint8, count=n)
++        return cls(days, mask, mood)
++
++    def __len__(self) -> int:
++        return len(self.days)
++
++    @property
++    def nbytes(self) -> int:
++        return self.days.nbytes + self.mask.nbytes + self.mood.nbytes
++
++    @property
++    def done(self) -> np.ndarray:
++        return _POPCOUNT[self.mask]
++
++    @property
++    def pct(self) -> np.ndarray:
++        return self.done * (100.0 / len(HABITS))
++
++    def between(self, start: int, end: int) -> "HabitColumns":
++        # start <= day <= end (서수) 구간의 뷰
++        lo, hi = np.searchsorted(self.days, [start, end + 1])
++        return HabitColumns(self.days[lo:hi], self.mask[lo:hi], self.mood[lo:hi])
++
++    def range(self, start: date, end: date) -> "HabitColumns":
++        return self.between(start.toordinal(), end.toordinal())
++
++    def month(self, year: int, month: int) -> "HabitColumns":
++        last_day = calendar.monthrange(year, month)[1]
++        return self.between(date(year, month, 1).toordinal(), date(year, month, last_day).toordinal())
++
++    def with_day(self, row: Dict) -> "HabitColumns":
++        # 아직 저장 전인 하루(화면 값)를 끼워 넣은 사본. 짧은 구간(주/월)에만 쓴다.
++        day = np.array([date.fromisoformat(row["date"]).toordinal()], dtype=np.int32)
++        mask = np.array([int(row.get("habit_mask", 0))], dtype=np.uint8)
++        mood = np.array([int(row.get("mood") or 0)], dtype=np.uint8)
++        return self.merge(HabitColumns(day, mask, mood))
++
++    def merge(self, other: "HabitColumns") -> "HabitColumns":
++        # other의 날짜는 덮어쓰고 없던 날짜는 제자리에 끼운 사본. 배열 복사(O(n) memcpy)만 하고 다시 읽지 않는다.
++        i = np.searchsorted(self.days, other.days)
++        hit = i < len(self.days)
++        hit[hit] = self.days[i[hit]] == other.days[hit]
++        arrays = []
++        for mine, theirs in zip((self.days, self.mask, self.mood), (other.days, other.mask, other.mood)):
++            arr = mine.copy()
++            arr[i[hit]] = theirs[hit]
++            arrays.append(np.insert(arr, i[~hit], theirs[~hit]))
++        return HabitColumns(*arrays)
++
++    def digest(self) -> str:
++        h = hashlib.blake2b(digest_size=16)
++        for arr in (self.days, self.mask, self.mood):
++            h.update(arr.tobytes())
++        return h.hexdigest()
++
++    def frame(self) -> pd.DataFrame:
++        # 차트용 DataFrame. mask/mood 열은 배열을 복사 없이 감싸고, 날짜 인덱스와 pct만 새로 만든다.
++        import pandas as pd
++
++        index = pd.DatetimeIndex((self.days - _EPOCH_ORDINAL).astype("datetime64[D]"), name="date")
++        return pd.DataFrame({"pct": self.pct, "mood": self.mood, "mask": self.mask}, index=index, copy=False)
++
++
++class ColumnsCache:
++    # 사용자별 최신 HabitColumns 하나와 그 revision. revision이 오르면 그 뒤에 쓴 행만 읽어 끼워 넣으므로
++    # 체크인 저장마다 전체 기록을 다시 읽지 않는다. 저장소가 바뀐 행을 모르면(records_since → None) 전체를 읽는다.
++    def __init__(self, store: HistoryRepository, max_users: int = 256) -> None:
++        self.store = store
++        self.max_users = max_users
++        self.full_loads = 0
++        self.incremental_loads = 0
++        self._latest: "OrderedDict[str, Tuple[int, HabitColumns]]" = OrderedDict()
++        self._lock = threading.Lock()
++
++    def get(self, user_id: str, revision: int) -> HabitColumns:
++        with self._lock:
++            cached = self._latest.get(user_id)
++            if cached is not None:
++                self._latest.move_to_end(user_id)
++        if cached is not None and cached[0] == revision:
++            return cached[1]
++        cols = None
++        if cached is not None and cached[0] < revision:
++            changed = self.store.records_since(user_id, cached[0])
++            if changed is not None:
++                cols = cached[1].merge(HabitColumns.from_records(changed)) if changed else cached[1]
++                self.incremental_loads += 1
++        if cols is None:
++            cols = HabitColumns.from_records(self.store.get_records(user_id))
++            self.full_loads += 1
++        with self._lock:
++            # 동시에 더 새 revision을 넣은 세션이 있으면 그쪽을 남긴다
++            if user_id not in self._latest or self._latest[user_id][0] <= revision:
++                self._latest[user_id] = (revision, cols)
++                self._latest.move_to_end(user_id)
++            while len(self._latest) > self.max_users:
++                self._latest.popitem(last=False)
++        return cols
++
++
++@st.cache_resource
++def _columns_cache() -> ColumnsCache:
++    return ColumnsCache(_history_store())
++
++
++def history_columns(user_id: str, revision: int) -> HabitColumns:
++    # 세션 간 같은 객체를 공유한다(cache_data처럼 매번 역직렬화하지 않음). 기록이 바뀌면 revision이 달라진다.
++    return _columns_cache().get(user_id, revision)
++
++
++def _contributions(cols: HabitColumns) -> Tuple[np.ndarray, ...]:
++    # 행들이 합계에 보태는 몫: (습관별 완료 수, 요일별 기록일, 요일 x 습관 완료 수, 요일별 완료 습관 수,
++    # 기분 적률 [n, Σ기분, Σ완료, Σ기분², Σ완료², Σ기분·완료]). 전부 정수라 더하고 빼도 오차가 없다.
++    weekday = (cols.days - 1) % 7  # 서수 1(0001-01-01)은 월요일, 월=0
++    done = cols.done.astype(np.int64)
++    bits = ((cols.mask[:, None] >> np.arange(len(HABITS))) & 1).astype(np.int64)
++    heat = np.stack([np.bincount(weekday, weights=bits[:, i], minlength=7) for i in range(len(HABITS))], axis=1)
++    ok = cols.mood > 0
++    x, y = cols.mood[ok].astype(np.int64), done[ok]
++    moments = np.array([len(x), x.sum(), y.sum(), (x * x).sum(), (y * y).sum(), (x * y).sum()], dtype=np.int64)
++    return (
++        bits.sum(axis=0),
++        np.bincount(weekday, minlength=7).astype(np.int64),
++        heat.astype(np.int64),
++        np.bincount(weekday, weights=done, minlength=7).astype(np.int64),
++        moments,
++    )
++
++
++class RunningAnalytics:
++    # compute_analytics의 중간 합계. 일 단위 완료 수/누적합/이동 평균 배열과 요일·습관·기분 합계를 들고 있어
++    # 바뀐 행만 빼고 더하면(apply) 다음 revision의 결과가 된다. 이동 평균은 가장 이른 변경일 뒤만 다시 계산한다.
++    __slots__ = ("start", "daily", "csum", "avgs", "sums")
++
++    def __init__(self, start: int, daily: np.ndarray, csum: np.ndarray, avgs: Dict[int, np.ndarray], sums: Tuple[np.ndarray, ...]) -> None:
++        self.start = start
++        self.daily = daily
++        self.csum = csum
++        self.avgs = avgs
++        self.sums = sums
++
++    @classmethod
++    def from_columns(cls, cols: HabitColumns) -> "RunningAnalytics":
++        if len(cols) == 0:
++            return cls(0, np.zeros(0, dtype=np.int64), np.zeros(1, dtype=np.int64), {}, _contributions(cols))
++        start = int(cols.days[0])
++        daily = np.zeros(int(cols.days[-1]) - start + 1, dtype=np.int64)
++        daily[cols.days - start] = cols.done
++        return cls(start, daily, np.zeros(1, dtype=np.int64), {}, _contributions(cols))._rolled_from(0, daily)
++
++    def _rolled_from(self, k: int, daily: np.ndarray) -> "RunningAnalytics":
++        # daily[k:]가 바뀐 사본: 누적합과 이동 평균을 k 뒤로만 다시 계산하고 앞부분은 복사한다
++        n_days = len(daily)
++        csum = np.empty(n_days + 1, dtype=np.int64)
++        csum[: k + 1] = self.csum[: k + 1]
++        csum[k + 1 :] = csum[k] + np.cumsum(daily[k:])
++        pos = np.arange(k + 1, n_days + 1)
++        avgs = {}
++        for w in ROLLING_WINDOWS:
++            avg = np.empty(n_days)
++            if k:
++                avg[:k] = self.avgs[w][:k]
++            lo = np.maximum(pos - w, 0)
++            avg[k:] = (csum[pos] - csum[lo]) * (100.0 / len(HABITS)) / np.minimum(pos, w)
++            avgs[w] = avg
++        return RunningAnalytics(self.start, daily, csum, avgs, self.sums)
++
++    def apply(self, prev: HabitColumns, changed: HabitColumns) -> Optional["RunningAnalytics"]:
++        # prev(이 합계를 만든 기록)에 changed 행을 덮어쓴 결과. 첫 기록보다 앞선 날이 들어오면 None(전체 재계산).
++        if len(changed) == 0:
++            return self
++        if len(prev) == 0 or changed.days[0] < self.start:
++            return None
++        i = np.searchsorted(prev.days, changed.days)
++        hit = i < len(prev.days)
++        hit[hit] = prev.days[i[hit]] == changed.days[hit]
++        old = i[hit]
++        removed = _contributions(HabitColumns(prev.days[old], prev.mask[old], prev.mood[old]))
++        sums = tuple(s + a - r for s, a, r in zip(self.sums, _contributions(changed), removed))
++        daily = np.zeros(max(len(self.daily), int(changed.days[-1]) - self.start + 1), dtype=np.int64)
++        daily[: len(self.daily)] = self.daily
++        daily[changed.days - self.start] = changed.done
++        # 마지막 기록 뒤로 늘어난 구간(빈 날은 0)도 새로 계산해야 하므로 k는 기존 길이를 넘지 않는다
++        k = min(int(changed.days[0]) - self.start, len(self.daily))
++        return RunningAnalytics(self.start, self.daily, self.csum, self.avgs, sums)._rolled_from(k, daily)
++
++    def frames(self) -> Dict[str, Any]:
++        import pandas as pd
++
++        labels = [f"{emoji} {label}" for _, emoji, label in HABITS]
++        habit_sum, counts, heat, wd_done, (n, sx, sy, sxx, syy, sxy) = self.sums
++        if len(self.daily) == 0:
++            return {"trend": pd.DataFrame(), "habit_rates": pd.Series(dtype=float), "weekday": pd.DataFrame(), "mood_corr": None}
++
++        # 기록이 없는 날은 0%로 보는 일 단위 달력 위의 이동 평균
++        trend = {"pct": self.daily * (100.0 / len(HABITS))}
++        trend.update({f"avg_{w}d": self.avgs[w] for w in ROLLING_WINDOWS})
++        index = pd.date_range(pd.Timestamp(date.fromordinal(self.start)), periods=len(self.daily), freq="D")
++        trend_df = pd.DataFrame(trend, index=index)
++
++        # 습관별 달성률 / 요일 x 습관 히트맵
++        habit_rates = pd.Series(habit_sum / counts.sum() * 100.0, index=labels)
++        safe = np.where(counts == 0, 1, counts)
++        weekday_df = pd.DataFrame(heat / safe[:, None] * 100.0, index=WEEKDAY_LABELS, columns=labels)
++        weekday_df["전체"] = wd_done * (100.0 / len(HABITS)) / safe
++        weekday_df["기록일"] = counts
++        weekday_df.loc[counts == 0, labels + ["전체"]] = np.nan
++
++        # 기분 vs 달성률 상관계수 (달성률은 완료 수의 상수배라 상관계수가 같다)
++        n, sx, sy, sxx, syy, sxy = (int(v) for v in (n, sx, sy, sxx, syy, sxy))
++        var_x, var_y = n * sxx - sx * sx, n * syy - sy * sy
++        mood_corr = None
++        if n >= 3 and var_x > 0 and var_y > 0:
++            mood_corr = float((n * sxy - sx * sy) / np.sqrt(float(var_x) * float(var_y)))
++
++        return {"trend": trend_df, "habit_rates": habit_rates, "weekday": weekday_df, "mood_corr": mood_corr}
++
++
++@instrumented("analytics_frames")
++def compute_analytics(cols: HabitColumns) -> Dict[str, Any]:
++    # 전체 기록을 한 번에 집계 (열 저장 위의 numpy 연산만, 파이썬 루프 없음)
++    return RunningAnalytics.from_columns(cols).frames()
++
++
++class AnalyticsCache:
++    # 사용자별 최신 RunningAnalytics와 그것을 만든 기록(HabitColumns). revision이 오르면 그 뒤에 쓴 행만 읽어
++    # 합계에서 옛 값을 빼고 새 값을 더한다. 저장소가 바뀐 행을 모르면 history_columns로 전체를 다시 집계한다.
++    def __init__(self, store: HistoryRepository, max_users: int = 256) -> None:
++        self.store = store
++        self.max_users = max_users
++        self.full_builds = 0
++        self.incremental_builds = 0
++        self._latest: "OrderedDict[str, Tuple[int, HabitColumns, RunningAnalytics]]" = OrderedDict()
++        self._lock = threading.Lock()
++
++    def get(self, user_id: str, revision: int) -> Dict[str, Any]:
++        with self._lock:
++            cached = self._latest.get(user_id)
++            if cached is not None:
++                self._latest.move_to_end(user_id)
++        if cached is not None and cached[0] == revision:
++            return cached[2].frames()
++        entry = None
++        if cached is not None and cached[0] < revision:
++            rows = self.store.records_since(user_id, cached[0])
++            if rows is not None:
++                with timed("analytics_incremental"):
++                    changed = HabitColumns.from_records(rows)
++                    running = cached[2].apply(cached[1], changed)
++                if running is not None:
++                    entry = (revision, cached[1].merge(changed) if len(changed) else cached[1], running)
++                    self.incremental_builds += 1
++        if entry is None:
++            cols = history_columns(user_id, revision)
++            with timed("analytics_frames"):
++                entry = (revision, cols, RunningAnalytics.from_columns(cols))
++            self.full_builds += 1
++        with self._lock:
++            if user_id not in self._latest or self._latest[user_id][0] <= revision:
++                self._latest[user_id] = entry
++                self._latest.move_to_end(user_id)
++            while len(self._latest) > self.max_users:
++                self._latest.popitem(last=False)
++        return entry[2].frames()
++
++
++@st.cache_resource
++def _analytics_cache() -> AnalyticsCache:
++    return AnalyticsCache(_history_store())
++
++
++@st.cache_data(max_entries=128, show_spinner=False)
++def cached_analytics(user_id: str, revision: int) -> Dict[str, Any]:
++    # 기록이 바뀔 때만(revision 증가) 다시 만든다: 체크박스/슬라이더 재실행은 캐시 히트.
++    # 새 revision은 직전 revision의 합계에 바뀐 행만 반영한다 (AnalyticsCache)
++    return _analytics_cache().get(user_id, revision)
++
++
++def _trend_word(delta: float) -> str:
++    return "상승" if delta >= 5 else "하락" if delta <= -5 else "비슷"
++
++
++def history_digest(cols: HabitColumns, today: date, today_done: bool) -> List[str]:
++    # 리포트 프롬프트용 기록 요약. 어제까지의 기록만 보고, 중요한 줄부터 돌려준다(예산이 모자라면 뒤에서부터 빠짐).
++    # 같은 기록이면 항상 같은 문장이라 화면과 batch-reports가 같은 프롬프트(= 같은 캐시 키)를 만든다.
++    yesterday = today.toordinal() - 1
++    past = cols.between(1, yesterday)
++    if len(past) == 0:
++        return []
++    labels = [f"{emoji} {label}" for _, emoji, label in HABITS]
++
++    def window_pct(first: int, last: int) -> Tuple[float, int]:
++        # first..last(서수) 평균 달성률, 미기록일은 0%
++        window = past.between(first, last)
++        return float(window.pct.sum()) / (last - first + 1), len(window)
++
++    # 연속 기록: 달성한 날(done > 0)이 이어진 구간. 오늘은 화면 값으로 판단 (calc_streak과 같은 규칙)
++    active = past.days[past.done > 0]
++    current = longest = 0
++    if len(active):
++        breaks = np.flatnonzero(np.diff(active) != 1)
++        runs = np.diff(np.concatenate(([-1], breaks, [len(active) - 1])))
++        longest = int(runs.max())
++        current = int(runs[-1]) if active[-1] == yesterday else 0
++    current = current + 1 if today_done else 0
++    lines = [f"연속 기록 {current}일 (최장 {max(longest, current)}일)"]
++
++    a7, n7 = window_pct(yesterday - 6, yesterday)
++    p7, m7 = window_pct(yesterday - 13, yesterday - 7)
++    if n7 or m7:
++        lines.append(f"최근 7일 평균 달성률 {a7:.0f}% (그 전 7일 {p7:.0f}%, {_trend_word(a7 - p7)})")
++    recent = past.between(yesterday - 29, yesterday)
++    if len(recent):
++        rates = ((recent.mask[:, None] >> np.arange(len(HABITS))) & 1).mean(axis=0) * 100.0
++        weak, strong = int(rates.argmin()), int(rates.argmax())
++        lines.append(
++            f"최근 30일 가장 약한 습관 {labels[weak]} {rates[weak]:.0f}%, 가장 강한 습관 {labels[strong]} {rates[strong]:.0f}%"
++        )
++        lines.append(f"최근 30일 중 {len(recent)}일 기록, 평균 달성률 {float(recent.pct.sum()) / 30:.0f}% (미기록일 0%)")
++    moods = past.between(yesterday - 6, yesterday).mood
++    prev_moods = past.between(yesterday - 13, yesterday - 7).mood
++    moods, prev_moods = moods[moods > 0], prev_moods[prev_moods > 0]
++    if len(moods):
++        lines.append(
++            f"최근 7일 평균 기분 {moods.mean():.1f}/10" + (f" (그 전 7일 {prev_moods.mean():.1f})" if len(prev_moods) else "")
++        )
++    quarter = past.between(yesterday - 83, yesterday)
++    if len(quarter) >= 14:
++        weekday = (quarter.days - 1) % 7
++        counts = np.bincount(weekday, minlength=7)
++        avg = np.bincount(weekday, weights=quarter.pct, minlength=7) / np.maximum(counts, 1)
++        avg = np.where(counts > 0, avg, np.nan)
++        best, worst = int(np.nanargmax(avg)), int(np.nanargmin(avg))
++        lines.append(
++            f"최근 12주 요일별: {WEEKDAY_LABELS[best]}요일 최고 {avg[best]:.0f}%, {WEEKDAY_LABELS[worst]}요일 최저 {avg[worst]:.0f}%"
++        )
++    if len(past.between(yesterday - 27, yesterday - 7)):
++        weeks = [window_pct(yesterday - 7 * k - 6, yesterday - 7 * k)[0] for k in range(3, -1, -1)]
++        lines.append("최근 4주 주별 평균 " + " → ".join(f"{w:.0f}%" for w in weeks))
++    span = yesterday - int(past.days[0]) + 1
++    lines.append(f"첫 기록 이후 {span}일 중 {len(past)}일 기록, 기록한 날 평균 달성률 {float(past.pct.mean()):.0f}%")
++    return lines
++
++
++def render_weekday_heatmap(weekday_df: pd.DataFrame) -> None:
++    import pandas as pd
++
++    if weekday_df.empty:
++        return
++    cols = [c for c in weekday_df.columns if c != "기록일"]
++    table = ['<table class="calendar"><thead><tr><th></th>']
++    table.extend(f"<th>{c}</th>" for c in cols)
++    table.append("</tr></thead><tbody>")
++    for day, row in weekday_df.iterrows():
++        table.append(f"<tr><th>{day}</th>")
++        for c in cols:
++            value = row[c]
++            if pd.isna(value):
++                table.append('<td class="empty">.</td>')
++            else:
++                table.append(f"<td style='background:{_pct_to_color(value)};'>{value:.0f}%</td>")
++        table.append("</tr>")
++    table.append("</tbody></table>")
++    st.markdown("".join(table), unsafe_allow_html=True)
++
++
++# -----------------------------
++# CLI (벤치마크)
++# -----------------------------
++def _percentiles(samples: List[float]) -> Dict[str, float]:
++    arr = np.asarray(samples, dtype=float) * 1000
++    if arr.size == 0:
++        return {"p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
++    p50, p95, p99 = np.percentile(arr, [50, 95, 99])
++    return {"p50_ms": round(p50, 2), "p95_ms": round(p95, 2), "p99_ms": round(p99, 2), "max_ms": round(arr.max(), 2)}
++
++
++def _simulate_session(service: HabitService, reruns: int, seed: int) -> List[float]:
++    # 화면 한 번 그리기에 해당하는 저장소 호출 + 체크 변경 저장을 반복
++    rng = np.random.default_rng(seed)
++    today = datetime.now().date()
++    latencies = []
++    for _ in range(reruns):
++        t0 = time.perf_counter()
++        done = int(rng.integers(0, 6))
++        service.save_day(
++            {"date": today.isoformat(), "done": done, "pct": done * 20.0, "mood": int(rng.integers(1, 11)),
++             "habit_mask": (1 << done) - 1}
++        )
++        service.range(today - timedelta(days=6), today - timedelta(days=1))
++        service.streak(done > 0)
++        service.longest_streak()
++        service.revision()
++        service.month(today.year, today.month)
++        service.settings()
++        latencies.append(time.perf_counter() - t0)
++    return latencies
++
++
++def cmd_bench_load(args: argparse.Namespace) -> int:
++    with tempfile.TemporaryDirectory() as tmp:
++        store = SQLiteHistoryRepository(os.path.join(tmp, "history.sqlite3"), pool_size=args.pool_size)
++        base = datetime.now().date()
++        for u in range(args.users):
++            rows = []
++            for i in range(args.days, 0, -1):
++                done = (u + i) % 6
++                rows.append(
++                    {"date": (base - timedelta(days=i)).isoformat(), "done": done, "pct": done * 20.0,
++                     "mood": 5 + done % 5, "habit_mask": (1 << done) - 1}
++                )
++            store.upsert_days(f"user{u}", rows)
++
++        jobs = [(u, s) for u in range(args.users) for s in range(args.sessions)]
++        writer = None
++        if args.write_behind > 0:
++            writer = WriteBehindQueue(store, args.write_behind, WRITE_BEHIND_MAX_PENDING).start()
++        latencies: List[float] = []
++        errors = 0
++        t0 = time.perf_counter()
++        with ThreadPoolExecutor(max_workers=len(jobs)) as pool:
++            futures = [
++                pool.submit(_simulate_session, HabitService(store, f"user{u}", writer), args.reruns, u * 1000 + s)
++                for u, s in jobs
++            ]
++            for f in futures:
++                try:
++                    latencies.extend(f.result())
++                except Exception:
++                    errors += 1
++        elapsed = time.perf_counter() - t0
++        if writer is not None:
++            t_close = time.perf_counter()
++            writer.close()
++            write_behind = {**writer.status(), "close_ms": round((time.perf_counter() - t_close) * 1000.0, 2)}
++
++    result = {
++        "users": args.users,
++        "sessions_per_user": args.sessions,
++        "reruns_per_session": args.reruns,
++        "pool_size": args.pool_size,
++        "write_behind_s": args.write_behind,
++        "reruns": len(latencies),
++        "errors": errors,
++        "elapsed_s": round(elapsed, 3),
++        "reruns_per_s": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
++        **_percentiles(latencies),
++    }
++    if writer is not None:
++        result["write_behind"] = write_behind
++    print(json.dumps(result, ensure_ascii=False, indent=2))
++    return 1 if errors else 0
++
++
++def _seed_history(store: HistoryRepository, user_id: str, days: int) -> None:
++    base = datetime.now().date()
++    rng = np.random.default_rng(days)
++    rows = []
++    for i in range(days, 0, -1):
++        mask = int(rng.integers(0, 1 << len(HABITS)))
++        done = bin(mask).count("1")
++        rows.append(
++            {"date": (base - timedelta(days=i)).isoformat(), "done": done, "pct": done * 20.0,
++             "mood": int(rng.integers(1, 11)), "habit_mask": mask}
++        )
++    for chunk in range(0, len(rows), 5000):
++        store.upsert_days(user_id, rows[chunk:chunk + 5000])
++
++
++def cmd_bench_rerun(args: argparse.Namespace) -> int:
++    from streamlit.testing.v1 import AppTest
++
++    results = {}
++    with tempfile.TemporaryDirectory() as tmp:
++        os.environ["HABIT_TRACKER_DATA_DIR"] = tmp
++        _seed_history(SQLiteHistoryRepository(os.path.join(tmp, "history.sqlite3")), DEFAULT_USER_ID, args.days)
++        for mode in ("tabs", "lazy"):
++            os.environ["HABIT_TRACKER_NAV"] = mode
++            at = AppTest.from_file(os.path.abspath(__file__), default_timeout=120)
++            at.run()
++            if mode == "lazy":
++                at.radio(key="view").set_value("✅ 습관")
++                at.run()
++            samples = []
++            for i in range(args.reruns):
++                box = at.checkbox(key=f"habit_{HABITS[i % len(HABITS)][0]}")
++                box.set_value(not box.value)
++                t0 = time.perf_counter()
++                at.run()
++                samples.append(time.perf_counter() - t0)
++                if at.exception:
++                    print(at.exception[0].message, file=sys.stderr)
++                    return 1
++            results[mode] = _percentiles(samples)
++
++    print(json.dumps({"days": args.days, "reruns": args.reruns, **results}, ensure_ascii=False, indent=2))
++    return 0
++
++
++BENCH_SIZES = (7, 365, 3650, 100_000)
++STUB_REPORT_TEXT = "**컨디션 등급: B**\n- 벤치마크용 고정 리포트입니다.\n- 내일 미션: 물 2L, 30분 걷기, 11시 취침"
++
++
++def _stub_usage(body: Dict[str, Any]) -> Tuple[int, int]:
++    # 실제 토크나이저 대신 앱의 추정치를 입력 토큰으로 돌려준다
++    messages = body.get("input") or body.get("messages") or []
++    return prompt_token_estimate(messages), len(STUB_REPORT_TEXT.split(" "))
++
++
++def _stub_response(model: str, usage: Tuple[int, int] = (0, 0)) -> Dict[str, Any]:
++    return {
++        "id": "resp_bench", "object": "response", "created_at": 0, "model": model, "status": "completed",
++        "output": [{"type": "message", "id": "msg_bench", "role": "assistant", "status": "completed",
++                    "content": [{"type": "output_text", "text": STUB_REPORT_TEXT, "annotations": []}]}],
++        "parallel_tool_calls": False, "tool_choice": "auto", "tools": [],
++        "usage": {"input_tokens": usage[0], "input_tokens_details": {"cached_tokens": 0},
++                  "output_tokens": usage[1], "output_tokens_details": {"reasoning_tokens": 0},
++                  "total_tokens": sum(usage)},
++    }
++
++
++@functools.lru_cache(maxsize=1)
++def _stub_dog_jpeg() -> bytes:
++    # dog.ceo 원본 크기쯤 되는 이미지 (썸네일 축소 경로까지 측정되도록)
++    from PIL import Image
++
++    buf = io.BytesIO()
++    Image.new("RGB", (1600, 1200), (234, 179, 8)).save(buf, "JPEG", quality=90)
++    return buf.getvalue()
++
++
++class _StubUpstreamHandler:
++    # BaseHTTPRequestHandler와 섞어 쓰는 믹스인 (http.server는 StubUpstream을 만들 때 import한다).
++    # OpenWeatherMap / Dog CEO / OpenAI(Responses, Chat Completions) 흉내.
++    # server.endpoints에 없는 OpenAI 경로는 404: 해당 API를 모르는 SDK/프록시를 흉내 낸다.
++    def log_message(self, format: str, *args: Any) -> None:
++        pass
++
++    def _delay(self) -> None:
++        # 느린 업스트림 흉내 (요청마다 같은 지연)
++        if self.server.delay_s > 0:
++            time.sleep(self.server.delay_s)
++
++    def _send_events(self, events: List[Tuple[Optional[str], Dict[str, Any]]]) -> None:
++        self.send_response(200)
++        self.send_header("Content-Type", "text/event-stream")
++        self.end_headers()
++        for name, data in events:
++            prefix = f"event: {name}\n" if name else ""
++            self.wfile.write(f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8"))
++
++    def _send_bytes(self, body: bytes, content_type: str, status: int = 200) -> None:
++        self.send_response(status)
++        self.send_header("Content-Type", content_type)
++        self.send_header("Content-Length", str(len(body)))
++        self.end_headers()
++        self.wfile.write(body)
++
++    def _send_json(self, payload: Dict[str, Any], status: int = 200) -> None:
++        self._send_bytes(json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json", status)
++
++    def do_GET(self) -> None:
++        path = urlparse(self.path).path
++        self._delay()
++        if path == "/weather":
++            city = parse_qs(urlparse(self.path).query).get("q", ["Seoul"])[0]
++            self._send_json(
++                {"name": city, "weather": [{"description": "맑음"}],
++                 "main": {"temp": 21.3, "feels_like": 20.8, "humidity": 45}, "wind": {"speed": 2.1}}
++            )
++        elif path == "/dog":
++            host = self.headers.get("Host", "127.0.0.1")
++            self._send_json({"message": f"http://{host}/breeds/hound-afghan/bench.jpg", "status": "success"})
++        elif path.startswith("/breeds/"):
++            self._send_bytes(_stub_dog_jpeg(), "image/jpeg")
++        else:
++            self._send_json({"error": "not found"}, status=404)
++
++    def do_POST(self) -> None:
++        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
++        endpoint = {"/v1/responses": "responses", "/v1/chat/completions": "chat"}.get(urlparse(self.path).path)
++        self._delay()
++        with self.server.lock:
++            self.server.requests += 1
++        if endpoint not in self.server.endpoints:
++            self._send_json({"error": {"message": "not found", "type": "invalid_request_error"}}, status=404)
++            return
++        model = body.get("model", REPORT_MODEL)
++        tokens = STUB_REPORT_TEXT.split(" ")
++        usage = _stub_usage(body)
++        if endpoint == "responses":
++            if not body.get("stream"):
++                self._send_json(_stub_response(model, usage))
++                return
++            events: List[Tuple[Optional[str], Dict[str, Any]]] = [
++                ("response.output_text.delta",
++                 {"type": "response.output_text.delta", "item_id": "msg_bench", "output_index": 0,
++                  "content_index": 0, "delta": token + " ", "logprobs": [], "sequence_number": i})
++                for i, token in enumerate(tokens)
++            ]
++            events.append(
++                ("response.completed",
++                 {"type": "response.completed", "response": _stub_response(model, usage),
++                  "sequence_number": len(tokens)})
++            )
++            self._send_events(events)
++            return
++        chat_usage = {"prompt_tokens": usage[0], "completion_tokens": usage[1], "total_tokens": sum(usage)}
++        if not body.get("stream"):
++            self._send_json(
++                {"id": "bench", "object": "chat.completion", "created": 0, "model": model,
++                 "choices": [{"index": 0, "message": {"role": "assistant", "content": STUB_REPORT_TEXT},
++                              "finish_reason": "stop"}], "usage": chat_usage}
++            )
++            return
++        events = [
++            (None, {"id": "bench", "object": "chat.completion.chunk", "created": 0, "model": model,
++                    "choices": [{"index": 0, "delta": {"content": token + " "} if token else {},
++                                 "finish_reason": finish}]})
++            for token, finish in [*((t, None) for t in tokens), ("", "stop")]
++        ]
++        if (body.get("stream_options") or {}).get("include_usage"):
++            events.append((None, {"id": "bench", "object": "chat.completion.chunk", "created": 0, "model": model,
++                                  "choices": [], "usage": chat_usage}))
++        self._send_events(events)
++        self.wfile.write(b"data: [DONE]\n\n")
++
++
++class StubUpstream:
++    # 벤치마크/점검 동안 외부 API 대신 쓰는 로컬 서버. env()를 os.environ에 넣으면 앱의 호출이 이리로 온다.
++    def __init__(self, endpoints: Tuple[str, ...] = REPORT_PATHS, delay_s: float = 0.0) -> None:
++        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
++
++        handler = type("StubUpstreamHandler", (_StubUpstreamHandler, BaseHTTPRequestHandler), {})
++        self._server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
++        self._server.endpoints = endpoints
++        self._server.delay_s = delay_s
++        self._server.requests = 0
++        self._server.lock = threading.Lock()
++        self.url = f"http://127.0.0.1:{self._server.server_port}"
++        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-upstream", daemon=True)
++
++    def __enter__(self) -> "StubUpstream":
++        self._thread.start()
++        return self
++
++    def __exit__(self, *exc: Any) -> None:
++        self._server.shutdown()
++        self._server.server_close()
++
++    @property
++    def openai_requests(self) -> int:
++        with self._server.lock:
++            return self._server.requests
++
++    def env(self) -> Dict[str, str]:
++        return {
++            "HABIT_OWM_URL": f"{self.url}/weather",
++            "HABIT_DOG_API_URL": f"{self.url}/dog",
++            "OPENAI_BASE_URL": f"{self.url}/v1",
++        }
++
++
++def _run_app(at) -> float:
++    t0 = time.perf_counter()
++    at.run()
++    elapsed = time.perf_counter() - t0
++    if at.exception:
++        raise RuntimeError(at.exception[0].message)
++    return elapsed
++
++
++def _bench_interaction(at, action: Callable[[int], None], reruns: int) -> Dict[str, float]:
++    # action(i)로 위젯을 조작한 뒤 재실행 시간을 잰다. 첫 회(화면 전환/콜드 캐시)는 first_ms로 따로 남긴다.
++    # 최대 메모리는 tracemalloc 오버헤드가 시간 측정에 섞이지 않게 마지막 1회에서만 잰다. 추적은 시간 측정
++    # 재실행들이 끝난 뒤(캐시가 데워진 상태) 시작하므로 그 1회의 재실행이 새로 할당한 양만 잡힌다.
++    samples = []
++    for i in range(reruns):
++        action(i)
++        samples.append(_run_app(at))
++    import tracemalloc
++
++    action(reruns)
++    tracemalloc.start()
++    try:
++        _run_app(at)
++        peak = tracemalloc.get_traced_memory()[1]
++    finally:
++        tracemalloc.stop()
++    return {"first_ms": round(samples[0] * 1000, 2), **_percentiles(samples), "peak_mem_kb": round(peak / 1024, 1)}
++
++
++def _widget(widgets, label: str):
++    return next(w for w in widgets if w.label == label)
 +
 +
-+def calc_streak(history_rows: List[Dict[str, float]]) -> int:
-+    streak = 0
-+    today = datetime.now().date()
-+    history_map = {row["date"]: row for row in history_rows}
-+    for offset in range(0, 365):
-+        day = today - timedelta(days=offset)
-+        key = day.strftime("%Y-%m-%d")
-+        row = history_map.get(key)
-+        if row and row.get("done", 0) > 0:
-+            streak += 1
++def _share_script_cache() -> None:
++    # AppTest는 재실행마다 새 ScriptCache로 스크립트를 다시 컴파일한다(이 파일은 약 20MB를 잡는다).
++    # 실제 서버처럼 한 번만 컴파일하도록 캐시를 공유해, 재실행 시간/최대 메모리에 컴파일 비용이 섞이지 않게 한다.
++    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
++    from streamlit.testing.v1 import local_script_runner
++
++    shared = ScriptCache()
++    local_script_runner.ScriptCache = lambda: shared
++
++
++def bench_history_size(user_id: str, reruns: int) -> Dict[str, Dict[str, float]]:
++    from streamlit.testing.v1 import AppTest
++
++    _share_script_cache()
++    at = AppTest.from_file(os.path.abspath(__file__), default_timeout=600)
++    at.run()
++    _widget(at.sidebar.text_input, "OpenAI API Key").set_value("sk-bench")
++    _widget(at.sidebar.text_input, "OpenWeatherMap API Key").set_value("owm-bench")
++    at.text_input(key="user_id").set_value(user_id)
++    _run_app(at)
++
++    results: Dict[str, Dict[str, float]] = {}
++    for view in ("🏠 홈", "✅ 습관", "🗓️ 캘린더", "🧾 리포트", "ℹ️ API"):
++        results[f"view:{view}"] = _bench_interaction(at, lambda i, v=view: at.radio(key="view").set_value(v), reruns)
++
++    at.radio(key="view").set_value("✅ 습관")
++    _run_app(at)
++
++    def toggle_checkbox(i: int) -> None:
++        box = at.checkbox(key=f"habit_{HABITS[i % len(HABITS)][0]}")
++        box.set_value(not box.value)
++
++    # AppTest의 위젯 조작은 항상 스크립트 전체를 재실행한다. 체크인 fragment(st.fragment)만 다시 도는
++    # 실제 브라우저 경로의 절감은 여기 잡히지 않으므로 이름에 전체 재실행임을 밝힌다.
++    results["checkbox_toggle_full_rerun"] = _bench_interaction(at, toggle_checkbox, reruns)
++
++    at.radio(key="view").set_value("🗓️ 캘린더")
++    _run_app(at)
++
++    def switch_month(i: int) -> None:
++        month = _widget(at.selectbox, "월 선택")
++        month.set_value(month.options[(i + 1) % min(len(month.options), 12)])
++
++    results["month_switch"] = _bench_interaction(at, switch_month, reruns)
++
++    at.radio(key="view").set_value("🧾 리포트")
++    _run_app(at)
++    # 첫 클릭은 리포트 캐시 미스(스텁 호출), 이후는 같은 프롬프트라 캐시 히트
++    results["report_click"] = _bench_interaction(
++        at, lambda i: _widget(at.button, "컨디션 리포트 생성").click(), reruns
++    )
++    return results
++
++
++def cmd_bench_suite(args: argparse.Namespace) -> int:
++    import platform
++
++    report: Dict[str, Any] = {
++        "generated_at": datetime.now().isoformat(timespec="seconds"),
++        "python": platform.python_version(),
++        "streamlit": st.__version__,
++        "reruns": args.reruns,
++        "sizes": {},
++    }
++    with tempfile.TemporaryDirectory() as tmp, StubUpstream() as stub:
++        os.environ["HABIT_TRACKER_DATA_DIR"] = tmp
++        os.environ["HABIT_TRACKER_NAV"] = "lazy"
++        # 크기별 사용자를 사이드바 ID 입력으로 고른다
++        os.environ["HABIT_TRACKER_USER_MODE"] = "dev"
++        os.environ.update(stub.env())
++        store = SQLiteHistoryRepository(os.path.join(tmp, "history.sqlite3"))
++        for days in args.sizes:
++            # 크기마다 사용자를 따로 둔다: 프로세스 전역 캐시(cache_resource/cache_data)는 사용자 ID로 구분된다
++            user_id = f"bench{days}"
++            t0 = time.perf_counter()
++            _seed_history(store, user_id, days)
++            seed_s = time.perf_counter() - t0
++            try:
++                cases = bench_history_size(user_id, args.reruns)
++            except Exception as exc:
++                print(f"{days}일: {exc}", file=sys.stderr)
++                return 1
++            report["sizes"][str(days)] = {"seed_s": round(seed_s, 3), "cases": cases}
++            print(f"{days}일 완료", file=sys.stderr)
++
++    text = json.dumps(report, ensure_ascii=False, indent=2)
++    if args.out:
++        with open(args.out, "w", encoding="utf-8") as f:
++            f.write(text + "\n")
++    print(text)
++    return 0
++
++
++def _fanout_probe(runs: int) -> Dict[str, Any]:
++    # bench-fanout의 자식 프로세스에서 실행된다 (외부 API 주소가 지연 스텁을 가리키는 상태).
++    # 같은 함수(날씨 캐시 경유 조회, 강아지 조회, 리포트 생성)를 예전처럼 차례로 부르는 경우와
++    # fetch_report_bundle(날씨/강아지 동시 호출 → 준비되는 즉시 리포트)을 비교한다.
++    # 회차마다 도시와 기록 요약 문구를 바꿔 날씨/리포트 캐시가 끼어들지 않게 한다.
++    owm_key, openai_key, coach = "bench-owm", "sk-bench", "따뜻한 멘토"
++
++    def sequential(i: int) -> Optional[str]:
++        city = f"seq-{i}"
++        weather = get_weather_cached(city, owm_key) or last_known_weather(city)
++        dog = take_dog() or fallback_dog()
++        messages = _report_messages(coach, {}, 7, weather, dog, [f"sequential {i}"])
++        return _complete_report(openai_key, messages)[0]
++
++    def fanout(i: int) -> Optional[str]:
++        return fetch_report_bundle(f"fan-{i}", owm_key, openai_key, coach, {}, 7, digest=[f"fan-out {i}"])[2]
++
++    samples: Dict[str, List[float]] = {"sequential": [], "fanout": []}
++    failed = 0
++    # 0회차는 워밍업(HTTP 세션, OpenAI 클라이언트, import)이라 기록하지 않는다
++    for i in range(runs + 1):
++        for mode, run in (("sequential", sequential), ("fanout", fanout)):
++            t0 = time.perf_counter()
++            ok = bool(run(i))
++            elapsed = time.perf_counter() - t0
++            failed += not ok
++            if i:
++                samples[mode].append(elapsed)
++    return {"failed": failed, **{mode: _percentiles(s) for mode, s in samples.items()}}
++
++
++def cmd_bench_fanout(args: argparse.Namespace) -> int:
++    import subprocess
++
++    if args.probe:
++        print(json.dumps(_fanout_probe(args.runs)))
++        return 0
++    # 업스트림마다 delay_ms씩 걸리는 스텁: 차례 호출은 약 3배, 병렬 호출은 약 2배(날씨∥강아지 → 리포트)가 기대값
++    delay_s = args.delay_ms / 1000.0
++    with StubUpstream(delay_s=delay_s) as stub, tempfile.TemporaryDirectory() as tmp:
++        env = dict(
++            os.environ,
++            **stub.env(),
++            HABIT_TRACKER_DATA_DIR=tmp,
++            HABIT_DOG_POOL_SIZE="0",
++            HABIT_WEATHER_PREFETCH_S="0",
++            HABIT_OWM_RATE_PER_MIN="6000",
++        )
++        proc = subprocess.run(
++            [sys.executable, os.path.abspath(__file__), "bench-fanout", "--probe", "--runs", str(args.runs)],
++            capture_output=True,
++            text=True,
++            env=env,
++        )
++    if proc.returncode != 0:
++        print(proc.stderr[-2000:], file=sys.stderr)
++        return 1
++    probe = json.loads(proc.stdout.strip().splitlines()[-1])
++    sequential_ms, fanout_ms = probe["sequential"]["p50_ms"], probe["fanout"]["p50_ms"]
++    failures = []
++    if probe["failed"]:
++        failures.append(f"리포트 생성 실패 {probe['failed']}회")
++    # 병렬화로 적어도 업스트림 지연 절반만큼은 줄어야 한다 (기대값은 지연 1회분)
++    if sequential_ms - fanout_ms < args.delay_ms / 2:
++        failures.append(f"병렬 호출 이득 부족: 차례 {sequential_ms:.0f}ms vs 병렬 {fanout_ms:.0f}ms")
++    result = {
++        "delay_ms": args.delay_ms,
++        "runs": args.runs,
++        "sequential": probe["sequential"],
++        "fanout": probe["fanout"],
++        "saved_p50_ms": round(sequential_ms - fanout_ms, 2),
++        "speedup": round(sequential_ms / fanout_ms, 2) if fanout_ms else None,
++        "failures": failures,
++    }
++    print(json.dumps(result, ensure_ascii=False, indent=2))
++    return 1 if failures else 0
++
++
++def cmd_check_openai_paths(args: argparse.Namespace) -> int:
++    # 가짜 서버의 엔드포인트 조합 x 경로 설정(auto/고정) x 스트리밍 여부마다 리포트를 두 번 요청하고 요청 수를 센다.
++    # 기대: 지원되는 경로면 성공하고 두 번째 요청은 정확히 1회, 고정한 경로가 없으면 1회 만에 실패.
++    from openai import OpenAI
++
++    messages = _report_messages("따뜻한 멘토", {key: True for key, _, _ in HABITS}, 7, None, None)
++    api_key = "sk-path-check"
++    cases = []
++    for endpoints in (("responses", "chat"), ("chat",), ("responses",)):
++        with StubUpstream(endpoints) as stub:
++            client = OpenAI(api_key=api_key, base_url=f"{stub.url}/v1", timeout=5.0, max_retries=0)
++            for pinned in ("auto", *REPORT_PATHS):
++                for stream in (False, True):
++                    paths = ApiPathMemory(pinned)
++                    expect_ok = pinned == "auto" or pinned in endpoints
++                    results, counts = [], []
++                    for _ in range(2):
++                        before = stub.openai_requests
++                        if stream:
++                            text = "".join(d for _, d in _stream_report(client, api_key, messages, paths)).strip()
++                        else:
++                            text = (_request_report(client, api_key, messages, paths) or ("",))[0]
++                        results.append(bool(text))
++                        counts.append(stub.openai_requests - before)
++                    passed = results == [expect_ok] * 2 and counts[1] == 1 and (expect_ok or counts[0] == 1)
++                    cases.append({
++                        "endpoints": "+".join(endpoints), "pinned": pinned, "stream": stream,
++                        "ok": results, "requests": counts, "path": paths.describe(api_key), "pass": passed,
++                    })
++
++    failed = sum(not c["pass"] for c in cases)
++    print(json.dumps({"cases": cases, "failed": failed}, ensure_ascii=False, indent=2))
++    return 1 if failed else 0
++
++
++def stored_report_inputs(store: HistoryRepository, user_id: str, day: str) -> Dict[str, Any]:
++    # 저장된 기록/설정으로 그 날 화면이 만들 리포트 입력(날씨/강아지 제외). report_fingerprint(**값)으로 바로 쓴다.
++    settings = store.get_settings(user_id)
++    rows = store.get_range(user_id, day, day)
++    # 기록이 없는 사용자는 화면의 기본값(미체크, 기분 7)과 같은 프롬프트를 미리 만든다
++    habits = habits_from_mask(rows[0]["habit_mask"]) if rows else {key: False for key, _, _ in HABITS}
++    day_date = date.fromisoformat(day)
++    # 화면과 같은 기록 요약: 전날까지의 기록 + 그날 체크 여부
++    past = HabitColumns.from_records(store.get_records(user_id, end=(day_date - timedelta(days=1)).isoformat()))
++    return {
++        "city": settings.get("city", "Seoul"),
++        "coach_style": settings.get("coach_style", "따뜻한 멘토"),
++        "habit_state": habits,
++        "mood": int(rows[0]["mood"]) if rows and rows[0]["mood"] is not None else 7,
++        "digest": history_digest(past, day_date, any(habits.values())),
++    }
++
++
++def cmd_batch_reports(args: argparse.Namespace) -> int:
++    openai_key = args.openai_key or os.environ.get("OPENAI_API_KEY", "")
++    if not openai_key:
++        print("OPENAI_API_KEY(또는 --openai-key)가 필요합니다.", file=sys.stderr)
++        return 2
++    owm_key = args.owm_key or OWM_SERVER_KEY
++    day = args.date or _today_str()
++    store = _history_store()
++    users = args.user or store.list_users()
++
++    # 사용자별 입력 → 프롬프트. 같은 (코치, 습관, 기분, 도시, 기록 요약) 조합은 한 번만 생성하고,
++    # 결과는 사용자마다 (사용자, 날짜) 행으로 남긴다. 화면은 그 사용자의 입력이 그대로일 때만 이 행을 쓰고,
++    # 다른 사용자나 입력이 바뀐 클릭은 평소처럼 실시간 날씨/강아지로 만든다.
++    jobs: Dict[str, Dict[str, Any]] = {}
++    inputs: Dict[str, Tuple[Optional[Dict], Optional[Dict]]] = {}
++    skipped = 0
++    for uid in users:
++        user_inputs = stored_report_inputs(store, uid, day)
++        city = user_inputs["city"]
++        if city not in inputs:
++            inputs[city] = (get_weather_cached(city, owm_key) or last_known_weather(city), take_dog() or fallback_dog())
++        weather, dog = inputs[city]
++        if (weather or {}).get("fallback") or dog.get("fallback"):
++            # 업스트림 장애 때의 대체 값으로 만든 리포트는 남기지 않는다 (클릭 시 실시간 경로가 다시 시도)
++            skipped += 1
++            continue
++        messages = _report_messages(
++            user_inputs["coach_style"], user_inputs["habit_state"], user_inputs["mood"], weather, dog, user_inputs["digest"]
++        )
++        job = jobs.setdefault(
++            report_cache_key(messages), {"messages": messages, "weather": weather, "dog": dog, "users": []}
++        )
++        job["users"].append((uid, report_fingerprint(**user_inputs)))
++
++    bucket = TokenBucket(rate=args.rps, capacity=max(1.0, args.rps))
++    counts = {"generated": 0, "cached": 0, "failed": 0, "prompt_tokens": 0, "completion_tokens": 0}
++    counts_lock = threading.Lock()
++
++    def run_job(job: Dict[str, Any]) -> None:
++        usage = None
++        cached = _report_store().get(report_cache_key(job["messages"]))
++        if cached is not None:
++            text, outcome = cached[0], "cached"
 +        else:
-+            break
-+    return streak
++            bucket.acquire()
++            text, _, usage = _complete_report(openai_key, job["messages"])
++            outcome = "generated" if text else "failed"
++        if text:
++            for uid, fingerprint in job["users"]:
++                _report_store().put_pregenerated(uid, day, fingerprint, job["weather"], job["dog"], text)
++        with counts_lock:
++            counts[outcome] += 1
++            for kind, n in (usage or {}).items():
++                counts[kind] += n
 +
++    t0 = time.perf_counter()
++    with ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="batch-report") as pool:
++        list(pool.map(run_job, jobs.values()))
++    result = {
++        "date": day,
++        "users": len(users),
++        "skipped_fallback_inputs": skipped,
++        "unique_prompts": len(jobs),
++        "max_prompt_tokens_est": max((prompt_token_estimate(job["messages"]) for job in jobs.values()), default=0),
++        **counts,
++        "elapsed_s": round(time.perf_counter() - t0, 3),
++    }
++    print(json.dumps(result, ensure_ascii=False, indent=2))
++    return 1 if counts["failed"] else 0
 +
-+def render_calendar(history_rows: List[Dict[str, float]], focus_date: datetime) -> None:
-+    history_map = {row["date"]: row for row in history_rows}
-+    year = focus_date.year
-+    month = focus_date.month
-+    weeks = _calendar_matrix(year, month)
-+    month_label = focus_date.strftime("%Y년 %m월")
 +
-+    st.markdown(f"#### 🗓️ {month_label}")
-+    table = ['<table class="calendar">']
-+    table.append("<thead><tr>")
-+    for day in ["월", "화", "수", "목", "금", "토", "일"]:
-+        table.append(f"<th>{day}</th>")
-+    table.append("</tr></thead><tbody>")
-+    for week in weeks:
-+        table.append("<tr>")
-+        for day in week:
-+            if not day:
-+                table.append('<td class="empty">.</td>')
-+                continue
-+            date_key = f"{year}-{month:02d}-{day:02d}"
-+            row = history_map.get(date_key)
-+            pct = row["pct"] if row else 0
-+            mood = row.get("mood") if row else None
-+            color = _pct_to_color(pct)
-+            label = f"{day}<br/><span style='font-size:11px; color:#e2e8f0'>{pct:.0f}%</span>"
-+            if mood:
-+                label += f"<div style='font-size:11px; color:#cbd5f5'>🙂 {mood}</div>"
-+            table.append(
-+                f"<td style='background:{color};'>{label}</td>"
-+            )
-+        table.append("</tr>")
-+    table.append("</tbody></table>")
-+    st.markdown("".join(table), unsafe_allow_html=True)
++def _run_batch_reports(stub: StubUpstream, data_dir: str, **env: str) -> Dict[str, Any]:
++    # 스텁 업스트림을 보는 새 프로세스에서 batch-reports 실행 (저장 위치/외부 주소는 import 시점 상수)
++    import subprocess
 +
-+    st.markdown(
-+        """
-+<div class="calendar-legend">
-+  <span class="legend-box" style="background:#1f2937;"></span>미기록
-+  <span class="legend-box" style="background:#fb7185;"></span>낮음
-+  <span class="legend-box" style="background:#f59e0b;"></span>보통
-+  <span class="legend-box" style="background:#38bdf8;"></span>높음
-+  <span class="legend-box" style="background:#22c55e;"></span>아주 높음
-+</div>
-+""",
-+        unsafe_allow_html=True,
++    proc = subprocess.run(
++        [sys.executable, os.path.abspath(__file__), "batch-reports", "--openai-key", "sk-batch-check",
++         "--owm-key", "owm-batch-check", "--rps", "100"],
++        capture_output=True,
++        text=True,
++        env={**os.environ, **stub.env(), "HABIT_TRACKER_DATA_DIR": data_dir, "HABIT_DOG_POOL_SIZE": "0",
++             "HABIT_WEATHER_PREFETCH_S": "0", **env},
 +    )
++    if proc.returncode not in (0, 1) or "{" not in proc.stdout:
++        raise RuntimeError(proc.stderr[-2000:])
++    return json.loads(proc.stdout[proc.stdout.index("{"):])
 +
 +
- # -----------------------------
- # session_state 초기화
- # -----------------------------
- def init_state() -> None:
-     if "history" not in st.session_state:
-         # 데모용 6일 샘플 데이터 + 오늘은 사용자가 입력
-         base = datetime.now().date()
-         sample_days = 6
-         rows = []
-         # 샘플은 약간의 변동을 주기 위한 패턴
-         patterns = [
-             (3, 6), (4, 7), (2, 5), (5, 8), (3, 7), (4, 6)
-         ]
-         for i in range(sample_days, 0, -1):
-             d = base - timedelta(days=i)
-             done, mood = patterns[(sample_days - i) % len(patterns)]
-             pct = (done / 5) * 100
-             rows.append({"date": d.strftime("%Y-%m-%d"), "done": done, "pct": pct, "mood": mood})
-         st.session_state.history = rows
- 
-     if "today_record" not in st.session_state:
-         st.session_state.today_record = {
-             "date": _today_str(),
-             "habits": {k: False for k, _, _ in HABITS},
-             "mood": 7,
-@@ -311,249 +470,266 @@ def generate_report(
-                         if t:
-                             chunks.append(t)
-                 txt = "\n".join(chunks).strip() if chunks else None
-             return txt or None
-         except Exception:
-             pass
- 
-         # 2) Chat Completions 폴백
-         try:
-             cc = client.chat.completions.create(
-                 model="gpt-5-mini",
-                 messages=[
-                     {"role": "system", "content": sys},
-                     {"role": "user", "content": user},
-                 ],
-             )
-             return (cc.choices[0].message.content or "").strip() or None
-         except Exception:
-             return None
- 
-     except Exception:
-         return None
- 
- 
- # -----------------------------
--# 습관 체크인 UI
++def cmd_check_batch_reports(args: argparse.Namespace) -> int:
++    # 가짜 OpenAI/날씨/강아지 서버로 batch-reports를 끝까지 돌려 본다:
++    # 같은 입력의 사용자는 한 번만 생성, 사용자마다 미리 만든 리포트 행, 재실행은 호출 0회,
++    # 입력이 바뀐 사용자는 미리 만든 리포트를 쓰지 않음, 대체 입력(업스트림 장애)일 때는 아무것도 남기지 않음.
++    day = _today_str()
++    base = date.fromisoformat(day)
++    # (사용자, 도시, 코치, 오늘 습관 마스크): a와 b는 입력이 같아 프롬프트 하나를 나눠 쓴다
++    users = [
++        ("a", "Seoul", "따뜻한 멘토", 0b00111),
++        ("b", "Seoul", "따뜻한 멘토", 0b00111),
++        ("c", "Busan", "따뜻한 멘토", 0b00111),
++        ("d", "Seoul", "스파르타 코치", 0b11111),
++    ]
++    cases = []
++
++    def case(name: str, passed: bool, **detail: Any) -> None:
++        cases.append({"case": name, "pass": bool(passed), **detail})
++
++    with StubUpstream() as stub, tempfile.TemporaryDirectory() as tmp:
++        for sub_dir in ("live", "fallback"):
++            store = SQLiteHistoryRepository(os.path.join(tmp, sub_dir, "history.sqlite3"), pool_size=1)
++            for uid, city, coach_style, mask in users:
++                rows = [
++                    {"date": (base - timedelta(days=i)).isoformat(), "done": bin(mask >> (i % 3)).count("1"),
++                     "pct": bin(mask >> (i % 3)).count("1") * 20.0, "mood": 7, "habit_mask": mask >> (i % 3)}
++                    for i in range(14, -1, -1)
++                ]
++                store.upsert_days(uid, rows)
++                store.save_settings(uid, {"city": city, "coach_style": coach_style})
++
++        store = SQLiteHistoryRepository(os.path.join(tmp, "live", "history.sqlite3"), pool_size=1)
++        reports = ReportStore(os.path.join(tmp, "live", "reports.sqlite3"))
++        expected_prompts = len(users) - 1
++
++        before = stub.openai_requests
++        first = _run_batch_reports(stub, os.path.join(tmp, "live"))
++        calls = stub.openai_requests - before
++        case("first run generates each unique prompt once",
++             first["unique_prompts"] == expected_prompts and first["generated"] == expected_prompts
++             and first["failed"] == 0 and calls == expected_prompts,
++             unique_prompts=first["unique_prompts"], generated=first["generated"], openai_requests=calls)
++
++        fingerprints = {uid: report_fingerprint(**stored_report_inputs(store, uid, day)) for uid, *_ in users}
++        found = {uid: reports.get_pregenerated(uid, day, fp, REPORT_PREGEN_FRESH_S) for uid, fp in fingerprints.items()}
++        case("every user gets a pre-generated report",
++             all(r is not None and r["text"] == STUB_REPORT_TEXT and not r["dog"].get("fallback") for r in found.values()),
++             users=sorted(uid for uid, r in found.items() if r is not None))
++
++        changed = stored_report_inputs(store, "a", day)
++        changed["mood"] = 3
++        case("changed inputs fall back to the live path",
++             reports.get_pregenerated("a", day, report_fingerprint(**changed), REPORT_PREGEN_FRESH_S) is None)
++        case("pre-generated reports are per user",
++             reports.get_pregenerated("zz", day, fingerprints["a"], REPORT_PREGEN_FRESH_S) is None)
++
++        before = stub.openai_requests
++        second = _run_batch_reports(stub, os.path.join(tmp, "live"))
++        calls = stub.openai_requests - before
++        case("second run reuses the report cache",
++             second["cached"] == expected_prompts and second["generated"] == 0 and calls == 0,
++             cached=second["cached"], openai_requests=calls)
++
++        # 강아지 API가 404: 내장 강아지(대체 입력)라 리포트를 만들지도, 남기지도 않는다
++        before = stub.openai_requests
++        degraded = _run_batch_reports(stub, os.path.join(tmp, "fallback"), HABIT_DOG_API_URL=f"{stub.url}/missing")
++        calls = stub.openai_requests - before
++        fallback_reports = ReportStore(os.path.join(tmp, "fallback", "reports.sqlite3"))
++        case("fallback inputs are not persisted",
++             degraded["skipped_fallback_inputs"] == len(users) and calls == 0
++             and all(fallback_reports.get_pregenerated(uid, day, fp, REPORT_PREGEN_FRESH_S) is None
++                     for uid, fp in fingerprints.items()),
++             skipped=degraded["skipped_fallback_inputs"], openai_requests=calls)
++
++    failed = sum(not c["pass"] for c in cases)
++    print(json.dumps({"cases": cases, "failed": failed}, ensure_ascii=False, indent=2))
++    return 1 if failed else 0
++
++
++IMPORTTIME_MARKER = "-- deferred imports --"
++
++
++def _import_probe() -> Dict[str, Any]:
++    # check-import-budget의 자식 프로세스에서 실행된다. 이 시점까지는 app.py의 정의만 읽힌 상태.
++    eager = [name for name in DEFERRED_IMPORTS if name in sys.modules]
++    # 이후 import는 importtime 합계에서 빼도록 표시하고, 미뤄 둔 모듈 각각의 비용을 잰다
++    sys.stderr.write(IMPORTTIME_MARKER + "\n")
++    sys.stderr.flush()
++    deferred_ms: Dict[str, Optional[float]] = {}
++    for name in DEFERRED_IMPORTS:
++        t0 = time.perf_counter()
++        try:
++            importlib.import_module(name)
++            deferred_ms[name] = round((time.perf_counter() - t0) * 1000.0, 1)
++        except ImportError:
++            deferred_ms[name] = None
++    return {"eager": eager, "deferred_ms": deferred_ms}
++
++
++def _checkin_view_probe() -> Dict[str, Any]:
++    # check-import-budget --probe-view 자식 프로세스: 실제 스크립트를 체크인 화면(✅ 습관)으로 열고
++    # 습관 하나를 저장하는 rerun까지 돈 뒤 pandas가 import됐는지 본다
++    from streamlit.testing.v1 import AppTest
++
++    with tempfile.TemporaryDirectory() as tmp:
++        os.environ["HABIT_TRACKER_DATA_DIR"] = tmp
++        os.environ["HABIT_TRACKER_NAV"] = "lazy"
++        at = AppTest.from_file(os.path.abspath(__file__), default_timeout=120)
++        at.session_state["view"] = "✅ 습관"
++        at.run()
++        box = at.checkbox(key=f"habit_{HABITS[0][0]}")
++        box.set_value(not box.value)
++        at.run()
++        error = at.exception[0].message if at.exception else None
++    return {"error": error, "pandas": "pandas" in sys.modules}
++
++
++def _parse_importtime(stderr: str) -> Dict[str, float]:
++    # -X importtime 출력에서 최상위 import(들여쓰기 없음)의 누적 시간(ms)만 모은다
++    top: Dict[str, float] = {}
++    for line in stderr.split(IMPORTTIME_MARKER)[0].splitlines():
++        if not line.startswith("import time:") or "|" not in line:
++            continue
++        _, cumulative, name = line.split("|", 2)
++        if cumulative.strip().isdigit() and name[1:2] != " ":
++            top[name.strip()] = top.get(name.strip(), 0.0) + int(cumulative) / 1000.0
++    return top
++
++
++def cmd_check_import_budget(args: argparse.Namespace) -> int:
++    import subprocess
++
++    if args.probe:
++        print(json.dumps(_import_probe()))
++        return 0
++    if args.probe_view:
++        print(json.dumps(_checkin_view_probe()))
++        return 0
++    # 새 프로세스에서 app.py 정의를 읽는 데 드는 import 시간을 재고, 가장 빠른 회차를 예산과 비교한다
++    runs = []
++    for _ in range(max(1, args.runs)):
++        proc = subprocess.run(
++            [sys.executable, "-X", "importtime", os.path.abspath(__file__), "check-import-budget", "--probe"],
++            capture_output=True,
++            text=True,
++            env=dict(os.environ, HABIT_PREWARM_IMPORTS="0"),
++        )
++        if proc.returncode != 0:
++            print(proc.stderr[-2000:], file=sys.stderr)
++            return 1
++        top = _parse_importtime(proc.stderr)
++        runs.append((sum(top.values()), top, json.loads(proc.stdout.strip().splitlines()[-1])))
++    import_ms, top, probe = min(runs, key=lambda run: run[0])
++    proc = subprocess.run(
++        [sys.executable, os.path.abspath(__file__), "check-import-budget", "--probe-view"],
++        capture_output=True,
++        text=True,
++        env=dict(os.environ, HABIT_PREWARM_IMPORTS="0", HABIT_DOG_POOL_SIZE="0", HABIT_WEATHER_PREFETCH_S="0"),
++    )
++    if proc.returncode != 0:
++        print(proc.stderr[-2000:], file=sys.stderr)
++        return 1
++    view = json.loads(proc.stdout.strip().splitlines()[-1])
++    failures = []
++    if import_ms > args.budget_ms:
++        failures.append(f"import {import_ms:.0f}ms > 예산 {args.budget_ms:.0f}ms")
++    if probe["eager"]:
++        failures.append("시작 시 import됨: " + ", ".join(probe["eager"]))
++    if view["error"]:
++        failures.append(f"체크인 화면 실행 실패: {view['error']}")
++    if view["pandas"]:
++        failures.append("체크인 화면이 pandas를 import함")
++    result = {
++        "import_ms": round(import_ms, 1),
++        "budget_ms": args.budget_ms,
++        "runs_ms": [round(run[0], 1) for run in runs],
++        "top_imports_ms": {name: round(ms, 1) for name, ms in sorted(top.items(), key=lambda kv: -kv[1])[:8]},
++        "deferred_ms": probe["deferred_ms"],
++        "failures": failures,
++    }
++    print(json.dumps(result, ensure_ascii=False, indent=2))
++    return 1 if failures else 0
++
++
++def cmd_export_history(args: argparse.Namespace) -> int:
++    fmt = args.format or history_format(args.path)
++    store = _history_store()
++    users = args.user or store.list_users()
++    t0 = time.perf_counter()
++    if args.path == "-":
++        rows = write_history(sys.stdout.buffer, fmt, export_history_chunks(store, users, args.chunk_size))
++    else:
++        with open(args.path, "wb") as out:
++            rows = write_history(out, fmt, export_history_chunks(store, users, args.chunk_size))
++    summary = {"rows": rows, "users": len(users), "format": fmt, "elapsed_s": round(time.perf_counter() - t0, 3)}
++    print(json.dumps(summary, ensure_ascii=False), file=sys.stderr)
++    return 0
++
++
++def cmd_import_history(args: argparse.Namespace) -> int:
++    fmt = args.format or history_format(args.path)
++    t0 = time.perf_counter()
++    with open(args.path, "rb") as inp:
++        stats = import_history(_history_store(), read_history(inp, fmt, args.chunk_size), user_id=args.user)
++    stats["elapsed_s"] = round(time.perf_counter() - t0, 3)
++    print(json.dumps(stats, ensure_ascii=False, indent=2))
++    return 1 if stats["invalid"] else 0
++
++
++def cli_main(argv: List[str]) -> int:
++    import argparse
++
++    parser = argparse.ArgumentParser(prog="python app.py", description="AI 습관 트래커 CLI")
++    sub = parser.add_subparsers(dest="command", required=True)
++
++    p = sub.add_parser("bench-load", help="여러 사용자/세션 동시 접속 시 저장소 지연 시간 측정")
++    p.add_argument("--users", type=int, default=20)
++    p.add_argument("--sessions", type=int, default=3, help="사용자당 동시 세션 수")
++    p.add_argument("--reruns", type=int, default=50, help="세션당 화면 갱신 횟수")
++    p.add_argument("--days", type=int, default=365, help="사용자당 미리 채울 기록 일수")
++    p.add_argument("--pool-size", type=int, default=DB_POOL_SIZE)
++    p.add_argument("--write-behind", type=float, default=0.0, help="체크인 저장 write-behind 지연(초), 0이면 동기 저장")
++    p.set_defaults(func=cmd_bench_load)
++
++    p = sub.add_parser("bench-rerun", help="체크박스 클릭 1회당 스크립트 재실행 시간 (전체 탭 vs 선택 화면만)")
++    p.add_argument("--days", type=int, default=3650, help="미리 채울 기록 일수")
++    p.add_argument("--reruns", type=int, default=20)
++    p.set_defaults(func=cmd_bench_rerun)
++
++    p = sub.add_parser("bench-suite", help="기록 크기별 화면/상호작용 재실행 시간과 최대 메모리 (외부 API는 로컬 스텁)")
++    p.add_argument("--sizes", type=int, nargs="+", default=list(BENCH_SIZES), help="기록 일수 목록")
++    p.add_argument("--reruns", type=int, default=10, help="상호작용당 재실행 횟수")
++    p.add_argument("--out", help="결과 JSON 저장 경로 (회귀 비교용)")
++    p.set_defaults(func=cmd_bench_suite)
++
++    p = sub.add_parser("bench-fanout", help="느린 스텁 업스트림으로 리포트 입력 차례 호출 vs 병렬 호출 시간 비교")
++    p.add_argument("--delay-ms", type=float, default=300.0, help="스텁 업스트림 요청당 지연")
++    p.add_argument("--runs", type=int, default=5, help="모드별 측정 횟수 (워밍업 1회 별도)")
++    p.add_argument("--probe", action="store_true", help=argparse.SUPPRESS)
++    p.set_defaults(func=cmd_bench_fanout)
++
++    p = sub.add_parser("check-openai-paths", help="가짜 OpenAI 서버로 호출 경로 감지/고정 동작 점검 (Responses/Chat 조합)")
++    p.set_defaults(func=cmd_check_openai_paths)
++
++    p = sub.add_parser("check-batch-reports", help="가짜 OpenAI/날씨/강아지 서버로 batch-reports 전체 흐름 점검")
++    p.set_defaults(func=cmd_check_batch_reports)
++
++    p = sub.add_parser("check-import-budget", help="새 프로세스의 import 시간 예산과 무거운 의존성 지연 import 점검")
++    p.add_argument("--budget-ms", type=float, default=IMPORT_BUDGET_MS, help="최상위 import 누적 시간 상한")
++    p.add_argument("--runs", type=int, default=3, help="측정 횟수 (가장 빠른 회차로 판정)")
++    p.add_argument("--probe", action="store_true", help=argparse.SUPPRESS)
++    p.add_argument("--probe-view", action="store_true", help=argparse.SUPPRESS)
++    p.set_defaults(func=cmd_check_import_budget)
++
++    p = sub.add_parser("export-history", help="기록을 CSV/JSONL/Parquet으로 청크 단위 내보내기")
++    p.add_argument("path", help="출력 파일 (- 이면 표준 출력, 이때는 --format 필요)")
++    p.add_argument("--format", choices=HISTORY_IO_FORMATS, help="기본: 확장자로 판단")
++    p.add_argument("--user", action="append", help="대상 사용자 (여러 번 지정 가능, 기본: 전체)")
++    p.add_argument("--chunk-size", type=int, default=HISTORY_IO_CHUNK)
++    p.set_defaults(func=cmd_export_history)
++
++    p = sub.add_parser("import-history", help="CSV/JSONL/Parquet 기록 가져오기 (검증, 날짜별 중복 제거, 배치 upsert)")
++    p.add_argument("path")
++    p.add_argument("--format", choices=HISTORY_IO_FORMATS, help="기본: 확장자로 판단")
++    p.add_argument("--user", help="모든 행을 이 사용자로 가져오기 (기본: 파일의 user_id 열)")
++    p.add_argument("--chunk-size", type=int, default=HISTORY_IO_CHUNK)
++    p.set_defaults(func=cmd_import_history)
++
++    p = sub.add_parser("batch-reports", help="모든 사용자의 오늘 리포트를 미리 생성해 리포트 캐시에 저장")
++    p.add_argument("--date", help="기록 날짜 (YYYY-MM-DD, 기본: 오늘)")
++    p.add_argument("--user", action="append", help="대상 사용자 (여러 번 지정 가능, 기본: 전체)")
++    p.add_argument("--openai-key", default="", help="기본: OPENAI_API_KEY 환경 변수")
++    p.add_argument("--owm-key", default="", help="기본: OWM_API_KEY 환경 변수")
++    p.add_argument("--concurrency", type=int, default=4, help="동시 OpenAI 호출 수")
++    p.add_argument("--rps", type=float, default=2.0, help="초당 최대 OpenAI 호출 수")
++    p.set_defaults(func=cmd_batch_reports)
++
++    args = parser.parse_args(argv)
++    return args.func(args)
++
++
++if CLI_MODE:
++    raise SystemExit(cli_main(sys.argv[1:]))
++
++
++# -----------------------------
 +# 메인 UI
  # -----------------------------
++with st.sidebar:
++    st.subheader("👤 사용자")
++    if logged_in_user_id():
++        st.caption(f"로그인 계정: {st.session_state.user_id}")
++        st.button("로그아웃", on_click=logout)
++    elif USER_MODE == "login":
++        st.button("로그인", on_click=st.login, type="primary")
++    elif USER_MODE == "dev":
++        st.text_input("사용자 ID", key="user_id", help="개발 모드: 같은 ID로 접속하면 기록과 설정을 이어서 사용합니다.")
++        st.caption("⚠️ 개발 모드: ID만 알면 누구나 그 기록을 볼 수 있습니다. 공유 배포에서는 login 모드를 쓰세요.")
++    else:
++        st.caption("1인용 모드 · 여러 사용자는 `HABIT_TRACKER_USER_MODE=login`(st.login 설정 필요)")
++
++if USER_MODE == "login" and not logged_in_user_id():
++    # 공유 배포: 계정 없이는 어떤 사용자의 기록도 읽거나 쓰지 않는다
++    st.info("로그인하면 내 습관 기록과 설정을 불러옵니다. 사이드바의 **로그인** 버튼을 누르세요.")
++    st.stop()
++
++_import_prewarmer()
++_weather_prefetcher()
++_dog_pool()
++_metrics_writer()
++
++user_id = str(st.session_state.user_id).strip() or DEFAULT_USER_ID
++service = HabitService(_history_store(), user_id, _day_writer())
++today = datetime.now().date()
++
++if st.session_state.get("loaded_user_id") != user_id:
++    # 사용자 전환(또는 첫 접속): 이전 사용자의 대기 중인 저장은 바로 쓰게 하고,
++    # 저장된 오늘 기록과 설정으로 화면 상태를 다시 채운다
++    if service.writer is not None and st.session_state.get("loaded_user_id"):
++        service.writer.request_flush()
++    service.seed_demo_if_empty()
++    settings = service.settings()
++    saved_today = service.day(today)
++    saved_habits = habits_from_mask(saved_today["habit_mask"]) if saved_today else {}
++    st.session_state.today_record = {
++        "habits": {key: bool(saved_habits.get(key, False)) for key, _, _ in HABITS},
++        "mood": int(saved_today["mood"]) if saved_today and saved_today["mood"] is not None else 7,
++        "city": settings.get("city", "Seoul"),
++        "coach_style": settings.get("coach_style", "따뜻한 멘토"),
++    }
++    for widget_key in [f"habit_{key}" for key, _, _ in HABITS] + ["mood_slider", "city_select", "coach_style_radio"]:
++        st.session_state.pop(widget_key, None)
++    st.session_state.pop("report_cache", None)
++    st.session_state.saved_settings = settings
++    st.session_state.loaded_user_id = user_id
++    if USER_MODE == "dev" and not logged_in_user_id():
++        st.query_params["user"] = user_id
++
  record = st.session_state.today_record
 -
 -st.subheader("✅ 오늘의 체크인")
@@ -337,6 +4238,13 @@ index bf85c2e77c3dd41f9a304cb5e131777fbfac5e88..2a7353db828ee980db43cfbc8db804a0
 -# -----------------------------
 -# 달성률 + 메트릭
 -# -----------------------------
++# 위젯 값은 위젯을 그리기 전에 이미 session_state에 들어 있다: 어느 화면이든 이번 실행의 값으로 요약한다
++for key, _, _ in HABITS:
++    if f"habit_{key}" in st.session_state:
++        record["habits"][key] = bool(st.session_state[f"habit_{key}"])
++for field, widget_key in (("mood", "mood_slider"), ("city", "city_select"), ("coach_style", "coach_style_radio")):
++    if widget_key in st.session_state:
++        record[field] = st.session_state[widget_key]
  done_cnt, pct = calc_achievement(record["habits"])
  
 -m1, m2, m3 = st.columns(3, gap="medium")
@@ -357,11 +4265,24 @@ index bf85c2e77c3dd41f9a304cb5e131777fbfac5e88..2a7353db828ee980db43cfbc8db804a0
      "done": done_cnt,
      "pct": (done_cnt / 5) * 100,
      "mood": record["mood"],
++    "habit_mask": habit_mask(record["habits"]),
  }
-+history_rows = list(st.session_state.history)
- chart_rows = history_rows + [today_row]
- df = pd.DataFrame(chart_rows)
-+streak = calc_streak(chart_rows)
+-chart_rows = history_rows + [today_row]
++history = service.columns()
++
++# 저장된 오늘 행 대신 아직 저장 전인 화면 값(today_row)을 붙여서 사용
++week = history.range(today - timedelta(days=6), today - timedelta(days=1)).with_day(today_row)
+-df = pd.DataFrame(chart_rows)
++# 주/월 롤업도 같은 방식으로 맞춘다: 저장된 오늘 행을 빼고 화면 값을 더한다
++stored_today = history.range(today, today)
++saved_today_row = (
++    {"pct": float(stored_today.pct[0]), "mood": int(stored_today.mood[0]) or None,
++     "habit_mask": int(stored_today.mask[0])}
++    if len(stored_today)
++    else None
++)
++streak = service.streak(done_cnt > 0)
++longest_streak = max(streak, service.longest_streak())
  
 -st.subheader("📈 최근 7일 달성 현황")
 -c_chart, c_note = st.columns([1.2, 0.8], gap="large")
@@ -378,11 +4299,10 @@ index bf85c2e77c3dd41f9a304cb5e131777fbfac5e88..2a7353db828ee980db43cfbc8db804a0
 -    st.write(f"- 오늘 달성률: **{pct:.0f}%**")
 -    st.write("- 아래 버튼으로 오늘 기록을 저장하고 AI 리포트를 생성할 수 있습니다.")
 +if "report_cache" not in st.session_state:
-+    st.session_state.report_cache = {"weather": None, "dog": None, "text": None}
++    st.session_state.report_cache = {
++        "weather": None, "dog": None, "text": None, "ttft_s": None, "cached_at": None, "fallback": False
++    }
  
-+tab_home, tab_habits, tab_calendar, tab_report, tab_api = st.tabs(
-+    ["🏠 홈", "✅ 습관", "🗓️ 캘린더", "🧾 리포트", "ℹ️ API"]
-+)
  
 -# -----------------------------
 -# 결과 표시: 버튼 / 카드 / 리포트 / 공유 텍스트
@@ -431,7 +4351,63 @@ index bf85c2e77c3dd41f9a304cb5e131777fbfac5e88..2a7353db828ee980db43cfbc8db804a0
 -        mood=record["mood"],
 -        weather=weather_data,
 -        dog=dog_data,
-+with tab_home:
++# -----------------------------
++# 화면(뷰)
++# -----------------------------
++def period_rollups(period: str, start: date) -> List[Dict]:
++    # start부터 오늘이 속한 기간까지의 롤업 (빈 기간 포함, 현재 기간은 화면 값 반영)
++    by_start = {r["start"]: r for r in service.rollups(period, start, today)}
++    current = period_start(today, period)
++    by_start[current] = rollup_with_day(by_start.get(current), current, saved_today_row, today_row)
++    out, cursor = [], period_start(start, period)
++    while cursor <= current:
++        out.append(by_start.get(cursor) or empty_rollup(cursor))
++        cursor = cursor + timedelta(days=7) if period == "week" else (cursor + timedelta(days=32)).replace(day=1)
++    return out
++
++
++def _pct_label(value: Optional[float]) -> str:
++    return f"{value:.0f}%" if value is not None else "-"
++
++
++def _pct_delta(now: Optional[float], prev: Optional[float], label: str) -> Optional[str]:
++    return f"{now - prev:+.0f}%p ({label} 대비)" if now is not None and prev is not None else None
++
++
++def week_frame() -> pd.DataFrame:
++    # 최근 7일 차트용 DataFrame은 그 차트를 그리는 화면에서만 만든다 (체크인 화면은 pandas 없이)
++    with timed("chart_frame"):
++        return week.frame()
++
++
++def render_period_cards() -> None:
++    # 주/월 롤업 몇 행만 읽는다 (원본 일별 기록을 훑지 않음)
++    last_week, this_week = period_rollups("week", today - timedelta(days=7))[-2:]
++    last_month, this_month = period_rollups("month", (today.replace(day=1) - timedelta(days=1)))[-2:]
++    w_now, w_prev = rollup_pct(this_week), rollup_pct(last_week)
++    m_now, m_prev = rollup_pct(this_month), rollup_pct(last_month)
++    mood = rollup_mood(this_month)
++    k1, k2, k3, k4 = st.columns(4)
++    k1.metric("이번 주 평균", _pct_label(w_now), _pct_delta(w_now, w_prev, "지난 주"))
++    k2.metric("이번 달 평균", _pct_label(m_now), _pct_delta(m_now, m_prev, "지난 달"))
++    k3.metric("이번 달 기록", f"{this_month['days']}일", f"지난 달 {last_month['days']}일", delta_color="off")
++    k4.metric("이번 달 평균 기분", f"{mood:.1f}/10" if mood is not None else "-")
++
++
++def render_rollup_summary(rollup: Dict, label: str) -> None:
++    if not rollup["days"]:
++        st.caption(f"{label}: 기록 없음")
++        return
++    mood = rollup_mood(rollup)
++    habits = " · ".join(f"{emoji} {count}일" for (_, emoji, _), count in zip(HABITS, rollup["habits"]))
++    st.caption(
++        f"{label}: 기록 {rollup['days']}일 · 평균 달성률 {rollup_pct(rollup):.0f}%"
++        + (f" · 평균 기분 {mood:.1f}" if mood is not None else "")
++        + f" · {habits}"
++    )
++
++
++def render_home_tab() -> None:
 +    st.markdown("### 오늘의 요약")
 +    h1, h2, h3, h4 = st.columns([1, 1, 1, 1], gap="large")
 +    h1.markdown(
@@ -439,7 +4415,7 @@ index bf85c2e77c3dd41f9a304cb5e131777fbfac5e88..2a7353db828ee980db43cfbc8db804a0
 +        unsafe_allow_html=True,
 +    )
 +    h2.markdown(
-+        f"<div class='card'><h4>연속 기록</h4><div style='font-size:28px;font-weight:700'>{streak}일</div><div class='muted'>끊기지 않게 이어가기</div></div>",
++        f"<div class='card'><h4>연속 기록</h4><div style='font-size:28px;font-weight:700'>{streak}일</div><div class='muted'>최장 {longest_streak}일 · 끊기지 않게 이어가기</div></div>",
 +        unsafe_allow_html=True,
      )
 +    h3.markdown(
@@ -451,13 +4427,33 @@ index bf85c2e77c3dd41f9a304cb5e131777fbfac5e88..2a7353db828ee980db43cfbc8db804a0
 +        unsafe_allow_html=True,
 +    )
 +
++    analytics = cached_analytics(user_id, service.revision())
++
++    st.markdown("### 기간 요약")
++    render_period_cards()
++
 +    st.markdown("### 주간 흐름")
 +    c_chart, c_note = st.columns([1.2, 0.8], gap="large")
 +    with c_chart:
-+        df_plot = df.set_index("date")[["pct"]]
-+        st.bar_chart(df_plot, height=260)
++        df = week_frame()
++        st.bar_chart(df[["pct"]], height=260)
++        import pandas as pd
++
++        weeks = period_rollups("week", today - timedelta(weeks=11))
++        st.caption("주별 평균 달성률 (최근 12주, 기록한 날 기준)")
++        st.bar_chart(
++            pd.DataFrame(
++                {"avg_pct": [rollup_pct(w) or 0.0 for w in weeks]},
++                index=pd.DatetimeIndex([w["start"] for w in weeks], name="week"),
++            ),
++            height=160,
++        )
++        trend = analytics["trend"]
++        if not trend.empty:
++            st.caption("이동 평균 달성률 (최근 90일, 미기록일은 0%)")
++            st.line_chart(trend.tail(90)[["avg_7d", "avg_30d"]], height=180)
 +    with c_note:
-+        best_day = df.loc[df["pct"].idxmax(), "date"]
++        best_day = df["pct"].idxmax().strftime("%Y-%m-%d")
 +        st.markdown(
 +            f"""
 +<div class='card'>
@@ -469,117 +4465,246 @@ index bf85c2e77c3dd41f9a304cb5e131777fbfac5e88..2a7353db828ee980db43cfbc8db804a0
 +""",
 +            unsafe_allow_html=True,
 +        )
++        habit_rates = analytics["habit_rates"]
++        if not habit_rates.empty:
++            trend = analytics["trend"]
++            best_weekday = analytics["weekday"]["전체"].idxmax()
++            mood_corr = analytics["mood_corr"]
++            mood_line = f"{mood_corr:+.2f}" if mood_corr is not None else "데이터 부족"
++            st.markdown(
++                f"""
++<div class='card' style='margin-top:12px'>
++  <h4>누적 인사이트</h4>
++  <p class='muted'>최근 7일 / 30일 평균: <strong>{trend['avg_7d'].iloc[-1]:.0f}% / {trend['avg_30d'].iloc[-1]:.0f}%</strong></p>
++  <p class='muted'>가장 잘 지킨 습관: <strong>{habit_rates.idxmax()}</strong> ({habit_rates.max():.0f}%)</p>
++  <p class='muted'>보완이 필요한 습관: <strong>{habit_rates.idxmin()}</strong> ({habit_rates.min():.0f}%)</p>
++  <p class='muted'>가장 잘 되는 요일: <strong>{best_weekday}요일</strong> · 기분-달성률 상관: <strong>{mood_line}</strong></p>
++</div>
++""",
++                unsafe_allow_html=True,
++            )
++
++    st.markdown("### 요일별 습관 달성률")
++    render_weekday_heatmap(analytics["weekday"])
++
++
++@st.fragment
++def render_checkin() -> None:
++    # 체크/기분 변경은 이 조각만 다시 실행된다 (차트·캘린더·분석은 전체 재실행 때만 갱신)
++    st.markdown("#### 🧩 습관 목록")
++    c1, c2 = st.columns(2, gap="medium")
++    for idx, (key, emoji, label) in enumerate(HABITS):
++        target_col = c1 if idx % 2 == 0 else c2
++        with target_col:
++            record["habits"][key] = st.checkbox(
++                f"{emoji} {label}",
++                value=bool(record["habits"].get(key, False)),
++                key=f"habit_{key}",
++            )
++
++    st.markdown("#### 🙂 기분")
++    record["mood"] = st.slider(
++        "오늘 기분은 몇 점인가요?",
++        min_value=1,
++        max_value=10,
++        value=int(record.get("mood", 7)),
++        key="mood_slider",
++    )
++
++    done_now, pct_now = calc_achievement(record["habits"])
++    s1, s2, s3 = st.columns(3)
++    s1.metric("오늘 달성률", f"{pct_now:.0f}%", f"{done_now}/{len(HABITS)} 습관", delta_color="off")
++    s2.metric("연속 기록", f"{service.streak(done_now > 0)}일")
++    s3.metric("오늘 기분", f"{record['mood']}/10")
 +
-+with tab_habits:
++
++@st.fragment
++def render_settings() -> None:
++    st.markdown("#### 🌍 환경 설정")
++    record["city"] = st.selectbox(
++        "도시 선택",
++        options=CITIES,
++        index=CITIES.index(record.get("city", "Seoul")) if record.get("city", "Seoul") in CITIES else 0,
++        key="city_select",
++    )
++    record["coach_style"] = st.radio(
++        "코치 스타일",
++        options=list(COACH_STYLES.keys()),
++        index=list(COACH_STYLES.keys()).index(record.get("coach_style", "따뜻한 멘토"))
++        if record.get("coach_style", "따뜻한 멘토") in COACH_STYLES else 1,
++        key="coach_style_radio",
++    )
++    st.caption(COACH_STYLES.get(record["coach_style"], ""))
++    current_settings = {"city": record["city"], "coach_style": record["coach_style"]}
++    if current_settings != st.session_state.saved_settings:
++        service.save_settings(current_settings)
++        st.session_state.saved_settings = current_settings
++
++
++def render_habits_tab() -> None:
 +    st.markdown("### ✅ 오늘의 습관 체크")
 +    col_a, col_b = st.columns([1.3, 1.0], gap="large")
 +
 +    with col_a:
-+        st.markdown("#### 🧩 습관 목록")
-+        c1, c2 = st.columns(2, gap="medium")
-+        for idx, (key, emoji, label) in enumerate(HABITS):
-+            target_col = c1 if idx % 2 == 0 else c2
-+            with target_col:
-+                record["habits"][key] = st.checkbox(
-+                    f"{emoji} {label}",
-+                    value=bool(record["habits"].get(key, False)),
-+                    key=f"habit_{key}",
-+                )
-+
-+        st.markdown("#### 🙂 기분")
-+        record["mood"] = st.slider(
-+            "오늘 기분은 몇 점인가요?",
-+            min_value=1,
-+            max_value=10,
-+            value=int(record.get("mood", 7)),
-+            key="mood_slider",
-+        )
++        render_checkin()
 +
 +    with col_b:
-+        st.markdown("#### 🌍 환경 설정")
-+        record["city"] = st.selectbox(
-+            "도시 선택",
-+            options=CITIES,
-+            index=CITIES.index(record.get("city", "Seoul")) if record.get("city", "Seoul") in CITIES else 0,
-+            key="city_select",
-+        )
-+        record["coach_style"] = st.radio(
-+            "코치 스타일",
-+            options=list(COACH_STYLES.keys()),
-+            index=list(COACH_STYLES.keys()).index(record.get("coach_style", "따뜻한 멘토"))
-+            if record.get("coach_style", "따뜻한 멘토") in COACH_STYLES else 1,
-+            key="coach_style_radio",
-+        )
-+        st.caption(COACH_STYLES.get(record["coach_style"], ""))
++        render_settings()
 +        st.markdown(
 +            "<div class='card'><h4>오늘의 체크 팁</h4><p class='muted'>습관 체크는 <strong>오늘 목표를 완료한 후</strong>에 눌러 주세요. 작은 완료 표시가 큰 동기부여가 됩니다.</p></div>",
 +            unsafe_allow_html=True,
 +        )
 +
-+with tab_calendar:
++
++def render_calendar_tab() -> None:
 +    st.markdown("### 🗓️ 달력 기반 습관 기록")
-+    month_options = [
-+        datetime.now(),
-+        datetime.now() - timedelta(days=30),
-+        datetime.now() - timedelta(days=60),
-+    ]
-+    month_labels = [d.strftime("%Y-%m") for d in month_options]
-+    selected = st.selectbox("월 선택", month_labels, index=0)
-+    focus_date = datetime.strptime(f"{selected}-01", "%Y-%m-%d")
-+    render_calendar(chart_rows, focus_date)
++    this_month = today.strftime("%Y-%m")
++    month_labels = [this_month] + [m for m in service.months() if m != this_month]
++    view_mode = st.radio("보기", ["월간", "연간"], horizontal=True, key="calendar_view")
++    if view_mode == "월간":
++        selected = st.selectbox("월 선택", month_labels, index=0)
++        focus_date = datetime.strptime(f"{selected}-01", "%Y-%m-%d")
++        month_cols = history.month(focus_date.year, focus_date.month)
++        if selected == this_month:
++            month_cols = month_cols.with_day(today_row)
++        render_calendar(month_cols, focus_date)
++        month_start = focus_date.date()
++        if selected == this_month:
++            render_rollup_summary(period_rollups("month", month_start)[-1], "이 달")
++        else:
++            render_rollup_summary(service.rollup("month", month_start) or empty_rollup(month_start), "이 달")
++    else:
++        year_labels = sorted({m[:4] for m in month_labels}, reverse=True)
++        selected_year = int(st.selectbox("연도 선택", year_labels, index=0))
++        year_cols = history.range(date(selected_year, 1, 1), date(selected_year, 12, 31))
++        if selected_year == today.year:
++            year_cols = year_cols.with_day(today_row)
++        render_calendar_year(year_cols, selected_year)
++        import pandas as pd
++
++        year_rollups = service.rollups("month", date(selected_year, 1, 1), date(selected_year, 12, 31))
++        months = {r["start"].month: r for r in year_rollups}
++        if selected_year == today.year:
++            current = period_start(today, "month")
++            months[today.month] = rollup_with_day(months.get(today.month), current, saved_today_row, today_row)
++        st.caption("월별 평균 달성률 (기록한 날 기준)")
++        st.bar_chart(
++            pd.DataFrame(
++                {"avg_pct": [rollup_pct(months.get(m)) or 0.0 for m in range(1, 13)]},
++                index=[f"{m:02d}월" for m in range(1, 13)],
++            ),
++            height=180,
++        )
 +    st.markdown("### 📈 최근 7일 달성 현황")
-+    st.bar_chart(df.set_index("date")[["pct"]], height=220)
++    st.bar_chart(week_frame()[["pct"]], height=220)
++    with st.expander("📦 기록 내보내기 / 가져오기"):
++        io_format = st.radio("파일 형식", HISTORY_IO_FORMATS, horizontal=True, key="history_io_format")
++        st.download_button(
++            f"전체 기록 내보내기 (.{io_format})",
++            data=functools.partial(service.export_history, io_format),
++            file_name=f"habit_history_{today:%Y%m%d}.{io_format}",
++            mime=HISTORY_IO_MIME[io_format],
++            on_click="ignore",
++        )
++        uploaded = st.file_uploader(
++            "기록 파일 가져오기", type=["csv", "jsonl", "ndjson", "parquet"], key="history_upload",
++            help="같은 날짜의 기록은 파일 내용으로 덮어씁니다. 파일의 user_id 열은 무시하고 현재 사용자로 가져옵니다.",
++        )
++        if uploaded is not None and st.button("가져오기", key="history_import"):
++            try:
++                with st.spinner("기록을 가져오는 중..."):
++                    st.session_state.history_import_result = service.import_history(
++                        uploaded, history_format(uploaded.name)
++                    )
++            except RuntimeError as exc:
++                st.error(f"가져오기를 하지 않았습니다: {exc}")
++            except (ValueError, OSError) as exc:
++                st.error(f"파일을 읽을 수 없습니다: {exc}")
++            else:
++                st.rerun()
++        result = st.session_state.pop("history_import_result", None)
++        if result is not None:
++            st.success(
++                f"{result['written']}일 저장 · 읽은 행 {result['rows']} · 중복 {result['duplicates']} · "
++                f"오류 {result['invalid']}"
++            )
++            for error in result["errors"]:
++                st.caption(error)
++
 +
-+with tab_report:
++def render_report_tab() -> None:
 +    st.markdown("### 🧾 컨디션 리포트")
 +    btn_col1, btn_col2 = st.columns([0.25, 0.75], gap="medium")
 +    with btn_col1:
 +        generate_clicked = st.button("컨디션 리포트 생성", use_container_width=True)
 +    status_area = btn_col2.empty()
 +
++    report_stream: Optional[ReportStream] = None
 +    if generate_clicked:
-+        updated = False
-+        for row in st.session_state.history:
-+            if row.get("date") == _today_str():
-+                row.update(today_row)
-+                updated = True
-+                break
-+        if not updated:
-+            st.session_state.history.append(today_row)
-+        st.session_state.history = st.session_state.history[-7:]
++        service.save_day(today_row)
 +
 +        with status_area:
 +            st.info("날씨/강아지 데이터를 불러오고 AI 리포트를 생성합니다...")
 +
-+        weather_data = get_weather(record["city"], owm_api_key)
-+        dog_data = get_dog_image()
-+        report_text = generate_report(
-+            openai_key=openai_api_key,
-+            coach_style=record["coach_style"],
-+            habit_state=record["habits"],
-+            mood=record["mood"],
-+            weather=weather_data,
-+            dog=dog_data,
-+        )
++        digest = history_digest(history, today, done_cnt > 0)
++        usage = None
++        pregen = None
++        if openai_api_key:
++            fingerprint = report_fingerprint(
++                record["city"], record["coach_style"], record["habits"], record["mood"], digest
++            )
++            pregen = load_pregenerated_report(user_id, today_row["date"], fingerprint)
++        if pregen is not None:
++            # 아침 배치가 지금과 같은 입력으로 만들어 둔 리포트: 외부 호출 없이 바로 보여 준다
++            weather_data, dog_data = pregen["weather"], pregen["dog"]
++            report_text, cached_at = pregen["text"], pregen["created_at"]
++        elif stream_report and openai_api_key:
++            deadline = time.monotonic() + REPORT_DEADLINE_S
++            weather_data, dog_data = fetch_report_inputs(record["city"], owm_api_key, deadline)
++            report_stream = stream_coach_report(
++                openai_key=openai_api_key,
++                coach_style=record["coach_style"],
++                habit_state=record["habits"],
++                mood=record["mood"],
++                weather=weather_data,
++                dog=dog_data,
++                deadline_s=max(1.0, deadline - time.monotonic()),
++                digest=digest,
++            )
++            report_text = cached_at = None
++        else:
++            weather_data, dog_data, report_text, cached_at, usage = fetch_report_bundle(
++                city=record["city"],
++                owm_key=owm_api_key,
++                openai_key=openai_api_key,
++                coach_style=record["coach_style"],
++                habit_state=record["habits"],
++                mood=record["mood"],
++                digest=digest,
++            )
++
++        used_template = bool(openai_api_key) and report_stream is None and report_text is None
++        if used_template:
++            report_text = template_report(record["coach_style"], record["habits"], record["mood"], weather_data, dog_data)
 +
 +        st.session_state.report_cache = {
 +            "weather": weather_data,
 +            "dog": dog_data,
 +            "text": report_text,
++            "ttft_s": None,
++            "cached_at": cached_at,
++            "fallback": used_template,
++            "usage": usage,
++            "prompt_tokens_est": prompt_token_estimate(
++                _report_messages(record["coach_style"], record["habits"], record["mood"], weather_data, dog_data, digest)
++            ),
 +        }
- 
+-
 -    with status_area:
 -        if not openai_api_key:
 -            st.warning("OpenAI API Key가 필요합니다. 사이드바에 입력하세요.")
 -        elif report_text is None:
 -            st.error("AI 리포트 생성에 실패했습니다. 키/네트워크/모델 설정을 확인하세요.")
-+        with status_area:
-+            if not openai_api_key:
-+                st.warning("OpenAI API Key가 필요합니다. 사이드바에 입력하세요.")
-+            elif report_text is None:
-+                st.error("AI 리포트 생성에 실패했습니다. 키/네트워크/모델 설정을 확인하세요.")
-+            else:
-+                st.success("리포트 생성 완료")
 +
 +    weather_data = st.session_state.report_cache.get("weather")
 +    dog_data = st.session_state.report_cache.get("dog")
@@ -597,6 +4722,8 @@ index bf85c2e77c3dd41f9a304cb5e131777fbfac5e88..2a7353db828ee980db43cfbc8db804a0
 +            st.write(
 +                f"- 습도: **{weather_data.get('humidity', '')}%** / 바람: **{weather_data.get('wind_ms', '')} m/s**"
 +            )
++            if weather_data.get("fallback"):
++                st.caption("날씨 서버 응답이 없어 마지막으로 받은 날씨를 표시합니다.")
 +        elif generate_clicked:
 +            st.caption("날씨 정보를 가져오지 못했습니다(키/도시/네트워크 확인).")
          else:
@@ -632,7 +4759,9 @@ index bf85c2e77c3dd41f9a304cb5e131777fbfac5e88..2a7353db828ee980db43cfbc8db804a0
 +        st.markdown("#### 🐶 오늘의 강아지")
 +        if dog_data:
 +            st.write(f"- 품종(추정): **{dog_data.get('breed', 'Unknown')}**")
-+            st.image(dog_data.get("url", ""), use_container_width=True)
++            st.image(dog_image_src(dog_data), use_container_width=True)
++            if dog_data.get("fallback"):
++                st.caption("강아지 서버 응답이 없어 내장 이미지를 표시합니다.")
 +        elif generate_clicked:
 +            st.caption("강아지 이미지를 가져오지 못했습니다(네트워크 확인).")
 +        else:
@@ -642,8 +4771,51 @@ index bf85c2e77c3dd41f9a304cb5e131777fbfac5e88..2a7353db828ee980db43cfbc8db804a0
 -st.markdown("#### 🤖 AI 코치 리포트")
 -if generate_clicked:
 +    st.markdown("#### 🤖 AI 코치 리포트")
++    if report_stream is not None:
++        st.write_stream(report_stream)
++        report_text = report_stream.text
++        if report_text is None:
++            report_text = template_report(record["coach_style"], record["habits"], record["mood"], weather_data, dog_data)
++            st.markdown(report_text)
++        st.session_state.report_cache.update(
++            text=report_text,
++            ttft_s=report_stream.ttft_s,
++            cached_at=report_stream.cached_at,
++            fallback=report_stream.text is None,
++            usage=report_stream.usage or None,
++        )
++    elif report_text:
++        st.markdown(report_text)
++    report_cache = st.session_state.report_cache
++    if report_text and not report_cache.get("fallback") and report_cache.get("prompt_tokens_est"):
++        usage = report_cache.get("usage")
++        if usage:
++            usage_line = f"실제 입력 {usage['prompt_tokens']} / 출력 {usage['completion_tokens']} 토큰"
++        elif report_cache.get("cached_at"):
++            usage_line = "캐시된 리포트라 추가 토큰 없음"
++        else:
++            usage_line = "실제 사용량 정보 없음"
++        st.caption(f"프롬프트 약 {report_cache['prompt_tokens_est']}토큰 (예산 {REPORT_PROMPT_TOKENS}) · {usage_line}")
++
++    if generate_clicked:
++        with status_area:
++            if not openai_api_key:
++                st.warning("OpenAI API Key가 필요합니다. 사이드바에 입력하세요.")
++            elif report_text is None:
++                st.error("AI 리포트 생성에 실패했습니다. 키/네트워크/모델 설정을 확인하세요.")
++            elif st.session_state.report_cache.get("fallback"):
++                st.warning("AI 리포트를 받지 못해 기본 템플릿 리포트를 표시합니다. 잠시 후 다시 시도하세요.")
++            else:
++                st.success("리포트 생성 완료")
++
      if report_text:
-         st.markdown(report_text)
+-        st.markdown(report_text)
++        cached_at = st.session_state.report_cache.get("cached_at")
++        ttft_s = st.session_state.report_cache.get("ttft_s")
++        if cached_at is not None:
++            st.caption(f"💾 저장된 리포트 재사용 · {_format_age(time.time() - cached_at)} 생성 (API 호출 없음)")
++        elif ttft_s is not None:
++            st.caption(f"⏱️ 첫 토큰까지 {ttft_s:.2f}초 (스트리밍)")
  
 -        # 공유용 텍스트
 -        share_lines = []
@@ -675,7 +4847,8 @@ index bf85c2e77c3dd41f9a304cb5e131777fbfac5e88..2a7353db828ee980db43cfbc8db804a0
 -# API 안내 (expander)
 -# -----------------------------
 -with st.expander("📌 API 안내 / 트러블슈팅"):
-+with tab_api:
++
++def render_api_tab() -> None:
 +    st.markdown("### 📌 API 안내 / 트러블슈팅")
      st.markdown(
          """
@@ -683,19 +4856,129 @@ index bf85c2e77c3dd41f9a304cb5e131777fbfac5e88..2a7353db828ee980db43cfbc8db804a0
    - 키 발급: OpenWeatherMap 계정 생성 후 API Key 생성
    - 호출: `api.openweathermap.org/data/2.5/weather?q={city}&appid={key}&units=metric&lang=kr`
    - 본 앱은 **섭씨(metric)**, **한국어(lang=kr)** 로 요청합니다. (timeout=10)
++  - 도시별 결과는 모든 세션이 공유하는 캐시에 10분간 보관됩니다.
++  - 외부 호출은 keep-alive 커넥션 풀(재시도 2회, 지터 백오프)을 공유합니다.
  
  - **Dog CEO**
    - 랜덤 이미지: `https://dog.ceo/api/breeds/image/random` (timeout=10)
    - 품종은 이미지 URL 경로에서 **추정**합니다.
++  - 백그라운드에서 강아지 몇 마리를 미리 받아 두고(축소 이미지는 디스크에 저장), 리포트는 그중 하나를 바로 꺼내 씁니다.
  
  - **OpenAI**
    - 모델: `gpt-5-mini`
    - SDK 버전에 따라 Responses API 또는 Chat Completions로 호출합니다.
++  - 처음 한 번 동작하는 경로를 감지해 키·모델별로 기억합니다. `HABIT_OPENAI_API_PATH=responses|chat`으로 고정할 수 있습니다.
++  - 클라이언트는 키별로 한 번 만들어 재사용합니다. (timeout=30)
++  - 사이드바의 **리포트 스트리밍 출력**을 켜면 토큰이 생성되는 대로 표시하고, 첫 토큰까지의 시간을 보여줍니다.
++  - 같은 입력(코치/습관/기분/날씨/강아지)의 리포트는 로컬 SQLite 캐시에서 재사용합니다.
++    (`HABIT_REPORT_CACHE_FRESH_S`, 기본 6시간)
++  - 리포트 프롬프트에는 지난 기록 요약(연속 기록, 추세, 가장 약한 습관 등)을 `HABIT_REPORT_PROMPT_TOKENS`
++    (기본 700토큰) 예산 안에서만 붙입니다. `HABIT_REPORT_MAX_OUTPUT_TOKENS`로 출력 토큰 상한을 둘 수 있습니다.
    - 실패 시: 키/네트워크/모델 접근 권한을 확인하세요.
++  - 외부 서버가 느리거나 멈추면 회로 차단기가 열려 바로 폴백합니다: 마지막으로 받은 날씨, 내장 강아지 이미지,
++    템플릿 리포트. `HABIT_BREAKER_OPEN_S`(기본 30초) 뒤 시험 호출 1건으로 회복을 확인합니다.
  
  - **배포 팁**
    - Streamlit Cloud 사용 시: `st.secrets["OPENAI_API_KEY"]` 같은 방식으로 키를 보관하세요.
++  - 여러 사람이 쓰는 배포는 `HABIT_TRACKER_USER_MODE=login`으로 `st.login()` 계정별로 기록을 나눕니다
++    (`.streamlit/secrets.toml`의 `[auth]` 설정 필요). 기본값 `single`은 1인용, `dev`는 ID 직접 입력(개발용)입니다.
++  - 습관 기록과 리포트 캐시는 `HABIT_TRACKER_DATA_DIR`(기본 `.habit_tracker/`)의 SQLite 파일에 저장됩니다.
++    오늘 기록 저장은 백그라운드에서 모아 쓰며(`HABIT_WRITE_BEHIND_S`, 기본 0.5초, 0이면 바로 저장),
++    로그아웃·사용자 전환·프로세스 정상 종료 때 남은 저장을 바로 씁니다. 대기 행이 `HABIT_WRITE_BEHIND_MAX_PENDING`
++    (기본 1000)에 차면 새 저장은 기다리지 않고 바로 씁니다. 내보내기/가져오기는 남은 저장을
++    `HABIT_WRITE_BEHIND_FLUSH_TIMEOUT_S`(기본 10초)까지 기다리고, 그때까지 못 쓰면 실행하지 않습니다.
++  - 화면은 선택한 메뉴만 실행합니다. `HABIT_TRACKER_NAV=tabs`로 모든 탭을 매번 그리는 방식으로 바꿀 수 있습니다.
++  - 아래 **개발자 패널**에서 주요 호출의 p50/p95/p99를 볼 수 있습니다. `HABIT_METRICS_TEXTFILE` 경로를 지정하면
++    같은 지표를 Prometheus 텍스트 형식으로 주기적으로 기록합니다 (node_exporter textfile collector용).
  """
      )
++    weather_stats = _weather_cache().stats()
++    st.caption(
++        f"날씨 캐시: {weather_stats['size']}개 도시 · hit {weather_stats['hits']} / "
++        f"stale {weather_stats['stale_hits']} / miss {weather_stats['misses']} / 대기 합류 {weather_stats['coalesced']}"
++    )
++    if openai_api_key:
++        st.caption(f"OpenAI 호출 경로: {_api_paths().describe(openai_api_key)} · `HABIT_OPENAI_API_PATH`로 고정 가능")
++    breaker_states = {name: breaker.status() for name, breaker in _breakers().items()}
++    st.caption(
++        "회로 차단기: "
++        + " · ".join(
++            f"{name} {s['state']} (차단 {s['rejected']}회, 열림 {s['trips']}회)" for name, s in breaker_states.items()
++        )
++    )
++    day_writer = _day_writer()
++    if day_writer is not None:
++        writer_status = day_writer.status()
++        st.caption(
++            f"체크인 저장(write-behind): 대기 {writer_status['pending']}행 · 배치 {writer_status['batches']}회 · "
++            f"저장 {writer_status['rows_written']}행 · 합침 {writer_status['coalesced']}회 · "
++            f"직접 저장(큐 가득 참) {writer_status['sync_writes']}회 · 오류 {writer_status['errors']}회"
++        )
++    dog_pool = _dog_pool()
++    if dog_pool is None:
++        st.caption("강아지 풀: 꺼짐 (HABIT_DOG_POOL_SIZE 환경 변수로 켤 수 있습니다)")
++    else:
++        dog_status = dog_pool.status()
++        st.caption(
++            f"강아지 풀: 준비 {dog_status['ready']}/{DOG_POOL_SIZE} (썸네일 {dog_status['thumbs']}) · "
++            f"채움 {dog_status['refills']}회 · 오류 {dog_status['errors']}회"
++        )
++    prefetcher = _weather_prefetcher()
++    if prefetcher is None:
++        st.caption("날씨 사전 갱신: 꺼짐 (OWM_API_KEY와 HABIT_WEATHER_PREFETCH_S 환경 변수로 켤 수 있습니다)")
++    else:
++        prefetch_status = prefetcher.status()
++        last_round = prefetch_status["last_round_at"]
++        st.caption(
++            f"날씨 사전 갱신: {WEATHER_PREFETCH_S:.0f}초 주기 · {prefetch_status['rounds']}회 완료 · "
++            f"오류 {prefetch_status['errors']}회"
++            + (f" · 마지막 갱신 {_format_age(time.time() - last_round)}" if last_round else "")
++        )
++
++    if st.toggle("🔧 개발자 패널 (계측)", key="dev_panel", help="이 프로세스에서 측정한 지연 시간·캐시 적중률·오류 수"):
++        metrics = _metrics()
++        summary = metrics.summary()
++        if summary:
++            import pandas as pd
++
++            st.dataframe(pd.DataFrame(summary).set_index("name"), use_container_width=True)
++        else:
++            st.caption("아직 측정된 호출이 없습니다.")
++        cache_lines = [
++            f"{cache}: {events['hits'] / (events['hits'] + events['misses']) * 100:.0f}% "
++            f"(hit {events['hits']} / miss {events['misses']})"
++            for cache, events in metrics.cache_stats().items()
++            if events["hits"] + events["misses"]
++        ]
++        st.caption("캐시 적중률 · " + (" · ".join(cache_lines) if cache_lines else "기록 없음"))
++        token_lines = [
++            f"{name}: {t['calls']}회 · 입력 평균 {t['prompt_tokens'] / t['calls']:.0f} / 출력 평균 {t['completion_tokens'] / t['calls']:.0f}"
++            for name, t in metrics.token_stats().items()
++        ]
++        st.caption("LLM 토큰 · " + (" · ".join(token_lines) if token_lines else "기록 없음"))
++        st.download_button(
++            "Prometheus 텍스트 내보내기",
++            data=metrics.prometheus_text(),
++            file_name="habit_tracker_metrics.prom",
++            mime="text/plain",
++        )
++
++
++# 기본(lazy)은 선택한 화면 하나만 실행한다. HABIT_TRACKER_NAV=tabs 이면 예전처럼 모든 탭을 매번 그린다.
++NAV_MODE = os.environ.get("HABIT_TRACKER_NAV", "lazy")
++VIEWS = {
++    "🏠 홈": render_home_tab,
++    "✅ 습관": render_habits_tab,
++    "🗓️ 캘린더": render_calendar_tab,
++    "🧾 리포트": render_report_tab,
++    "ℹ️ API": render_api_tab,
++}
++if NAV_MODE == "tabs":
++    for tab, render_view in zip(st.tabs(list(VIEWS)), VIEWS.values()):
++        with tab:
++            render_view()
++else:
++    view = st.radio("화면", list(VIEWS), horizontal=True, key="view", label_visibility="collapsed")
++    VIEWS[view]()
 
 